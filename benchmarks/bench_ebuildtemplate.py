@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+#-*- coding:utf-8 -*-
+# vim:ai:sta:et:ts=4:sw=4:sts=4
+
+"""Benchmarks for kernelng's ebuild template renderer.
+
+Renders the default ng-sources and no-sources templates for a few thousand
+synthetic kernel sources ebuilds, printing the time taken and the rate in
+ebuilds per second, along with the time taken to compile the templates.
+Portage is not needed.  Run from anywhere:
+
+    python benchmarks/bench_ebuildtemplate.py [-n REPEAT] [-e EBUILDS]
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import timeit
+from argparse import ArgumentParser
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from kernelng.ebuildtemplate import DEFAULT_TEMPLATES, EbuildTemplate
+from kernelng.overlay import KernelSource, GeneratedEbuild, render_ebuild
+
+def ebuilds(n):
+    result = []
+    for i in range(n):
+        pn = 'flavor%d-sources' % (i % 40)
+        pvr = '3.%d.%d' % (i // 40 % 20, i // 800)
+        source = KernelSource('gentoo', '/usr/portage', 'sys-kernel/' + pn, pn, pvr,
+            ('%032x' % i, 'kernel-2\t%032x' % i),
+            ('5', pvr, '~amd64 ~x86', 'Full sources for the "%s" kernel' % pn,
+             'https://www.kernel.org/', 'GPL-2'))
+        for flavor, name in (('ng', 'kernelng_' + pn), ('no', 'no_' + pn)):
+            result.append(GeneratedEbuild(flavor, 'sys-kernel/' + name,
+                'sys-kernel/%s/%s-%s.ebuild' % (name, name, pvr), source, None))
+    return result
+
+def main():
+    p = ArgumentParser(description='Benchmark kernelng ebuild template rendering.')
+    p.add_argument('-n', '--repeat', type=int, default=5, help='Best of this many runs.')
+    p.add_argument('-e', '--ebuilds', type=int, default=5000, help='Ebuilds to render per run.')
+    args = p.parse_args()
+
+    t = min(timeit.repeat(lambda: [EbuildTemplate(text) for text in DEFAULT_TEMPLATES.values()],
+        number=1, repeat=args.repeat))
+    print('compile %d templates: %.3f ms' % (len(DEFAULT_TEMPLATES), t * 1000))
+
+    templates = dict((flavor, EbuildTemplate(text)) for flavor, text in DEFAULT_TEMPLATES.items())
+    work = ebuilds(args.ebuilds // 2)
+    t = min(timeit.repeat(lambda: [render_ebuild(ebuild, templates[ebuild.flavor]) for ebuild in work],
+        number=1, repeat=args.repeat))
+    print('render %d ebuilds: %.3f ms (%.0f ebuilds/s)' % (len(work), t * 1000, len(work) / t))
+
+if __name__ == '__main__':
+    main()
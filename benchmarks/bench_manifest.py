@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+#-*- coding:utf-8 -*-
+# vim:ai:sta:et:ts=4:sw=4:sts=4
+
+"""Benchmarks for kernelng's in-process Manifest generation.
+
+Writes a synthetic overlay of a few hundred packages of generated-size
+ebuilds into a temporary directory and makes the Manifest text of every
+package, serially and on a thread pool, printing the time taken and the
+rate in packages per second.  Portage is not needed.  Run from anywhere:
+
+    python benchmarks/bench_manifest.py [-n REPEAT] [-p PACKAGES] [-v VERSIONS] [-j JOBS]
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import shutil
+import timeit
+import tempfile
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from kernelng.manifest import package_manifest
+
+DISTS = dict(('linux-3.%d.tar.xz' % i,
+    'DIST linux-3.%d.tar.xz 76000000 BLAKE2B %s SHA512 %s' % (i, 'ab' * 64, 'cd' * 64))
+    for i in range(20))
+
+def overlay(root, packages, versions):
+    pkgdirs = []
+    for i in range(packages):
+        pkgdir = os.path.join(root, 'sys-kernel', 'flavor%d-sources' % i)
+        os.makedirs(pkgdir)
+        for j in range(versions):
+            with open(os.path.join(pkgdir, 'flavor%d-sources-3.%d.ebuild' % (i, j)), 'w') as f:
+                f.write('# %d %d\n' % (i, j) + 'x' * 470 + '\n')
+        pkgdirs.append(pkgdir)
+    return pkgdirs
+
+def main():
+    p = ArgumentParser(description='Benchmark kernelng Manifest generation.')
+    p.add_argument('-n', '--repeat', type=int, default=5, help='Best of this many runs.')
+    p.add_argument('-p', '--packages', type=int, default=400, help='Packages in the overlay.')
+    p.add_argument('-v', '--versions', type=int, default=19, help='Ebuilds per package.')
+    p.add_argument('-j', '--jobs', type=int, default=os.cpu_count() or 1, help='Worker threads.')
+    args = p.parse_args()
+
+    root = tempfile.mkdtemp(prefix='bench_manifest.')
+    try:
+        pkgdirs = overlay(root, args.packages, args.versions)
+        t = min(timeit.repeat(lambda: [package_manifest(pkgdir, DISTS) for pkgdir in pkgdirs],
+            number=1, repeat=args.repeat))
+        print('serial: %d packages: %.3f ms (%.0f packages/s)' % (
+            len(pkgdirs), t * 1000, len(pkgdirs) / t))
+        with ThreadPoolExecutor(max_workers=args.jobs) as pool:
+            t = min(timeit.repeat(lambda: list(pool.map(lambda pkgdir: package_manifest(pkgdir, DISTS),
+                pkgdirs)), number=1, repeat=args.repeat))
+        print('%d jobs: %d packages: %.3f ms (%.0f packages/s)' % (
+            args.jobs, len(pkgdirs), t * 1000, len(pkgdirs) / t))
+    finally:
+        shutil.rmtree(root)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+#-*- coding:utf-8 -*-
+# vim:ai:sta:et:ts=4:sw=4:sts=4
+
+"""Benchmarks for kernelng's ANSI-aware text wrapping.
+
+Wraps long, heavily styled help- and report-like text at a few widths and
+sizes, printing the time per kilobyte of input at each size: as wrapping is
+meant to be linear in the size of its input, that figure should stay flat as
+the input grows.  Also times kngwrap_text and the rendering of every help
+page in the kernelng command tree, with and without the wrap cache.  Run from anywhere:
+
+    python benchmarks/bench_textwrap.py [-n REPEAT]
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import random
+import timeit
+from argparse import ArgumentParser
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ['KERNELNG_NO_HELP_CACHE'] = '1'
+
+import click
+
+from kernelng.kngtextwrapper import KNGTextWrapper, set_wrap_cache_enabled
+from kernelng.kngclick import kngwrap_text
+
+WORDS = ('kernel-ng overlay configuration package sys-kernel/gentoo-sources '
+    'the a of to is --install -i repos.conf ng-sources 3.15.2-r1 settings '
+    'portage eclass generated mirror site-specific dependency.').split()
+# localized (wide and combining) text, as a translated help page would carry
+WIDE_WORDS = ('カーネル オーバーレイ 設定 パッケージ 生成 커널 설정 内核 配置 '
+    'le re\u0301pertoire cre\u0301e\u0301 --install sys-kernel/ng-sources').split()
+STYLES = ({'fg': 'white', 'bold': True}, {'fg': 'yellow', 'bold': True},
+    {'fg': 'blue', 'bold': True}, {'fg': 'cyan'}, {'fg': 'red', 'bold': True})
+SIZES = (1, 4, 16, 64)
+WIDTHS = (40, 78, 118)
+
+def styled_text(words, styled_fraction, seed=0, vocabulary=WORDS):
+    rnd = random.Random(seed)
+    out = []
+    for i in range(words):
+        word = rnd.choice(vocabulary)
+        if rnd.random() < styled_fraction:
+            word = click.style(word, **rnd.choice(STYLES))
+        out.append(word)
+    return ' '.join(out)
+
+def bench(label, text, width, repeat):
+    wrapper = KNGTextWrapper(width=width)
+    t = min(timeit.repeat(lambda: wrapper.wrap(text), number=1, repeat=repeat))
+    kb = len(text.encode('utf-8')) / 1024.0
+    print('  %-28s width %3d  %8.1f KiB  %9.3f ms  %8.3f ms/KiB' % (
+        label, width, kb, t * 1000, t * 1000 / kb))
+
+def bench_stream(paragraphs, width, repeat):
+    wrapper = KNGTextWrapper(width=width)
+    t_list = min(timeit.repeat(lambda: [wrapper.wrap(p) for p in paragraphs],
+        number=1, repeat=repeat))
+    t_first = min(timeit.repeat(lambda: next(wrapper.iterwrap(iter(paragraphs))),
+        number=1, repeat=repeat))
+    t_all = min(timeit.repeat(lambda: sum(1 for line in wrapper.iterwrap(iter(paragraphs))),
+        number=1, repeat=repeat))
+    print('  %d paragraphs, width %d: wrap %.3f ms, iterwrap first line %.3f ms, all %.3f ms' % (
+        len(paragraphs), width, t_list * 1000, t_first * 1000, t_all * 1000))
+
+def bench_help(repeat):
+    from kernelng.scripts.kernelng import cli
+    from kernelng.kngclick import KNGContext
+    def pages(cmd, parent=None, name='kernelng'):
+        ctx = KNGContext(cmd, info_name=name, parent=parent)
+        yield ctx
+        if isinstance(cmd, click.MultiCommand):
+            for sub in cmd.list_commands(ctx):
+                for page in pages(cmd.get_command(ctx, sub), ctx, sub):
+                    yield page
+    contexts = list(pages(cli))
+    t = min(timeit.repeat(lambda: [ctx.get_help() for ctx in contexts], number=1, repeat=repeat))
+    print('  %d help pages: %.3f ms' % (len(contexts), t * 1000))
+
+def main():
+    p = ArgumentParser(description='Benchmark kernelng text wrapping.')
+    p.add_argument('-n', '--repeat', type=int, default=5, help='Best of this many runs.')
+    args = p.parse_args()
+
+    for styled_fraction, label in ((0.0, 'plain'), (0.5, 'half styled'), (1.0, 'fully styled')):
+        print('%s report text:' % label)
+        for width in WIDTHS:
+            for size in SIZES:
+                bench('%dx' % size, styled_text(500 * size, styled_fraction), width, args.repeat)
+
+    print('half styled localized text:')
+    for width in WIDTHS:
+        for size in SIZES:
+            bench('%dx' % size, styled_text(500 * size, 0.5, vocabulary=WIDE_WORDS),
+                width, args.repeat)
+
+    print('streamed report (one paragraph per package):')
+    bench_stream([styled_text(12, 0.3, seed=n) for n in range(5000)], 78, args.repeat)
+
+    text = '\n\n'.join(styled_text(120, 0.3, seed=n) for n in range(40))
+    for enabled in (False, True):
+        set_wrap_cache_enabled(enabled)
+        print('wrap cache %s:' % ('enabled' if enabled else 'disabled'))
+        t = min(timeit.repeat(lambda: kngwrap_text(text, 78, preserve_paragraphs=True),
+            number=1, repeat=args.repeat))
+        print('  40 styled help paragraphs (kngwrap_text): %.3f ms' % (t * 1000))
+        bench_help(args.repeat)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+#-*- coding:utf-8 -*-
+# vim:ai:sta:et:ts=4:sw=4:sts=4
+
+"""kernelng 0.x
+ Tool for maintaining customized overlays of kernel-ng.eclass-based ebuilds
+
+Copyright 2005-2014 Gentoo Foundation
+
+        Copyright (C) 2014 Gregory M. Turner <gmt@be-evil.net>
+
+Distributed under the terms of the GNU General Public License v2
+ This program is free software; you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, version 2 of the License.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program; if not, write to the Free Software
+ Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA 02110-1301, USA.
+
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import json
+import array
+import signal
+import socket
+
+# The kernelng command-line entry point.  When a "kernelng serve" server is
+# listening, the command line is forwarded to it, along with our standard
+# streams, and it runs the command for us with everything (click, the
+# configuration, portage) already loaded; otherwise the command runs right here
+# in-process as usual.  So that forwarding stays cheap, this module must import
+# nothing beyond the standard library until it knows it needs to.
+
+# eprefixifiable dummy value.  Unlike kernelng.config, we must not go asking
+# portage about it, as importing portage is precisely what we are avoiding.
+EPREFIX = "@GENTOO_PORTAGE_EPREFIX@"
+if EPREFIX == "@GENTOO_%s_EPREFIX@" % "PORTAGE":
+    EPREFIX = os.environ.get('PORTAGE_OVERRIDE_EPREFIX', '')
+
+SOCKET_NAME = 'serve.sock'
+SYSTEM_SOCKET_DIR = '%s/run/kernel-ng' % EPREFIX
+
+# Commands which never go to the server: "serve" itself.  Which command a
+# command line runs is found by stepping over the global options before it,
+# the only ones of which taking a separate value are VALUE_OPTIONS (see
+# kngclick.kngcommandcommon, which we must not import).
+LOCAL_ONLY_COMMANDS = frozenset(('serve',))
+VALUE_OPTIONS = frozenset(('--buffering', '--log-format', '--metrics-file'))
+
+def top_level_command(args):
+    '''
+    Returns the name of the top-level subcommand the command line args (sans
+    program name) would run, or None if it names none.
+    '''
+    args = iter(args)
+    for arg in args:
+        if arg == '--':
+            return next(args, None)
+        if arg in VALUE_OPTIONS:
+            next(args, None)
+        elif arg == '-' or not arg.startswith('-'):
+            return arg
+    return None
+
+def default_socket_path():
+    '''
+    The socket "kernelng serve" listens on: $KERNELNG_SOCKET if set, else a
+    system-wide location for root and a per-user one for everyone else.
+    '''
+    if os.environ.get('KERNELNG_SOCKET'):
+        return os.environ['KERNELNG_SOCKET']
+    if os.geteuid() == 0:
+        return os.path.join(SYSTEM_SOCKET_DIR, SOCKET_NAME)
+    rundir = os.environ.get('XDG_RUNTIME_DIR')
+    if rundir:
+        return os.path.join(rundir, 'kernelng', SOCKET_NAME)
+    return os.path.join('/tmp', 'kernelng-%d' % os.geteuid(), SOCKET_NAME)
+
+def send_message(sock, message, fds=None):
+    '''
+    Sends one newline-terminated JSON message, optionally passing file
+    descriptors along with it.
+    '''
+    data = (json.dumps(message) + '\n').encode('utf-8')
+    if fds:
+        sock.sendmsg([data], [(socket.SOL_SOCKET, socket.SCM_RIGHTS, array.array('i', fds))])
+    else:
+        sock.sendall(data)
+
+def _messages(sock):
+    '''
+    Yields the newline-terminated JSON messages arriving on sock until EOF.
+    '''
+    pending = b''
+    while True:
+        chunk = sock.recv(4096)
+        if not chunk:
+            return
+        pending += chunk
+        while b'\n' in pending:
+            line, pending = pending.split(b'\n', 1)
+            yield json.loads(line.decode('utf-8'))
+
+def _connect(path):
+    # never hand our streams to a socket belonging to somebody else
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    if st.st_uid != os.geteuid():
+        return None
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except OSError:
+        sock.close()
+        return None
+    return sock
+
+def _kill(pid, signum):
+    try:
+        os.kill(pid, signum)
+    except ProcessLookupError:
+        # already finished; its status is on its way
+        pass
+
+def forward(argv, path=None):
+    '''
+    Runs the command line argv in a "kernelng serve" server, if one is
+    listening, and returns its exit status.  Returns None, without having
+    done anything, if there is no server to run it.
+    '''
+    if top_level_command(argv[1:]) in LOCAL_ONLY_COMMANDS or os.environ.get('KERNELNG_NO_SERVER'):
+        return None
+    sock = _connect(path or default_socket_path())
+    if sock is None:
+        return None
+
+    umask = os.umask(0)
+    os.umask(umask)
+    with sock:
+        send_message(sock, {
+            'argv': list(argv),
+            'cwd': os.getcwd(),
+            'env': dict(os.environ),
+            'umask': umask,
+        }, fds=[0, 1, 2])
+
+        # ^C and friends are delivered to us, not to the server: pass them on
+        # to the process running our command and let it exit as it sees fit.
+        # Any arriving before we know which process that is are held until
+        # we do.
+        pid = []
+        pending = []
+        def relay(signum, frame):
+            if pid:
+                _kill(pid[0], signum)
+            else:
+                pending.append(signum)
+        for signum in (signal.SIGINT, signal.SIGTERM, signal.SIGHUP):
+            signal.signal(signum, relay)
+
+        status = None
+        for message in _messages(sock):
+            if 'pid' in message:
+                pid[:] = [message['pid']]
+                while pending:
+                    _kill(pid[0], pending.pop(0))
+            if 'status' in message:
+                status = message['status']
+    if status is None:
+        sys.stderr.write('kernelng: lost contact with the kernelng server\n')
+        return 1
+    return status
+
+def main():
+    status = forward(sys.argv)
+    if status is None:
+        from .scripts.kernelng import cli
+        cli()
+    else:
+        sys.exit(status)
@@ -35,26 +35,69 @@ from itertools import chain, islice, count, repeat
 import click
 from click._compat import iteritems
 
-from .output import has_verbose_level, echov, sechov, trace, suppress_tracing
+from .output import has_verbose_level, echov, echo_data, sechov, trace, suppress_tracing, kngstyle
+from .utils import file_stamp
+from . import metrics
 
-import portage
+# n.b.: portage is expensive to import and most commands (not to mention
+# --help) never need it, so nothing here may import it at module load time.
 
-try:
-    portage.proxy.lazyimport.lazyimport(globals(),
-        'portage.data:portage_uid,portage_gid')
-except ImportError:
-    portage_uid = 250
-    portage_gid = 250
+_portage_ids = None
+
+def portage_ids():
+    '''
+    Returns the (uid, gid) tuple of the portage user and group, importing
+    portage on first use.  Falls back to 250/250 if portage is unavailable.
+    '''
+    global _portage_ids
+    if _portage_ids is None:
+        try:
+            from portage.data import portage_uid, portage_gid
+            # these int casts resolve the portage proxies into integers and
+            # are required in recent python3's
+            _portage_ids = (int(portage_uid), int(portage_gid))
+        except ImportError:
+            _portage_ids = (250, 250)
+    return _portage_ids
+
+_portage_dbapi = None
+
+def portage_dbapi(reload=False):
+    '''
+    Returns portage's porttree dbapi for the configured root, importing and
+    initializing portage on first use, or None if portage is unavailable.  The
+    handle is kept for the life of the process (which, under "kernelng serve,"
+    is the life of the server) unless reload is True, in which case portage's
+    global state is reinitialized and a fresh handle obtained.
+    '''
+    global _portage_dbapi
+    if reload and _portage_dbapi is not None:
+        import portage
+        reset = getattr(portage, '_reset_legacy_globals', None)
+        if reset is not None:
+            reset()
+        _portage_dbapi = None
+    if _portage_dbapi is None:
+        try:
+            import portage
+        except ImportError:
+            return None
+        _portage_dbapi = portage.db[portage.root]['porttree'].dbapi
+    return _portage_dbapi
 
 # eprefixifiable dummy value
 EPREFIX = "@GENTOO_PORTAGE_EPREFIX@"
 
-# non-eprefixified fallback behavior: ask portage or assume empty
+# non-eprefixified fallback behavior: honor portage's own override variable,
+# otherwise ask portage or assume empty
 if EPREFIX == "@GENTOO_%s_EPREFIX@" % "PORTAGE":
-    try:
-        from portage.const import EPREFIX as _EPREFIX
-    except ImportError:
-        _EPREFIX = ''
+    if 'PORTAGE_OVERRIDE_EPREFIX' in os.environ:
+        _EPREFIX = os.environ['PORTAGE_OVERRIDE_EPREFIX']
+    else:
+        try:
+            from portage.const import EPREFIX as _EPREFIX
+        except ImportError:
+            _EPREFIX = ''
     EPREFIX = _EPREFIX
 
 PROGNAME = sys.argv[0].split(os.path.sep)[-1] if len(sys.argv) >= 1 else 'kernelng'
@@ -81,6 +124,16 @@ KERNELNG_CONF_FILE = ''.join((
     KERNELNG_CONF,
 ))
 
+# caches (the completion index, the kernel package index): system-wide ones
+# when run as root, per-user ones otherwise
+SYSTEM_CACHE_DIR = '%s/var/cache/%s' % (EPREFIX, FRAMEWORK)
+USER_CACHE_DIR = os.path.join(
+    os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache'),
+    'kernelng')
+
+def default_cache_dir():
+    return SYSTEM_CACHE_DIR if os.geteuid() == 0 else USER_CACHE_DIR
+
 CONST_RE = re.compile('%\([^)]*\)[^\W\d_]', re.UNICODE)
 SUBCONSTS = {
     'prog': PROGNAME,
@@ -90,8 +143,8 @@ SUBCONSTS = {
     'kngconffile': KERNELNG_CONF_FILE,
     'eprefix': EPREFIX,
     'lc': '%s%s' % (
-        click.style('LOADCONFIG', fg='blue', bold=True),
-        click.style(':', fg='white', bold=True)
+        kngstyle('LOADCONFIG', fg='blue', bold=True),
+        kngstyle(':', fg='white', bold=True)
     )
 }
 
@@ -110,6 +163,13 @@ def subconsts(text, subconsts=SUBCONSTS):
 # convenience alias
 _sc = subconsts
 
+def _lc():
+    # the %(lc)s prefix, styled (or not) according to the current log format
+    return '%s%s' % (
+        kngstyle('LOADCONFIG', fg='blue', bold=True),
+        kngstyle(':', fg='white', bold=True)
+    )
+
 class KNGConfigItemUnknownReason(Exception):
     def __init__(self, key, value, reason):
         super(KNGConfigItemUnknownReason, self).__init__(
@@ -436,6 +496,16 @@ def KNGExampleConfigData():
         '',
         ( 'overlay', 'site-%(framework)s', True ),
         '',
+        '# overlay_location',
+        '# ================',
+        '# default value: %(eprefix)s/usr/local/portage/site-%(framework)s',
+        '# scope: global only',
+        '#',
+        '# Filesystem location of the site-wide %(framework)s portage',
+        '# overlay.  "%(prog)s overlay update" generates its ebuilds here.',
+        '',
+        ( 'overlay_location', '%(eprefix)s/usr/local/portage/site-%(framework)s' ),
+        '',
         '# name_prefix',
         '# ==========',
         '# default value: %(prog)s_',
@@ -478,7 +548,10 @@ def KNGExampleConfigData():
         '# %(framework)s will not automatically maintain the repos.conf file;',
         '# otherwise, when the overlay is created, this file will be',
         '# automatically modified to activate the %(framework)s overlay in',
-        '# portage if and when the overlay is created.',
+        '# portage if and when the overlay is created, and "%(prog)s',
+        '# overlay destroy" will deactivate it again.  Either a file or',
+        '# a repos.conf directory will do; in a directory, the overlay',
+        '# gets a %(framework)s.conf file of its own.',
         '',
         ( 'repos_conf', '%(eprefix)s/etc/portage/repos.conf' ),
         '',
@@ -1003,6 +1076,11 @@ class KNGConfig(OrderedDict):
 
     @trace
     def loadExampleConfig(self):
+        with metrics.phase('config_load'):
+            self._loadExampleConfig()
+        self._countConfig()
+
+    def _loadExampleConfig(self):
         self.clear()
         ecd = KNGExampleConfigData()
         for key in ecd.keys():
@@ -1033,6 +1111,12 @@ class KNGConfig(OrderedDict):
                 else:
                     self[key].append(KNGConfigItem(item, daddy=self[key]))
 
+    def _countConfig(self):
+        # instrumentation: size of the configuration, for the metrics file
+        sections = [ items for items in self.values() if not items.fetal ]
+        metrics.set_count('config_sections', len(sections))
+        metrics.set_count('config_items', sum(len(list(items.iterkeys())) for items in sections))
+
     @property
     def globals(self):
         '''
@@ -1053,20 +1137,21 @@ class KNGConfig(OrderedDict):
         Write the currently loaded configuration to a given file.
 
         :param file: If provided, the output will be written into the provided click.File object.
-                     If not provided, output will go to standard output.
+                     If not provided, output will go to standard output (via the buffered
+                     output channel, but never as log records; see echo_data).
         '''
         keys = self.keys()
         for key in keys:
             vlist = self[key]
             if vlist and not vlist.fetal:
                 if key != 'implicit_global':
-                    click.echo('[%s]' % key, file=file)
+                    echo_data('[%s]' % key, file=file)
                 for item in vlist.iterexplicit():
                     if item.iscomment:
                         if not no_comments:
-                            click.echo(item.comment, file=file)
+                            echo_data(item.comment, file=file)
                     else:
-                        click.echo('%(itemkey)s = %(itemvalue)s' % { 'itemkey': item.key, 'itemvalue': item.value }, file=file)
+                        echo_data('%(itemkey)s = %(itemvalue)s' % { 'itemkey': item.key, 'itemvalue': item.value }, file=file)
 
     @trace
     def loadConfigText(self, file=None, dirty=False):
@@ -1081,9 +1166,16 @@ class KNGConfig(OrderedDict):
                       from the specified file.  This will overwrite any settings which conflict and
                       append any new settings values to the end of their corresponding sections.
         '''
+        with metrics.phase('config_load'):
+            self._loadConfigText(file)
+        self._countConfig()
+
+    def _loadConfigText(self, file):
         if file is None:
-            file = click.open_file(KERNELNG_CONF_FILE, mode='r')
-        with file:
+            file = self._kernelng_conf_file
+        if isinstance(file, str):
+            file = click.open_file(file, mode='r')
+        with file, metrics.phase('config_parse'):
             self.clear()
             section = 'implicit_global'
             for lineindex, line in enumerate((line.rstrip('\n') for line in file)):
@@ -1094,7 +1186,7 @@ class KNGConfig(OrderedDict):
                 if m:
                     section = m.group(1)
                     self[section].christen()
-                    echov(_sc('%s read section header: "%s"' % ('%(lc)s', click.style(section, fg='yellow', bold=True))), 2)
+                    echov('%s read section header: "%s"' % (_lc(), kngstyle(section, fg='yellow', bold=True)), 2)
                     continue
                 m = CONFIG_SETTING_RE.match(line)
                 if m:
@@ -1104,18 +1196,18 @@ class KNGConfig(OrderedDict):
                             '"%s", then re-assigned as "%s".' % (click.format_filename(file.name), lineindex, section,
                             key, self[section][key].value, val))
                     self[section][key] = val
-                    echov(_sc('%s loaded configuration setting: %s%s%s%s%s %s %s%s%s' % (
-                        '%(lc)s',
-                        click.style('[', fg='white', bold=True),
-                        click.style(section, fg='yellow', bold=True),
-                        click.style(']', fg='white', bold=True),
-                        click.style('.', fg='white', bold=True),
-                        click.style(key, fg='blue', bold=True),
-                        click.style('=', fg='white', bold=True),
-                        click.style('"', fg='white', bold=True),
-                        click.style(val, fg='blue', bold=True),
-                        click.style('"', fg='white', bold=True)
-                    )), 2)
+                    echov('%s loaded configuration setting: %s%s%s%s%s %s %s%s%s' % (
+                        _lc(),
+                        kngstyle('[', fg='white', bold=True),
+                        kngstyle(section, fg='yellow', bold=True),
+                        kngstyle(']', fg='white', bold=True),
+                        kngstyle('.', fg='white', bold=True),
+                        kngstyle(key, fg='blue', bold=True),
+                        kngstyle('=', fg='white', bold=True),
+                        kngstyle('"', fg='white', bold=True),
+                        kngstyle(val, fg='blue', bold=True),
+                        kngstyle('"', fg='white', bold=True)
+                    ), 2)
                     continue
                 raise SyntaxError('%s (line %s): Syntax error: "%s" unrecognized.' % (click.format_filename(file.name), lineindex, line))
 
@@ -1128,10 +1220,39 @@ class KNGConfig(OrderedDict):
 
     @trace
     def createOverlay(self, uid, gid, perm):
-        pass
+        '''
+        Creates and registers the overlay configured here (or, if it exists,
+        brings its ownership, permissions and registration into line).
+        Returns the (created, registered) pair of overlay.create_overlay.
+        '''
+        # (overlay imports us)
+        from .overlay import create_overlay
+        return create_overlay(self, uid, gid, perm)
 
     @trace
     def __missing__(self, index):
         rv=KNGConfigItems(fetal=True, daddy=self)
         self[index] = rv
         return rv
+
+_active_config = None
+_active_config_stamp = None
+
+@trace
+def active_config(kernelng_conf_file=KERNELNG_CONF_FILE):
+    '''
+    Returns the KNGConfig loaded from kernelng_conf_file, parsing it only when
+    the file has changed since the last call (or, if it does not exist, the
+    example configuration).  Callers must treat the result as read-only, as it
+    is shared by every caller in the process.
+    '''
+    global _active_config, _active_config_stamp
+    stamp = (kernelng_conf_file, file_stamp(kernelng_conf_file))
+    if _active_config is None or stamp != _active_config_stamp:
+        conf = KNGConfig(kernelng_conf_file=kernelng_conf_file)
+        if stamp[1] is None:
+            conf.loadExampleConfig()
+        else:
+            conf.loadConfigText(kernelng_conf_file)
+        _active_config, _active_config_stamp = conf, stamp
+    return _active_config
@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+#-*- coding:utf-8 -*-
+# vim:ai:sta:et:ts=4:sw=4:sts=4
+
+"""kernelng 0.x
+ Tool for maintaining customized overlays of kernel-ng.eclass-based ebuilds
+
+Copyright 2005-2014 Gentoo Foundation
+
+        Copyright (C) 2014 Gregory M. Turner <gmt@be-evil.net>
+
+Distributed under the terms of the GNU General Public License v2
+ This program is free software; you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, version 2 of the License.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program; if not, write to the Free Software
+ Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA 02110-1301, USA.
+
+"""
+
+
+from __future__ import print_function
+
+import os
+
+from .config import default_cache_dir
+from .jsoncache import JSONCache
+from .output import trace
+from . import metrics
+
+# Persistent cache of the digests of the files we hash for Manifests, keyed
+# by the (device, inode, size, mtime_ns) of the file, so that a file is only
+# read again once it has been replaced or modified.  The staged overlay is
+# made of hard links to the published one (see staging), so an unchanged
+# file keeps its key from one generation of the overlay to the next.  Each
+# entry also records a path at which the file was found, and entries whose
+# path no longer leads to the same file are evicted when the cache is saved.
+
+DIGEST_CACHE = 'digest-cache.json'
+CACHE_FORMAT = 1
+
+def file_key(st):
+    return '%d:%d:%d:%d' % (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+
+class DigestCache(JSONCache):
+    '''
+    The persisted cache.  get() and put() may be called from any thread;
+    save() writes the cache back if it has changed.
+    '''
+    KEY = 'entries'
+    FORMAT = CACHE_FORMAT
+    DESCRIPTION = 'digest cache'
+
+    def get(self, st, hashes):
+        '''
+        Returns the ((name, hexdigest), ...) of the file whose stat result is
+        st for each of the hash names in hashes, or None if any is unknown.
+        '''
+        entry = self._data.get(file_key(st))
+        if entry is not None:
+            digests = entry[1]
+            if all(name in digests for name in hashes):
+                metrics.count('digest_cache_hits')
+                return tuple((name, digests[name]) for name in hashes)
+        metrics.count('digest_cache_misses')
+        return None
+
+    def put(self, st, path, digests):
+        '''
+        Records the ((name, hexdigest), ...) digests of the file whose stat
+        result is st, to be found at path.
+        '''
+        key = file_key(st)
+        with self._lock:
+            entry = self._data.get(key)
+            known = dict(entry[1]) if entry is not None else {}
+            known.update(digests)
+            self._data[key] = [path, known]
+            self._dirty = True
+
+    def clear(self):
+        '''
+        Forgets every digest (so that everything is hashed afresh).
+        '''
+        with self._lock:
+            self._data, self._dirty = {}, True
+
+    @trace
+    def evict(self):
+        '''
+        Drops the entries whose recorded path no longer leads to the file
+        they describe.  Returns the number of entries dropped.
+        '''
+        with self._lock:
+            gone = []
+            for key, entry in self._data.items():
+                try:
+                    if file_key(os.stat(entry[0])) == key:
+                        continue
+                except OSError:
+                    pass
+                gone.append(key)
+            for key in gone:
+                del self._data[key]
+            if gone:
+                self._dirty = True
+        metrics.set_count('digest_cache_evictions', len(gone))
+        return len(gone)
+
+    @trace
+    def save(self):
+        '''
+        Evicts stale entries and atomically rewrites the cache file, if
+        anything has changed.
+        '''
+        if self._dirty:
+            self.evict()
+        super(DigestCache, self).save()
+
+_digest_cache = None
+
+@trace
+def digest_cache(path=None):
+    '''
+    Returns the process-wide DigestCache, loaded from path (by default, in
+    the cache directory) if it has changed on disk.
+    '''
+    global _digest_cache
+    if path is None:
+        path = os.path.join(default_cache_dir(), DIGEST_CACHE)
+    if _digest_cache is None or _digest_cache._path != path:
+        _digest_cache = DigestCache(path)
+    _digest_cache.load()
+    return _digest_cache
@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+#-*- coding:utf-8 -*-
+# vim:ai:sta:et:ts=4:sw=4:sts=4
+
+"""kernelng 0.x
+ Tool for maintaining customized overlays of kernel-ng.eclass-based ebuilds
+
+Copyright 2005-2014 Gentoo Foundation
+
+        Copyright (C) 2014 Gregory M. Turner <gmt@be-evil.net>
+
+Distributed under the terms of the GNU General Public License v2
+ This program is free software; you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, version 2 of the License.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program; if not, write to the Free Software
+ Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA 02110-1301, USA.
+
+"""
+
+from __future__ import print_function
+
+import os
+
+from .config import EKERNELNG_CONF_DIR
+from .output import trace
+from .utils import file_stamp
+
+# Templates of the ebuilds generated into the overlay, one per flavor.  A
+# template is the ebuild text with "@NAME@" slots (as in the eprefixify
+# convention), NAME being one of TEMPLATE_SLOTS; "@@" stands for a literal
+# "@".  Each template is split into literal and slot pieces once, when it is
+# loaded, so rendering one is a list copy, a few stores and a join.  A site
+# may replace either template by dropping a file of the same name into
+# TEMPLATE_DIR.
+
+TEMPLATE_DIR = os.path.join(EKERNELNG_CONF_DIR, 'templates')
+
+TEMPLATE_SLOTS = frozenset((
+    'MARKER',           # the "generated by" comment identifying our ebuilds
+    'FRAMEWORK',        # kernel-ng (the eclass)
+    'FLAVOR',           # ng or no
+    'NAME',             # the name of the generated package
+    'UPSTREAM',         # the upstream category/package-version
+    'UPSTREAM_PN',      # the upstream package name
+    'UPSTREAM_REPO',    # the upstream repository name
+    'UPSTREAM_EAPI',    # ... and the rest of the upstream metadata:
+    'PVR',
+    'DESCRIPTION',
+    'HOMEPAGE',
+    'LICENSE',
+    'SLOT',
+    'KEYWORDS',
+))
+
+TEMPLATE_FILES = {
+    'ng': 'ng-sources.ebuild',
+    'no': 'no-sources.ebuild',
+}
+
+DEFAULT_TEMPLATES = {
+    'ng': '''\
+# Distributed under the terms of the GNU General Public License v2
+@MARKER@ from @UPSTREAM@::@UPSTREAM_REPO@ -- do not edit.
+
+EAPI=5
+
+KERNEL_NG_FLAVOR="@FLAVOR@"
+KERNEL_NG_UPSTREAM="@UPSTREAM@"
+KERNEL_NG_UPSTREAM_REPO="@UPSTREAM_REPO@"
+
+inherit @FRAMEWORK@
+
+DESCRIPTION="@FRAMEWORK@ build of @UPSTREAM_PN@: @DESCRIPTION@"
+HOMEPAGE="@HOMEPAGE@"
+LICENSE="@LICENSE@"
+SLOT="@SLOT@"
+KEYWORDS="@KEYWORDS@"
+''',
+    'no': '''\
+# Distributed under the terms of the GNU General Public License v2
+@MARKER@ from @UPSTREAM@::@UPSTREAM_REPO@ -- do not edit.
+
+EAPI=5
+
+KERNEL_NG_FLAVOR="@FLAVOR@"
+KERNEL_NG_UPSTREAM="@UPSTREAM@"
+KERNEL_NG_UPSTREAM_REPO="@UPSTREAM_REPO@"
+
+inherit @FRAMEWORK@
+
+DESCRIPTION="@FRAMEWORK@ kernel from @UPSTREAM_PN@, without sources: @DESCRIPTION@"
+HOMEPAGE="@HOMEPAGE@"
+LICENSE="@LICENSE@"
+SLOT="@SLOT@"
+KEYWORDS="@KEYWORDS@"
+''',
+}
+
+class KNGTemplateError(Exception):
+    pass
+
+class EbuildTemplate(object):
+    '''
+    A template, compiled into alternating literal and slot pieces.
+    '''
+    @trace
+    def __init__(self, text, name='<template>'):
+        self.text = text
+        self.name = name
+        parts = text.split('@')
+        if len(parts) % 2 == 0:
+            raise KNGTemplateError('%s: unmatched "@" (write "@@" for a literal "@").' % name)
+        pieces, slots, literal = [], [], [parts[0]]
+        offset = len(parts[0])
+        for i in range(1, len(parts), 2):
+            slot = parts[i]
+            if not slot:
+                literal.append('@')
+            elif slot in TEMPLATE_SLOTS:
+                pieces.append(''.join(literal))
+                slots.append((len(pieces), slot))
+                pieces.append(None)
+                literal = []
+            else:
+                raise KNGTemplateError('%s, line %d: unknown slot "@%s@" (write "@@" for a '
+                    'literal "@").' % (name, text.count('\n', 0, offset) + 1, slot))
+            literal.append(parts[i + 1])
+            offset += len(slot) + len(parts[i + 1]) + 2
+        pieces.append(''.join(literal))
+        self._pieces = pieces
+        self._slots = tuple(slots)
+
+    def render(self, values):
+        '''
+        Returns the template text with each slot replaced by values[slot].
+        '''
+        pieces = self._pieces[:]
+        for index, slot in self._slots:
+            pieces[index] = values[slot]
+        return ''.join(pieces)
+
+_templates = None
+_templates_stamp = None
+
+@trace
+def ebuild_templates(template_dir=TEMPLATE_DIR):
+    '''
+    Returns the {flavor: EbuildTemplate} dict of the templates in effect: the
+    site's, from template_dir, where present, and the defaults otherwise.
+    They are compiled only when the site's templates have changed since the
+    last call.
+    '''
+    global _templates, _templates_stamp
+    paths = dict((flavor, os.path.join(template_dir, filename))
+        for flavor, filename in TEMPLATE_FILES.items())
+    stamp = tuple(sorted((flavor, path, file_stamp(path)) for flavor, path in paths.items()))
+    if _templates is None or stamp != _templates_stamp:
+        templates = {}
+        for flavor, path, path_stamp in stamp:
+            if path_stamp is None:
+                templates[flavor] = EbuildTemplate(DEFAULT_TEMPLATES[flavor],
+                    '<default %s template>' % TEMPLATE_FILES[flavor])
+            else:
+                with open(path) as f:
+                    templates[flavor] = EbuildTemplate(f.read(), path)
+        _templates, _templates_stamp = templates, stamp
+    return _templates
@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+#-*- coding:utf-8 -*-
+# vim:ai:sta:et:ts=4:sw=4:sts=4
+
+"""kernelng 0.x
+ Tool for maintaining customized overlays of kernel-ng.eclass-based ebuilds
+
+Copyright 2005-2014 Gentoo Foundation
+
+        Copyright (C) 2014 Gregory M. Turner <gmt@be-evil.net>
+
+Distributed under the terms of the GNU General Public License v2
+ This program is free software; you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, version 2 of the License.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program; if not, write to the Free Software
+ Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA 02110-1301, USA.
+
+"""
+
+
+from __future__ import print_function
+
+import os
+import json
+import threading
+
+from .output import echov, trace
+from .utils import file_stamp
+
+# Caches persisted between runs as a JSON file, {"format": FORMAT, KEY: data},
+# in the cache directory.  The file is only reread when its stamp (see
+# utils.file_stamp) has changed, and is rewritten atomically, by renaming a
+# temporary file into place.  A missing file, or one in another format, makes
+# for an empty cache.
+
+class JSONCache(object):
+    '''
+    A cache persisted at path.  Subclasses set KEY, FORMAT and DESCRIPTION
+    (for messages), keep their contents in self._data and set self._dirty
+    when they change them.
+    '''
+    KEY = 'data'
+    FORMAT = 1
+    DESCRIPTION = 'cache'
+
+    @trace
+    def __init__(self, path):
+        self._path = path
+        self._data = {}
+        self._dirty = False
+        self._stamp = None
+        self._lock = threading.Lock()
+
+    @trace
+    def load(self):
+        '''
+        (Re)loads the cache from its file, unless it is unchanged since we
+        last did.  A missing or unusable file makes for an empty cache.
+        '''
+        stamp = file_stamp(self._path)
+        if stamp is not None and stamp == self._stamp:
+            return
+        with self._lock:
+            self._data, self._dirty, self._stamp = {}, False, stamp
+            if stamp is None:
+                return
+            try:
+                with open(self._path) as f:
+                    data = json.load(f)
+                if data.get('format') == self.FORMAT:
+                    self._data = data[self.KEY]
+            except (IOError, OSError, ValueError, KeyError, AttributeError) as e:
+                echov('%s %s unusable (%s); starting afresh.' % (self.DESCRIPTION, self._path, e), 2)
+
+    @trace
+    def save(self):
+        '''
+        Atomically rewrites the cache file, if anything has changed.
+        '''
+        if not self._dirty:
+            return
+        dirname = os.path.dirname(self._path)
+        if not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        tmppath = '%s.%d.tmp' % (self._path, os.getpid())
+        try:
+            with open(tmppath, 'w') as f:
+                json.dump({'format': self.FORMAT, self.KEY: self._data}, f, separators=(',', ':'))
+            os.chmod(tmppath, 0o644)
+            os.rename(tmppath, self._path)
+        except Exception:
+            try:
+                os.unlink(tmppath)
+            except OSError:
+                pass
+            raise
+        self._dirty, self._stamp = False, file_stamp(self._path)
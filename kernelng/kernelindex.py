@@ -0,0 +1,234 @@
+#!/usr/bin/env python
+#-*- coding:utf-8 -*-
+# vim:ai:sta:et:ts=4:sw=4:sts=4
+
+"""kernelng 0.x
+ Tool for maintaining customized overlays of kernel-ng.eclass-based ebuilds
+
+Copyright 2005-2014 Gentoo Foundation
+
+        Copyright (C) 2014 Gregory M. Turner <gmt@be-evil.net>
+
+Distributed under the terms of the GNU General Public License v2
+ This program is free software; you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, version 2 of the License.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program; if not, write to the Free Software
+ Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA 02110-1301, USA.
+
+"""
+
+from __future__ import print_function
+
+import os
+import errno
+import hashlib
+
+from .config import default_cache_dir
+from .jsoncache import JSONCache
+from .output import trace
+from . import metrics
+
+# Index of the kernel sources packages (sys-kernel/*-sources) in each portage
+# repository, built from the repository's md5-cache metadata and persisted
+# between runs.  A repository's entry is trusted as long as its
+# metadata/timestamp.chk and the mtimes of its sys-kernel and md5-cache
+# directories are unchanged; otherwise, only packages whose directories'
+# mtimes changed are re-read.  Repositories without a timestamp.chk (i.e.,
+# local overlays, which may be edited in place) have their ebuilds' stamps
+# checked as well.  Where a cache entry is missing or stale (its _md5_ does
+# not match the ebuild), metadata comes from portage instead.
+
+KERNEL_CATEGORY = 'sys-kernel'
+SOURCES_SUFFIX = '-sources'
+
+KERNEL_INDEX = 'kernel-index.json'
+INDEX_FORMAT = 1
+
+# the metadata kept per ebuild, besides its _md5_ and _eclasses_
+METADATA_KEYS = ('EAPI', 'SLOT', 'KEYWORDS', 'DESCRIPTION', 'HOMEPAGE', 'LICENSE')
+
+# an ebuild's index entry: [stamp, md5, eclasses] + METADATA_KEYS values,
+# where stamp is the ebuild's (mtime_ns, size) and eclasses the _eclasses_
+# cache value (or, for metadata from portage, INHERITED)
+ENTRY_STAMP, ENTRY_MD5, ENTRY_ECLASSES, ENTRY_METADATA = 0, 1, 2, 3
+
+_WANTED = dict((key.encode('ascii'), key) for key in METADATA_KEYS + ('_eclasses_', '_md5_'))
+
+def parse_md5_cache(data):
+    '''
+    Returns a dict of the METADATA_KEYS, _eclasses_ and _md5_ values in
+    data, the (bytes) contents of an md5-cache entry.  Other keys are
+    skipped without being decoded.
+    '''
+    result = {}
+    for line in data.split(b'\n'):
+        key, sep, value = line.partition(b'=')
+        if sep and key in _WANTED:
+            result[_WANTED[key]] = value.decode('utf-8', 'replace')
+    return result
+
+def _read(path):
+    # a plain read() of the whole file; md5-cache entries and ebuilds are
+    # small enough that this beats mmap()ing them
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        chunks = []
+        while True:
+            chunk = os.read(fd, 65536)
+            if not chunk:
+                return b''.join(chunks)
+            chunks.append(chunk)
+    finally:
+        os.close(fd)
+
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+def _timestamp(tree):
+    try:
+        return _read(os.path.join(tree, 'metadata', 'timestamp.chk')).decode('utf-8', 'replace')
+    except OSError:
+        return None
+
+def eclass_names(entry):
+    '''
+    Returns the list of eclasses inherited by the ebuild of the index entry.
+    '''
+    eclasses = entry[ENTRY_ECLASSES]
+    return eclasses.split('\t')[::2] if '\t' in eclasses else eclasses.split()
+
+def entry_metadata(entry):
+    '''
+    Returns the dict of METADATA_KEYS values of the index entry.
+    '''
+    return dict(zip(METADATA_KEYS, entry[ENTRY_METADATA:]))
+
+class KernelIndex(JSONCache):
+    '''
+    The persisted index.  packages() brings a repository's entry up to date
+    (as cheaply as it can) and returns it; save() writes the index back if it
+    has changed.
+    '''
+    KEY = 'trees'
+    FORMAT = INDEX_FORMAT
+    DESCRIPTION = 'kernel index'
+
+    @trace
+    def packages(self, tree, dbapi=None):
+        '''
+        Returns {pn: {pvr: entry}} for the kernel sources packages of the
+        repository at tree, updating the index as required.  dbapi supplies
+        the metadata of any ebuild without a usable md5-cache entry (without
+        it, such ebuilds are skipped).
+        '''
+        timestamp = _timestamp(tree)
+        category = os.path.join(tree, KERNEL_CATEGORY)
+        cachedir = os.path.join(tree, 'metadata', 'md5-cache', KERNEL_CATEGORY)
+        category_mtime, cache_mtime = _mtime(category), _mtime(cachedir)
+        old = self._data.get(tree)
+        if old is not None and timestamp is not None and old['timestamp'] == timestamp and \
+                old['category_mtime'] == category_mtime and old['cache_mtime'] == cache_mtime:
+            metrics.count('kernel_index_hits')
+            return old['packages']
+        metrics.count('kernel_index_misses')
+
+        # a changed md5-cache directory means any entry may have changed
+        reusable = {} if old is None or old['cache_mtime'] != cache_mtime else old['packages']
+        old_mtimes = {} if old is None else old['package_mtimes']
+        if old is not None and old['category_mtime'] == category_mtime:
+            names = list(old['packages'])
+        else:
+            try:
+                names = [name for name in os.listdir(category) if name.endswith(SOURCES_SUFFIX)]
+            except OSError as e:
+                if e.errno not in (errno.ENOENT, errno.ENOTDIR):
+                    raise
+                names = []
+        packages, package_mtimes = {}, {}
+        for pn in sorted(names):
+            pkgdir = os.path.join(category, pn)
+            mtime = _mtime(pkgdir)
+            if mtime is None:
+                continue
+            entries = reusable.get(pn) if old_mtimes.get(pn) == mtime else None
+            if entries is not None and timestamp is None:
+                entries = self._revalidate(pkgdir, pn, entries)
+            if entries is None:
+                entries = self._read_package(tree, pkgdir, cachedir, pn, dbapi)
+            packages[pn] = entries
+            package_mtimes[pn] = mtime
+        self._data[tree] = {
+            'timestamp': timestamp,
+            'category_mtime': category_mtime,
+            'cache_mtime': cache_mtime,
+            'package_mtimes': package_mtimes,
+            'packages': packages,
+        }
+        self._dirty = True
+        return packages
+
+    def _revalidate(self, pkgdir, pn, entries):
+        # in-place edits leave the directory mtime alone: check each ebuild
+        for pvr, entry in entries.items():
+            try:
+                st = os.stat(os.path.join(pkgdir, '%s-%s.ebuild' % (pn, pvr)))
+            except OSError:
+                return None
+            if [st.st_mtime_ns, st.st_size] != list(entry[ENTRY_STAMP]):
+                return None
+        return entries
+
+    def _read_package(self, tree, pkgdir, cachedir, pn, dbapi):
+        entries = {}
+        for dirent in os.scandir(pkgdir):
+            name = dirent.name
+            if not (name.startswith(pn + '-') and name.endswith('.ebuild')):
+                continue
+            pvr = name[len(pn) + 1:-len('.ebuild')]
+            st = dirent.stat()
+            md5 = hashlib.md5(_read(dirent.path)).hexdigest()
+            try:
+                values = parse_md5_cache(_read(os.path.join(cachedir, '%s-%s' % (pn, pvr))))
+            except OSError:
+                values = {}
+            if values.get('_md5_') == md5:
+                eclasses = values.get('_eclasses_', '')
+            elif dbapi is not None:
+                metrics.count('kernel_index_portage_lookups')
+                cpv = '%s/%s-%s' % (KERNEL_CATEGORY, pn, pvr)
+                keys = METADATA_KEYS + ('INHERITED',)
+                values = dict(zip(keys, dbapi.aux_get(cpv, keys, mytree=tree)))
+                eclasses = values['INHERITED']
+            else:
+                continue
+            entries[pvr] = [[st.st_mtime_ns, st.st_size], md5, eclasses] + \
+                [values.get(key, '') for key in METADATA_KEYS]
+        return entries
+
+_kernel_index = None
+
+@trace
+def kernel_index(path=None):
+    '''
+    Returns the process-wide KernelIndex (which, under "kernelng serve," lives
+    as long as the server), loaded from path (by default, in the cache
+    directory) if it has changed on disk.
+    '''
+    global _kernel_index
+    if path is None:
+        path = os.path.join(default_cache_dir(), KERNEL_INDEX)
+    if _kernel_index is None or _kernel_index._path != path:
+        _kernel_index = KernelIndex(path)
+    _kernel_index.load()
+    return _kernel_index
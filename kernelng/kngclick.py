@@ -29,45 +29,49 @@ Feel free to treat everything in this file under the terms of that
 
 from __future__ import print_function
 
+import os
+import re
+import atexit
+import hashlib
 from contextlib import contextmanager
+from collections import OrderedDict
+from importlib import import_module
 
 from click.core import Context, Command, Group
-from click.termui import style, get_terminal_size
+from click.termui import get_terminal_size
 from click.formatting import HelpFormatter
 from click.decorators import command, option, version_option
 import click
 
 from .kngclicktextwrapper import KNGClickTextWrapper
-from .kngtextwrapper import kngterm_len, kngexpandtabs
+from .kngtextwrapper import kngterm_len, kngexpandtabs, wrap_cache, wrap_cache_info
 from .version import version
-from .output import set_verbose_level, trace
-
-KNG_OPTIONS_METAVAR = ''.join((
-    style('[', fg='blue'),
-    style('OPTIONS', fg='cyan', bold=True),
-    style(']', fg='blue')))
-
-SUBCOMMAND_METAVAR = ''.join((
-    style('SUBCOMMAND', fg='cyan', bold=True),
-    ' ',
-    style('[', fg='blue'),
-    style('ARGS', fg='cyan', bold=True),
-    style(']...', fg='blue')))
-
-SUBCOMMANDS_METAVAR = ''.join((
-    style('SUBCOMMAND1', fg='cyan', bold=True),
-    ' ',
-    style('[', fg='blue'),
-    style('ARGS', fg='cyan', bold=True),
-    style(']...', fg='blue'),
-    ' ',
-    style('[', fg='blue'),
-    style('SUBCOMMAND2', fg='cyan', bold=True),
-    ' ',
-    style('[', fg='blue'),
-    style('ARGS', fg='cyan', bold=True),
-    style(']...', fg='blue'),
-    style(']...', fg='blue')))
+from .config import SYSTEM_CACHE_DIR, USER_CACHE_DIR
+from .metrics import set_metrics_file, set_command, set_exit_status, set_count
+from . import output
+from .output import set_verbose_level, set_output_buffering, set_log_format, set_color, \
+    trace, echov, kngstyle, OUTPUT_BUFFERING_MODES, LOG_FORMATS
+from .scripts.helpstrings import HS
+
+# The metavars are kept plain, as commands are defined before colour has been
+# decided (and a server decides it afresh for each client); KNGHelpFormatter
+# styles them as the usage line is rendered.
+KNG_OPTIONS_METAVAR = '[OPTIONS]'
+SUBCOMMAND_METAVAR = 'SUBCOMMAND [ARGS]...'
+SUBCOMMANDS_METAVAR = 'SUBCOMMAND1 [ARGS]... [SUBCOMMAND2 [ARGS]...]...'
+
+_METAVAR_TOKEN_RE = re.compile(r'[A-Z][A-Z0-9]*|\[|\](?:\.\.\.)?|\.\.\.')
+
+def kngstyle_metavar(metavar):
+    '''
+    Styles one of the metavars above: names cyan, brackets and ellipses blue.
+    '''
+    def style(match):
+        token = match.group(0)
+        if token[:1].isalpha():
+            return kngstyle(token, fg='cyan', bold=True)
+        return kngstyle(token, fg='blue')
+    return _METAVAR_TOKEN_RE.sub(style, metavar)
 
 def kngwrap_text(text, width=78, initial_indent='', subsequent_indent='',
               preserve_paragraphs=False):
@@ -88,7 +92,15 @@ def kngwrap_text(text, width=78, initial_indent='', subsequent_indent='',
                               each consecutive line.
     :param preserve_paragraphs: if this flag is set then the wrapping will
                                 intelligently handle paragraphs.
+
+    Results are memoized; see kngtextwrapper.wrap_cache.
     """
+    return _kngwrap_text(text, width, initial_indent, subsequent_indent,
+        preserve_paragraphs)
+
+@wrap_cache
+def _kngwrap_text(text, width, initial_indent, subsequent_indent,
+        preserve_paragraphs):
     text = kngexpandtabs(text)
     wrapper = KNGClickTextWrapper(width, initial_indent=initial_indent,
                           subsequent_indent=subsequent_indent,
@@ -133,16 +145,29 @@ def kngwrap_text(text, width=78, initial_indent='', subsequent_indent='',
 
 click.formatting.__dict__['wrap_text'] = kngwrap_text
 
-class KNGHelpFormatter(HelpFormatter):
+def _report_wrap_cache():
+    # n.b.: registered after (so, run before) the metrics file is written
+    # and the output flushed
+    hits, misses, entries = wrap_cache_info()
+    if hits or misses:
+        set_count('wrap_cache_hits', hits)
+        set_count('wrap_cache_misses', misses)
+        echov('wrap cache: %d hits, %d misses, %d entries' % (hits, misses, entries), 3)
+
+atexit.register(_report_wrap_cache)
+
+def kng_help_width(width=None):
     # allow a maximum default width of 120 vs. HelpFormatter's 80
+    return max(min(get_terminal_size()[0], 120) - 2, 50) if width is None else width
+
+class KNGHelpFormatter(HelpFormatter):
     @trace
     def __init__(self, *args, **kwargs):
         if 'width' in kwargs:
             width = kwargs.pop('width')
         else:
             width = None
-        width = max(min(get_terminal_size()[0], 120) - 2, 50) if width is None else width
-        kwargs['width'] = width
+        kwargs['width'] = kng_help_width(width)
         self._kngsection = None
         super(KNGHelpFormatter, self).__init__(*args, **kwargs)
 
@@ -156,7 +181,7 @@ class KNGHelpFormatter(HelpFormatter):
             if heading == 'Commands':
                 heading = 'Subcommand'
             self.write('%*s%s%s\n' % (self.current_indent, '',
-                style(heading, fg='cyan', bold=True), style(':', fg='white', bold=True)))
+                kngstyle(heading, fg='cyan', bold=True), kngstyle(':', fg='white', bold=True)))
         else:
             super(KNGHelpFormatter, self).write_heading(heading)
 
@@ -178,7 +203,9 @@ class KNGHelpFormatter(HelpFormatter):
 
     @trace
     def write_usage(self, prog, args='', prefix='Usage: '):
-        prog = style(prog, fg='white', bold=True)
+        prog = kngstyle(prog, fg='white', bold=True)
+        for metavar in (SUBCOMMANDS_METAVAR, SUBCOMMAND_METAVAR, KNG_OPTIONS_METAVAR):
+            args = args.replace(metavar, kngstyle_metavar(metavar))
         super(KNGHelpFormatter, self).write_usage(prog, args=args, prefix=prefix)
 
     @trace
@@ -186,13 +213,13 @@ class KNGHelpFormatter(HelpFormatter):
         if len(word) == 0:
             return word
         elif word[:1] == '-':
-            return style(word, fg='white', bold=True)
+            return kngstyle(word, fg='white', bold=True)
         elif self._kngsection == 'Options':
             # for the options definiton list, we make non-hyphenated
             # words yellow; otherwise, we stick to white
-            return style(word, fg='yellow', bold=True)
+            return kngstyle(word, fg='yellow', bold=True)
         else:
-            return style(word, fg='white', bold=True)
+            return kngstyle(word, fg='white', bold=True)
 
     @trace
     def write_dl(self, rows, *args, **kwargs):
@@ -215,36 +242,105 @@ class KNGContext(Context):
     def make_formatter(self):
         return KNGHelpFormatter(width=self.terminal_width)
 
-no_color_mode = False
-
-# generate a new echo function suitable for monkey patching an old one
-# nb: definitely not a good idea to trace the inner function!!!
-def nocolorecho(oldecho):
-    def newecho(*args, **kwargs):
-        if no_color_mode:
-            if len(args) > 0:
-                args=(click._compat.strip_ansi(args[0]),) + args[1:]
-            else:
-                message = kwargs.pop('message', None)
-                if message is not None:
-                    kwargs['message'] = click._compat.strip_ansi(message)
-        oldecho(*args, **kwargs)
-    return newecho
-
-# monkey patch click's echo functions to always ignore color, regardless
-# of the output's isatty-ness when no_color_mode is True -- but only
-# bother if no_color_mode is, indeed, true, and we haven't already
-# monkey patched it.
-def no_color(ctx, command, value):
-    global no_color_mode
-    oldval = no_color_mode
-    no_color_mode = no_color_mode or value
-    if (not oldval) and no_color_mode:
-        click.utils.__dict__['echo'] = nocolorecho(click.utils.echo)
-        click.core.__dict__['echo'] = nocolorecho(click.core.echo)
-        click.__dict__['echo'] = nocolorecho(click.echo)
+# Rendered help pages are cached on disk, one file per (command path, width,
+# styling, help string substitutions), in a directory per kernelng version
+# -- so that upgrading invalidates everything -- under the user's cache
+# directory.  The styling is that actually used (none in jsonl log mode, even
+# on a terminal).  The substitutions (and the cache directories, which some
+# help strings mention) depend on the environment -- EPREFIX, the name the
+# program was run as, the server's socket and so on -- so they are part of
+# the key.  Any trouble with the cache simply falls back to rendering.
+HELP_CACHE_DIR = os.path.join(
+    os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache'),
+    'kernelng', 'help')
+
+help_cache_enabled = not os.environ.get('KERNELNG_NO_HELP_CACHE')
+
+def _help_styled():
+    return output.color_enabled and output.log_format != 'jsonl'
+
+def _help_inputs():
+    # HS holds the final substitutions, including those the subcommand
+    # modules add as they are imported
+    return hashlib.md5(repr((
+        sorted(HS.items()),
+        SYSTEM_CACHE_DIR,
+        USER_CACHE_DIR,
+    )).encode('utf-8')).hexdigest()
+
+def _help_cache_path(ctx):
+    key = '\0'.join((
+        ctx.command_path,
+        str(kng_help_width(ctx.terminal_width)),
+        'color' if _help_styled() else 'nocolor',
+        _help_inputs(),
+        version,
+    ))
+    return os.path.join(HELP_CACHE_DIR, version,
+        hashlib.md5(key.encode('utf-8')).hexdigest())
+
+def _prune_help_cache():
+    # remove the cached help of any other kernelng version
+    try:
+        for entry in os.listdir(HELP_CACHE_DIR):
+            if entry != version:
+                olddir = os.path.join(HELP_CACHE_DIR, entry)
+                for name in os.listdir(olddir):
+                    os.unlink(os.path.join(olddir, name))
+                os.rmdir(olddir)
+    except (IOError, OSError):
+        pass
+
+def _render_help(ctx, render):
+    rv = render(ctx)
+    if not _help_styled() and '\033' in rv:
+        # help strings styled before colour was decided (see kngstyle_static)
+        rv = click.unstyle(rv)
+    return rv
+
+def kng_cached_help(ctx, render):
+    '''
+    Returns the help page for ctx from the help cache, or else renders it by
+    calling render(ctx) and stores the result.
+    '''
+    if not help_cache_enabled:
+        return _render_help(ctx, render)
+    path = _help_cache_path(ctx)
+    try:
+        with open(path, 'rb') as f:
+            return f.read().decode('utf-8')
+    except (IOError, OSError):
+        pass
+    rv = _render_help(ctx, render)
+    try:
+        dirname = os.path.dirname(path)
+        if not os.path.isdir(dirname):
+            os.makedirs(dirname)
+            _prune_help_cache()
+        tmppath = '%s.%d.tmp' % (path, os.getpid())
+        with open(tmppath, 'wb') as f:
+            f.write(rv.encode('utf-8'))
+        os.rename(tmppath, path)
+    except (IOError, OSError):
+        pass
+    return rv
+
+def color(ctx, command, value):
+    if value is not None:
+        set_color(value, forced=True)
+        # likewise for what click itself writes (help, usage errors)
+        ctx.color = value
 
 class KNGGroup(Group):
+    '''
+    click Group with kernelng's styling and common options.  In addition to the
+    usual eagerly-added subcommands, a KNGGroup can carry a registry of lazy
+    subcommands (the lazy_subcommands keyword, or add_lazy_command), each
+    given as a name, an import path of the form "package.module:attribute", and
+    a short help string.  The module behind a lazy subcommand is imported only
+    when that subcommand is invoked or its own help is requested; the group's
+    help lists it using the registered short help alone.
+    '''
     @trace
     def __init__(self, *args, **kwargs):
         options_metavar = kwargs.pop('options_metavar', KNG_OPTIONS_METAVAR)
@@ -254,7 +350,57 @@ class KNGGroup(Group):
         subcommand_metavar = kwargs.pop('subcommand_metavar',
             SUBCOMMANDS_METAVAR if chain else SUBCOMMAND_METAVAR)
         kwargs['subcommand_metavar'] = subcommand_metavar
+        lazy_subcommands = kwargs.pop('lazy_subcommands', None) or {}
         super(KNGGroup, self).__init__(*args, **kwargs)
+        self.lazy_subcommands = OrderedDict()
+        for name, spec in iter(lazy_subcommands.items()):
+            self.add_lazy_command(name, *spec)
+
+    def add_lazy_command(self, name, import_path, short_help=''):
+        '''
+        Registers a subcommand to be imported from import_path
+        ("package.module:attribute") the first time it is needed.
+        '''
+        if ':' not in import_path:
+            raise ValueError('lazy subcommand import path "%s" lacks ":attribute"' % import_path)
+        self.lazy_subcommands[name] = (import_path, short_help)
+
+    def _load_lazy_command(self, name):
+        import_path, short_help = self.lazy_subcommands[name]
+        modname, attr = import_path.split(':', 1)
+        cmd = getattr(import_module(modname), attr)
+        self.add_command(cmd, name)
+        return cmd
+
+    def list_commands(self, ctx):
+        return sorted(set(super(KNGGroup, self).list_commands(ctx)) | set(self.lazy_subcommands))
+
+    def get_command(self, ctx, cmd_name):
+        cmd = super(KNGGroup, self).get_command(ctx, cmd_name)
+        if cmd is None and cmd_name in self.lazy_subcommands:
+            cmd = self._load_lazy_command(cmd_name)
+        return cmd
+
+    def format_commands(self, ctx, formatter):
+        '''
+        Like click's version, but uses the registered short help for lazy
+        subcommands rather than importing them just to ask.
+        '''
+        rows = []
+        for subcommand in self.list_commands(ctx):
+            if subcommand not in self.commands and subcommand in self.lazy_subcommands:
+                rows.append((subcommand, self.lazy_subcommands[subcommand][1]))
+                continue
+            cmd = self.get_command(ctx, subcommand)
+            if cmd is None or getattr(cmd, 'hidden', False):
+                continue
+            if hasattr(cmd, 'get_short_help_str'):
+                rows.append((subcommand, cmd.get_short_help_str(max(formatter.width - 6 - len(subcommand), 45))))
+            else:
+                rows.append((subcommand, cmd.short_help or ''))
+        if rows:
+            with formatter.section('Commands'):
+                formatter.write_dl(rows)
 
     @trace
     def make_context(self, info_name, args, parent=None, **extra):
@@ -265,6 +411,26 @@ class KNGGroup(Group):
         self.parse_args(ctx, args)
         return ctx
 
+    def main(self, *args, **kwargs):
+        # record the exit status for the metrics file, however we leave
+        try:
+            rv = super(KNGGroup, self).main(*args, **kwargs)
+        except SystemExit as e:
+            set_exit_status(e.code if isinstance(e.code, int) else 0 if e.code is None else 1)
+            raise
+        except BaseException:
+            set_exit_status(1)
+            raise
+        set_exit_status(0)
+        return rv
+
+    def invoke(self, ctx):
+        set_command(ctx.command_path)
+        return super(KNGGroup, self).invoke(ctx)
+
+    def get_help(self, ctx):
+        return kng_cached_help(ctx, super(KNGGroup, self).get_help)
+
     def kngcommand(self, *args, **kwargs):
         def decorator(f):
             cmd = kngcommand(*args, **kwargs)(f)
@@ -295,6 +461,13 @@ class KNGCommand(Command):
         self.parse_args(ctx, args)
         return ctx
 
+    def invoke(self, ctx):
+        set_command(ctx.command_path)
+        return super(KNGCommand, self).invoke(ctx)
+
+    def get_help(self, ctx):
+        return kng_cached_help(ctx, super(KNGCommand, self).get_help)
+
     def kngcommand(self, *args, **kwargs):
         def decorator(f):
             cmd = kngcommand(*args, **kwargs)(f)
@@ -308,10 +481,17 @@ class KNGCommand(Command):
             return cmd
         return decorator
 
-NOCOLORIZEHELP = "Do not colorize output or use advanced terminal features."
+COLORIZEHELP = "Colorize output, or (-C) do not colorize output or use advanced terminal " \
+    "features (default: colorize only on terminals)."
 QUIETHELP = "Skip non-essential outputs and error messages (mostly for robots)."
 VERBOSEHELP = "Include optional progress and informational output suitable for humans."
 DEBUGHELP = "Provide counterproductively detailed output (mostly for developers)."
+BUFFERINGHELP = "Output buffering: line-buffered on terminals and block-buffered otherwise (auto), " \
+    "or always line, block or none."
+LOGFORMATHELP = "Format of log and trace output: styled text (the default), or one JSON object " \
+    "per line (mostly for robots)."
+METRICSFILEHELP = "At exit, atomically write run metrics to the specified node-exporter " \
+    "textfile-collector (.prom) file."
 
 def kngcommandcommon(name=None, cls=None, **kwargs):
     '''
@@ -327,7 +507,10 @@ def kngcommandcommon(name=None, cls=None, **kwargs):
       -v, --verbose: report progress in detail (verboseness=2)
       -q, --quiet: avoid nonessential ouput (verboseness=0)
       --debug: dump silly amounts of information (verboseness=3)
-      -C, --no-color: suppresses fancy terminal behavior
+      --color, -C/--no-color: forces or suppresses fancy terminal behavior
+      --buffering: selects the output buffering mode
+      --log-format: selects text or jsonl log output
+      --metrics-file: writes prometheus metrics at exit
       -V, --version: dump version info & terminate
     '''
     def decorator(f):
@@ -338,9 +521,18 @@ def kngcommandcommon(name=None, cls=None, **kwargs):
                    help=QUIETHELP, callback=set_verbose_level, is_eager=True)(
               option('--debug', 'verbosity', expose_value=False, flag_value=3,
                      help=DEBUGHELP, callback=set_verbose_level, is_eager=True)(
-                option('-C', '--no-color', is_flag=True, default=False, is_eager=True,
-                       help=NOCOLORIZEHELP, expose_value=False, callback=no_color)(
-                  version_option(version, '-V', '--version')(f))))))
+                option('--color/--no-color', ' /-C', default=None, is_eager=True,
+                       help=COLORIZEHELP, expose_value=False, callback=color)(
+                  option('--buffering', type=click.Choice(OUTPUT_BUFFERING_MODES), default=None,
+                         is_eager=True, help=BUFFERINGHELP, expose_value=False,
+                         callback=set_output_buffering)(
+                    option('--log-format', type=click.Choice(LOG_FORMATS), default=None,
+                           is_eager=True, help=LOGFORMATHELP, expose_value=False,
+                           callback=set_log_format)(
+                      option('--metrics-file', type=click.Path(dir_okay=False, writable=True),
+                             default=None, is_eager=True, help=METRICSFILEHELP,
+                             expose_value=False, callback=set_metrics_file)(
+                        version_option(version, '-V', '--version')(f)))))))))
     return decorator
 
 def kngcommand(name=None, cls=None, **kwargs):
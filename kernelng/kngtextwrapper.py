@@ -16,10 +16,16 @@
 # Copyright (C) 2014 Gregory M. Turner
 # Written by Greg Ward <gward@python.net>
 
+import os
 import re
+from bisect import bisect_right
+from functools import lru_cache, wraps
 
-__all__ = ['KNGTextWrapper', 'kngwrap', 'kngfill', 'kngshorten', 'kngexpandtabs',
-           'kngterm_len', 'kngstrip_ansi']
+from .kngwidthtable import WIDTH_STARTS, WIDTH_VALUES
+
+__all__ = ['KNGTextWrapper', 'kngwrap', 'kngfill', 'kngiterwrap', 'kngshorten', 'kngexpandtabs',
+           'kngterm_len', 'kngstrip_ansi', 'kngstr_width', 'wrap_cache', 'wrap_cache_info',
+           'set_wrap_cache_enabled']
 
 # Hardcode the recognized whitespace characters to the US-ASCII
 # whitespace characters.  The main reason for doing this is that in
@@ -35,26 +41,79 @@ _whitespace = '\t\n\x0b\x0c\r '
 _ansi_re = re.compile('\033\[((?:\d|;)*)([a-zA-Z])')
 def kngstrip_ansi(value):
     return _ansi_re.sub('', value)
-def kngterm_len(x):
-    return len(kngstrip_ansi(x))
 # </cut-pasted from click code-base>
 
+# Display widths come from the table in kngwidthtable (generated at build time
+# from unicodedata), so that measuring never needs unicodedata itself; pure
+# ASCII, by far the common case, never even needs the table.
+
+_char_widths = {}
+
+def _char_width(ch):
+    try:
+        return _char_widths[ch]
+    except KeyError:
+        width = WIDTH_VALUES[bisect_right(WIDTH_STARTS, ord(ch)) - 1]
+        _char_widths[ch] = width
+        return width
+
+def kngstr_width(text):
+    '''
+    Returns the number of terminal columns text (which must be free of ANSI
+    escapes) occupies: east-asian wide characters count double, combining
+    marks not at all.
+    '''
+    if text.isascii():
+        return len(text)
+    return sum(_char_width(ch) for ch in text)
+
+def _width_prefix(text, maxwidth, force=False):
+    '''
+    Returns (index, width) for the longest prefix text[:index] no wider than
+    maxwidth, keeping combining marks with their base character.  If force,
+    at least one character is taken even if it doesn't fit.
+    '''
+    if text.isascii():
+        index = max(min(len(text), maxwidth), 1 if force and text else 0)
+        return index, index
+    index = width = 0
+    for index, ch in enumerate(text):
+        w = _char_width(ch)
+        if w and width + w > maxwidth and not (force and width == 0):
+            break
+        width += w
+    else:
+        index = len(text)
+    return index, width
+
+def kngterm_len(x):
+    # most strings have no escapes at all, and then there's nothing to strip
+    if '\033' in x:
+        x = kngstrip_ansi(x)
+    return kngstr_width(x)
+
+# note: these hardly catch all ANSI escape codes (see wikipedia!)
+# but they do catch the ones thrown about in click.style....
+_ansisep_re = re.compile('((?:\033\[(?:\d|;)*[a-zA-Z])+)')
+
 _tabsep_re = re.compile(r'(\t+)')
 
 def kngexpandtabs(text, tabsize=8):
+    if '\t' not in text:
+        return text
     col = 0
-    rslt = ''
+    rslt = []
     for chunk in _tabsep_re.split(text):
         if len(chunk) > 0:
-            if chunk[0] is '\t':
-                rslt += ' ' * (tabsize - col)
+            if chunk[0] == '\t':
+                rslt.append(' ' * (tabsize - col))
                 col = 0
-                rslt += ' ' * (tabsize * (len(chunk) - 1))
+                rslt.append(' ' * (tabsize * (len(chunk) - 1)))
             else:
                 col += kngterm_len(chunk)
                 col %= tabsize
-                rslt += chunk
-    return rslt
+                rslt.append(chunk)
+    return ''.join(rslt)
 
 class KNGTextWrapper(object):
     """
@@ -105,11 +164,6 @@ class KNGTextWrapper(object):
         Append to the last line of truncated text.
     """
 
-    # note: these hardly catch all ANSI escape codes (see wikipedia!)
-    # but they do catch the ones thrown about in click.style....
-    _ansisep_re = re.compile('((?:\033\[(?:\d|;)*[a-zA-Z])+)')
-    _ansi_only_re = re.compile('^((?:\033\[(?:\d|;)*[a-zA-Z])+)$')
-
     unicode_whitespace_trans = {}
     uspace = ord(' ')
     for x in _whitespace:
@@ -193,11 +247,11 @@ class KNGTextWrapper(object):
 
 
     def _split(self, text):
-        """_split(text : string) -> [string]
+        """_split(text : string) -> [(string, int)]
 
-        Split the text to wrap into indivisible chunks.  Chunks are
-        not quite the same as words; see _wrap_chunks() for full
-        details.  As an example, the text
+        Split the text to wrap into indivisible chunks, each paired with
+        its width on the terminal.  Chunks are not quite the same as words;
+        see _wrap_chunks() for full details.  As an example, the text
           Look, goof-ball -- use the -b option!
         breaks into the following chunks:
           'Look,', ' ', 'goof-', 'ball', ' ', '--', ' ',
@@ -206,16 +260,47 @@ class KNGTextWrapper(object):
           'Look,', ' ', 'goof-ball', ' ', '--', ' ',
           'use', ' ', 'the', ' ', '-b', ' ', option!'
         otherwise.
+
+        This is the only place the text is scanned for ANSI escape
+        sequences: they are split out first, as zero-width tokens, so that
+        the widths of the chunks come for free and never need measuring
+        again.  An escape sequence sticks to the word before it, or, after
+        whitespace, to the word after it, and never itself separates two
+        words, so that escapes neither split a word nor get dropped along
+        with the whitespace at the end of a line.
         """
         if self.break_on_hyphens is True:
-            chunks = self.wordsep_re.split(text)
+            wordsplit = self.wordsep_re.split
         else:
-            chunks = self.wordsep_simple_re.split(text)
-        chunks = [c for c in chunks if c]
-        return chunks
+            wordsplit = self.wordsep_simple_re.split
+        chunks = []
+        escapes = ''
+        glue = False
+        for index, piece in enumerate(_ansisep_re.split(text)):
+            if index % 2:
+                if chunks and chunks[-1][0].strip():
+                    chunks[-1][0] += piece
+                    glue = True
+                else:
+                    escapes += piece
+                continue
+            for word in wordsplit(piece):
+                if not word:
+                    continue
+                if glue and word.strip():
+                    # the word continues right where the escapes left off
+                    chunks[-1][0] += word
+                    chunks[-1][1] += kngstr_width(word)
+                else:
+                    chunks.append([escapes + word, kngstr_width(word)])
+                    escapes = ''
+                glue = False
+        if escapes:
+            chunks.append([escapes, 0])
+        return [tuple(chunk) for chunk in chunks]
 
     def _fix_sentence_endings(self, chunks):
-        """_fix_sentence_endings(chunks : [string])
+        """_fix_sentence_endings(chunks : [(string, int)])
 
         Correct for sentence endings buried in 'chunks'.  Eg. when the
         original text contains "... foo.\nBar ...", munge_whitespace()
@@ -226,15 +311,15 @@ class KNGTextWrapper(object):
         i = 0
         patsearch = self.sentence_end_re.search
         while i < len(chunks)-1:
-            if chunks[i+1] == " " and patsearch(chunks[i]):
-                chunks[i+1] = "  "
+            if chunks[i+1][0] == " " and patsearch(chunks[i][0]):
+                chunks[i+1] = ("  ", 2)
                 i += 2
             else:
                 i += 1
 
     def _handle_long_word(self, reversed_chunks, cur_line, cur_len, width):
-        """_handle_long_word(chunks : [string],
-                             cur_line : [string],
+        """_handle_long_word(chunks : [(string, int)],
+                             cur_line : [(string, int)],
                              cur_len : int, width : int)
 
         Handle a chunk of text (most likely a word, not whitespace) that
@@ -250,34 +335,43 @@ class KNGTextWrapper(object):
         # If we're allowed to break long words, then do so: put as much
         # of the next chunk onto the current line as will fit.
         if self.break_long_words:
-            subchunks = _ansisep_re.split(reversed_chunks[-1])
-            # keep gobbling up text until we consume space_left in non-ansi-escape-sequences.
-            # the re.split returns text, ansi, text, ansi, etc, always in that order
-            while len(subchunks) > 0 and space_left > 0:
-                firsttextchunk = subchunks[0]
-                if len(subchunks) > 1:
-                    firstansichunk = subchunks[1]
+            text, textwidth = reversed_chunks[-1]
+            # the re.split returns text, ansi, text, ansi, etc, always in that
+            # order; each escape sequence travels with the text after it.
+            pieces = _ansisep_re.split(text)
+            head = []
+            taken = 0
+            tail = []
+            for index in range(0, len(pieces), 2):
+                escape = pieces[index - 1] if index else ''
+                piece = pieces[index]
+                # on an otherwise empty line, something has to give, even if
+                # it's a wide character too wide for the line
+                cut, cutwidth = _width_prefix(piece, space_left - taken,
+                    force=(cur_len == 0 and taken == 0))
+                if cut == len(piece):
+                    head.append(escape)
+                    head.append(piece)
+                    taken += cutwidth
+                    continue
+                if cut > 0:
+                    head.append(escape)
+                    head.append(piece[:cut])
+                    taken += cutwidth
+                    tail.append(piece[cut:])
                 else:
-                    firstansichunk = ''
-                subchunks = subchunks[2:]
-
-                if len(firsttextchunk) == 0:
-                    cur_line.append(firstansichunk)
-                    reversed_chunks[-1] = reversed_chunks[-1][len(firstansichunk):]
-                elif len(firsttextchunk) <= space_left:
-                    space_left -= len(firsttextchunk)
-                    cur_line.append(firsttextchunk)
-                    cur_line.append(firstansichunk)
-                    reversed_chunks[-1] = reversed_chunks[-1][len(firsttextchunk) + len(firstansichunk):]
-                else:
-                    space_left = 0
-                    cur_line.append(firsttextchunk[:space_left])
-                    reversed_chunks[-1] = reversed_chunks[-1][space_left:]
+                    tail.append(escape)
+                    tail.append(piece)
+                tail.extend(pieces[index + 1:])
+                break
+            if taken:
+                cur_line.append((''.join(head), taken))
+                reversed_chunks[-1] = (''.join(tail), textwidth - taken)
 
         # Otherwise, we have to preserve the long word intact.  Only add
         # it to the current line if there's nothing already there --
         # that minimizes how much we violate the width constraint.
-        elif not kngstrip_ansi(cur_line):
+        elif cur_len == 0:
             cur_line.append(reversed_chunks.pop())
 
         # If we're not allowed to break long words, and there's already
@@ -287,34 +381,52 @@ class KNGTextWrapper(object):
         # devoted to the long word that we can't handle right now.
 
     def _wrap_chunks(self, chunks):
-        """_wrap_chunks(chunks : [string]) -> [string]
-
-        Wrap a sequence of text chunks and return a list of lines of
-        length 'self.width' or less.  (If 'break_long_words' is false,
-        some lines may be longer than this.)  Chunks correspond roughly
-        to words and the whitespace between them: each chunk is
-        indivisible (modulo 'break_long_words'), but a line break can
-        come between any two chunks.  Chunks should not have internal
-        whitespace; ie. a chunk is either all whitespace or a "word".
-        Whitespace chunks will be removed from the beginning and end of
-        lines, but apart from that whitespace is preserved.
+        """_wrap_chunks(chunks : [(string, int)]) -> [string]
+
+        List-returning form of _iter_wrap_chunks(), which see.
+        """
+        return list(self._iter_wrap_chunks(chunks))
+
+    def _iter_wrap_chunks(self, chunks):
+        """_iter_wrap_chunks(chunks : [(string, int)]) -> iter([string])
+
+        Wrap a sequence of text chunks, each paired with its width, and
+        generate lines of length 'self.width' or less.  (If
+        'break_long_words' is false, some lines may be longer than this.)
+        Chunks correspond roughly to words and the whitespace between them:
+        each chunk is indivisible (modulo 'break_long_words'), but a line
+        break can come between any two chunks.  Chunks should not have
+        internal whitespace; ie. a chunk is either all whitespace or a
+        "word".  Whitespace chunks will be removed from the beginning and
+        end of lines, but apart from that whitespace is preserved.
+
+        Since the widths are known up front, this never measures anything
+        but the indents and placeholder (once each), and runs in time
+        linear in the length of the text.  Each line is held back only
+        until the next one is made, as the placeholder may yet have to be
+        appended to it when 'max_lines' is set.
 
         FIXME: Probably very buggy when ANSI encloses only whitespace
         """
-        lines = []
+        # the last line made, not yet yielded, and how many have been made
+        held = None
+        nlines = 0
         if self.width <= 0:
             raise ValueError("invalid width %r (must be > 0)" % self.width)
+        initial_indent_len = kngterm_len(self.initial_indent)
+        subsequent_indent_len = kngterm_len(self.subsequent_indent)
+        placeholder_len = kngterm_len(self.placeholder)
         if self.max_lines is not None:
             if self.max_lines > 1:
-                indent = self.subsequent_indent
+                indent_len = subsequent_indent_len
             else:
-                indent = self.initial_indent
-            if kngterm_len(indent) + kngterm_len(self.placeholder.lstrip()) > self.width:
+                indent_len = initial_indent_len
+            if indent_len + kngterm_len(self.placeholder.lstrip()) > self.width:
                 raise ValueError("placeholder too large for max width")
 
         # Arrange in reverse order so items can be efficiently popped
         # from a stack of chucks.
-        chunks.reverse()
+        chunks = list(reversed(chunks))
 
         while chunks:
 
@@ -324,21 +436,23 @@ class KNGTextWrapper(object):
             cur_len = 0
 
             # Figure out which static string will prefix this line.
-            if lines:
+            if held is not None:
                 indent = self.subsequent_indent
+                indent_len = subsequent_indent_len
             else:
                 indent = self.initial_indent
+                indent_len = initial_indent_len
 
             # Maximum width for this line.
-            width = self.width - kngterm_len(indent)
+            width = self.width - indent_len
 
             # First chunk on line is whitespace -- drop it, unless this
             # is the very beginning of the text (ie. no lines started yet).
-            if self.drop_whitespace and chunks[-1].strip() == '' and lines:
+            if self.drop_whitespace and chunks[-1][0].strip() == '' and held is not None:
                 del chunks[-1]
 
             while chunks:
-                l = kngterm_len(chunks[-1])
+                l = chunks[-1][1]
 
                 # Can at least squeeze this chunk onto the current line.
                 if cur_len + l <= width:
@@ -351,45 +465,53 @@ class KNGTextWrapper(object):
 
             # The current line is full, and the next chunk is too big to
             # fit on *any* line (not just this one).
-            if chunks and kngterm_len(chunks[-1]) > width:
+            if chunks and chunks[-1][1] > width:
                 self._handle_long_word(chunks, cur_line, cur_len, width)
-                cur_len = kngterm_len(cur_line)
+                cur_len = sum(l for chunk, l in cur_line)
 
             # If the last chunk on this line is all whitespace, drop it.
-            if self.drop_whitespace and cur_line and cur_line[-1].strip() == '':
-                cur_len -= len(cur_line[-1])
+            if self.drop_whitespace and cur_line and cur_line[-1][0].strip() == '':
+                cur_len -= cur_line[-1][1]
                 del cur_line[-1]
 
             if cur_line:
                 if (self.max_lines is None or
-                    len(lines) + 1 < self.max_lines or
+                    nlines + 1 < self.max_lines or
                     (not chunks or
                      self.drop_whitespace and
                      len(chunks) == 1 and
-                     not chunks[0].strip()) and cur_len <= width):
-                    # Convert current line back to a string and store it in
-                    # list of all lines (return value).
-                    lines.append(indent + ''.join(cur_line))
+                     not chunks[0][0].strip()) and cur_len <= width):
+                    # Convert current line back to a string and hold it.
+                    if held is not None:
+                        yield held
+                    held = indent + ''.join(chunk for chunk, l in cur_line)
+                    nlines += 1
                 else:
                     while cur_line:
-                        if (cur_line[-1].strip() and
-                            cur_len + kngterm_len(self.placeholder) <= width):
-                            cur_line.append(self.placeholder)
-                            lines.append(indent + ''.join(cur_line))
+                        if (cur_line[-1][0].strip() and
+                            cur_len + placeholder_len <= width):
+                            cur_line.append((self.placeholder, placeholder_len))
+                            if held is not None:
+                                yield held
+                            held = indent + ''.join(chunk for chunk, l in cur_line)
+                            nlines += 1
                             break
-                        cur_len -= kngterm_len(cur_line[-1])
+                        cur_len -= cur_line[-1][1]
                         del cur_line[-1]
                     else:
-                        if lines:
-                            prev_line = lines[-1].rstrip()
-                            if (kngterm_len(prev_line) + kgnterm_len(self.placeholder) <=
+                        if held is not None:
+                            prev_line = held.rstrip()
+                            if (kngterm_len(prev_line) + placeholder_len <=
                                     self.width):
-                                lines[-1] = prev_line + self.placeholder
+                                held = prev_line + self.placeholder
                                 break
-                        lines.append(indent + self.placeholder.lstrip())
+                            yield held
+                        held = indent + self.placeholder.lstrip()
+                        nlines += 1
                     break
 
-        return lines
+        if held is not None:
+            yield held
 
     def _split_chunks(self, text):
         text = self._munge_whitespace(text)
@@ -420,6 +542,84 @@ class KNGTextWrapper(object):
         """
         return "\n".join(self.wrap(text))
 
+    def iterwrap(self, paragraphs):
+        """iterwrap(paragraphs : iter([string])) -> iter([string])
+
+        Reformat each paragraph from the iterable 'paragraphs' as wrap()
+        would, generating the wrapped lines as it goes rather than
+        returning them in a list.  Paragraphs are pulled from
+        'paragraphs' only as the lines are consumed, so a long report
+        can be wrapped and written out in memory bounded by its longest
+        paragraph.  A single string is taken as a single paragraph.
+        Empty paragraphs produce no lines, as with wrap().
+        """
+        if isinstance(paragraphs, str):
+            paragraphs = (paragraphs,)
+        for text in paragraphs:
+            chunks = self._split_chunks(text)
+            if self.fix_sentence_endings:
+                self._fix_sentence_endings(chunks)
+            for line in self._iter_wrap_chunks(chunks):
+                yield line
+
+
+# -- Wrap cache ----------------------------------------------------------
+
+# The same paragraphs (help text, above all) get wrapped at the same widths
+# over and over, so the convenience functions below, and kngclick's
+# kngwrap_text, remember their results in bounded LRU caches.  Set
+# KERNELNG_NO_WRAP_CACHE in the environment, or call
+# set_wrap_cache_enabled(False), to bypass them (e.g. when testing).
+
+WRAP_CACHE_SIZE = 512
+
+wrap_cache_enabled = not os.environ.get('KERNELNG_NO_WRAP_CACHE')
+
+_wrap_caches = []
+
+def wrap_cache(f):
+    '''
+    Decorator memoizing f, which must take only hashable, positional
+    arguments, in an LRU cache of WRAP_CACHE_SIZE entries.
+    '''
+    cached = lru_cache(maxsize=WRAP_CACHE_SIZE)(f)
+    _wrap_caches.append(cached)
+    @wraps(f)
+    def wrapper(*args):
+        if wrap_cache_enabled:
+            return cached(*args)
+        return f(*args)
+    wrapper.cache_info = cached.cache_info
+    return wrapper
+
+def wrap_cache_info():
+    '''
+    Returns (hits, misses, entries) summed over all the wrap caches.
+    '''
+    infos = [cached.cache_info() for cached in _wrap_caches]
+    return (sum(info.hits for info in infos), sum(info.misses for info in infos),
+        sum(info.currsize for info in infos))
+
+def set_wrap_cache_enabled(enabled):
+    '''
+    Turns the wrap caches on or off, emptying them either way.
+    '''
+    global wrap_cache_enabled
+    wrap_cache_enabled = bool(enabled)
+    for cached in _wrap_caches:
+        cached.cache_clear()
+
+def _kwargs_key(kwargs):
+    return tuple(sorted(kwargs.items()))
+
+@wrap_cache
+def _cached_wrap(text, width, kwargs):
+    # a tuple, as the list returned to the caller must be its own to mess with
+    return tuple(KNGTextWrapper(width=width, **dict(kwargs)).wrap(text))
+
+@wrap_cache
+def _cached_fill(text, width, kwargs):
+    return KNGTextWrapper(width=width, **dict(kwargs)).fill(text)
 
 # -- Convenience interface ---------------------------------------------
 
@@ -433,8 +633,7 @@ def kngwrap(text, width=70, **kwargs):
     space.  See TextWrapper class for available keyword args to customize
     wrapping behaviour.
     """
-    w = KNGTextWrapper(width=width, **kwargs)
-    return w.wrap(text)
+    return list(_cached_wrap(text, width, _kwargs_key(kwargs)))
 
 def kngfill(text, width=70, **kwargs):
     """Fill a single paragraph of text, returning a new string.
@@ -445,8 +644,18 @@ def kngfill(text, width=70, **kwargs):
     whitespace characters converted to space.  See TextWrapper class for
     available keyword args to customize wrapping behaviour.
     """
-    w = KNGTextWrapper(width=width, **kwargs)
-    return w.fill(text)
+    return _cached_fill(text, width, _kwargs_key(kwargs))
+
+def kngiterwrap(paragraphs, width=70, **kwargs):
+    """Wrap paragraphs of text lazily, generating wrapped lines.
+
+    Reformat each paragraph from the iterable 'paragraphs' so it fits
+    in lines of no more than 'width' columns, generating the lines as
+    they are consumed.  Nothing is cached, so this suits long,
+    one-off reports.  See TextWrapper.iterwrap() and the TextWrapper
+    class for available keyword args to customize wrapping behaviour.
+    """
+    return KNGTextWrapper(width=width, **kwargs).iterwrap(paragraphs)
 
 def kngshorten(text, width, **kwargs):
     """Collapse and truncate the given text to fit in the given width.
@@ -40,12 +40,6 @@ from kernelng.selectors import Interactive
 from kernelng.configs import get_kernel_ng_conf_path
 from kernelng.version import version
 
-# eprefix compatibility
-try:
-    from portage.const import rootuid
-except ImportError:
-    rootuid = 0
-
 # establish the eprefix, initially set so eprefixify can
 # set it on install
 EPREFIX = "@GENTOO_PORTAGE_EPREFIX@"
@@ -231,6 +225,12 @@ class KernelNgUtil(object):
 
         options = p.parse_args()
 
+        # eprefix compatibility (imported here as portage is slow to load)
+        try:
+            from portage.const import rootuid
+        except ImportError:
+            rootuid = 0
+
         if (os.getuid() != rootuid) and not options.output:
             self.output.print_err('Must be root to write to %s!\n' % config_path)
 
@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+#-*- coding:utf-8 -*-
+# vim:ai:sta:et:ts=4:sw=4:sts=4
+
+"""kernelng 0.x
+ Tool for maintaining customized overlays of kernel-ng.eclass-based ebuilds
+
+Copyright 2005-2014 Gentoo Foundation
+
+        Copyright (C) 2014 Gregory M. Turner <gmt@be-evil.net>
+
+Distributed under the terms of the GNU General Public License v2
+ This program is free software; you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, version 2 of the License.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program; if not, write to the Free Software
+ Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA 02110-1301, USA.
+
+"""
+
+
+from __future__ import print_function
+
+import os
+import errno
+import hashlib
+
+from .output import trace
+
+# Manifest2 files for the overlay's packages, made in-process rather than by
+# running "ebuild ... manifest" (a full portage startup) per package.  The
+# DIST entries are those of the upstream packages, whose distfiles the
+# generated ebuilds fetch; everything else is hashed here.
+
+MANIFEST = 'Manifest'
+MANIFEST_HASHES = ('BLAKE2B', 'SHA512')
+
+_HASHERS = {
+    'BLAKE2B': hashlib.blake2b,
+    'SHA512': hashlib.sha512,
+}
+
+# hashlib drops the GIL while hashing buffers over 2KiB, so large reads let
+# the worker threads hash in parallel
+HASH_CHUNK = 1 << 20
+
+def hash_file(path, hashes=MANIFEST_HASHES, cache=None, name=None):
+    '''
+    Returns the (size, ((name, hexdigest), ...)) of the file at path for
+    each of the Manifest hash names in hashes.  If cache (a DigestCache) is
+    given, the digests come from it if it knows them, and otherwise go into
+    it, recorded as those of the file at name (by default, path).
+    '''
+    hashers = [_HASHERS[hashname]() for hashname in hashes]
+    size = 0
+    with open(path, 'rb') as f:
+        st = os.fstat(f.fileno())
+        if cache is not None:
+            digests = cache.get(st, hashes)
+            if digests is not None:
+                return st.st_size, digests
+        while True:
+            chunk = f.read(HASH_CHUNK)
+            if not chunk:
+                break
+            size += len(chunk)
+            for hasher in hashers:
+                hasher.update(chunk)
+        digests = tuple(zip(hashes, (hasher.hexdigest() for hasher in hashers)))
+        # not if it was modified under us
+        if cache is not None and os.fstat(f.fileno()).st_mtime_ns == st.st_mtime_ns \
+                and size == st.st_size:
+            cache.put(st, name or path, digests)
+    return size, digests
+
+def manifest_entry(kind, name, size, digests):
+    return ' '.join([kind, name, str(size)] + ['%s %s' % digest for digest in digests])
+
+@trace
+def dist_entries(path):
+    '''
+    Returns the {distfile: entry} dict of the DIST entries in the Manifest
+    at path, which need not exist.
+    '''
+    try:
+        with open(path) as f:
+            lines = f.read().splitlines()
+    except (IOError, OSError) as e:
+        if e.errno == errno.ENOENT:
+            return {}
+        raise
+    rv = {}
+    for line in lines:
+        fields = line.split(None, 2)
+        if len(fields) == 3 and fields[0] == 'DIST':
+            rv[fields[1]] = line
+    return rv
+
+def _files(pkgdir):
+    # (kind, manifest name, path) of everything a Manifest covers
+    for entry in os.listdir(pkgdir):
+        path = os.path.join(pkgdir, entry)
+        if entry == 'files' and os.path.isdir(path):
+            for dirpath, dirnames, filenames in os.walk(path):
+                for filename in filenames:
+                    filepath = os.path.join(dirpath, filename)
+                    yield 'AUX', os.path.relpath(filepath, path), filepath
+        elif entry == MANIFEST or entry.startswith('.') or not os.path.isfile(path):
+            continue
+        elif entry.endswith('.ebuild'):
+            yield 'EBUILD', entry, path
+        else:
+            yield 'MISC', entry, path
+
+def package_manifest(pkgdir, dists=None, cache=None, alias=None):
+    '''
+    Returns the text of the Manifest of the package at pkgdir, with the
+    entries in the {distfile: entry} dict dists for its DIST entries.  The
+    files are hashed by way of the DigestCache cache, if given, under their
+    paths in alias, if given (i.e., where pkgdir will be published), rather
+    than in pkgdir.
+    '''
+    entries = [('DIST', name, line) for name, line in (dists or {}).items()]
+    for kind, name, path in _files(pkgdir):
+        size, digests = hash_file(path, cache=cache, name=None if alias is None else
+            os.path.join(alias, os.path.relpath(path, pkgdir)))
+        entries.append((kind, name, manifest_entry(kind, name, size, digests)))
+    entries.sort()
+    return ''.join('%s\n' % line for kind, name, line in entries)
@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+#-*- coding:utf-8 -*-
+# vim:ai:sta:et:ts=4:sw=4:sts=4
+
+"""kernelng 0.x
+ Tool for maintaining customized overlays of kernel-ng.eclass-based ebuilds
+
+Copyright 2005-2014 Gentoo Foundation
+
+        Copyright (C) 2014 Gregory M. Turner <gmt@be-evil.net>
+
+Distributed under the terms of the GNU General Public License v2
+ This program is free software; you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, version 2 of the License.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program; if not, write to the Free Software
+ Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA 02110-1301, USA.
+
+"""
+
+import os
+import sys
+import time
+import atexit
+import threading
+
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from .version import version
+
+# Lightweight run instrumentation, written out at exit as a node-exporter
+# textfile-collector (.prom) file when --metrics-file is given.  Recording is
+# always on (it's just a few dict updates); only the file is optional.
+
+METRIC_PREFIX = 'kernelng'
+
+METRIC_HELP = {
+    'config_sections': 'Number of sections in the loaded kernel-ng configuration.',
+    'config_items': 'Number of settings in the loaded kernel-ng configuration.',
+    'generated_packages': 'Number of packages generated into the kernel-ng overlay.',
+    'generated_ebuilds': 'Number of ebuilds generated into the kernel-ng overlay.',
+    'regenerated_ebuilds': 'Number of generated ebuilds whose inputs had changed and were regenerated.',
+    'written_ebuilds': 'Number of generated ebuilds which had changed and were (re)written.',
+    'removed_ebuilds': 'Number of generated ebuilds removed as their upstream ebuild had gone.',
+    'written_manifests': 'Number of kernel-ng overlay package Manifests which had changed and were (re)written.',
+    'digest_cache_hits': 'Number of files whose digests were found in the digest cache.',
+    'digest_cache_misses': 'Number of files which had to be hashed.',
+    'digest_cache_evictions': 'Number of digest cache entries dropped as their files had gone.',
+    'repermissioned_entries': 'Number of kernel-ng overlay entries whose ownership or permissions were corrected.',
+    'staged_links': 'Number of files hard linked into the staged kernel-ng overlay.',
+    'synced_files': 'Number of staged kernel-ng overlay files synced to disk before publishing.',
+    'kernel_index_hits': 'Number of repositories whose kernel index entry was still valid.',
+    'kernel_index_misses': 'Number of repositories whose kernel index entry was (partly) rebuilt.',
+    'kernel_index_portage_lookups': 'Number of ebuilds whose metadata was missing from the md5-cache.',
+    'batch_commands': 'Number of commands run by kernelng batch.',
+    'batch_failures': 'Number of commands run by kernelng batch which failed.',
+    'wrap_cache_hits': 'Number of text-wrapping requests answered from the wrap cache.',
+    'wrap_cache_misses': 'Number of text-wrapping requests which had to be wrapped.',
+}
+
+metrics_file = None
+
+_lock = threading.Lock()
+_phases = OrderedDict()
+_counts = OrderedDict()
+_command = None
+_exit_status = None
+
+def set_metrics_file(ctx, option, value):
+    global metrics_file
+    if value is None:
+        return
+    metrics_file = value
+
+def set_command(command_path):
+    global _command
+    _command = command_path
+
+def set_exit_status(status):
+    global _exit_status
+    _exit_status = status
+
+def reset():
+    '''
+    Forgets everything recorded so far (and the metrics file), as at startup.
+    '''
+    global metrics_file, _command, _exit_status
+    with _lock:
+        _phases.clear()
+        _counts.clear()
+    metrics_file = _command = _exit_status = None
+
+@contextmanager
+def phase(name):
+    '''
+    Accumulates the wall-clock time spent inside the with-block under the
+    given phase name.
+    '''
+    started = time.time()
+    try:
+        yield
+    finally:
+        elapsed = time.time() - started
+        with _lock:
+            _phases[name] = _phases.get(name, 0.0) + elapsed
+
+def count(name, n=1):
+    with _lock:
+        _counts[name] = _counts.get(name, 0) + n
+
+def set_count(name, n):
+    with _lock:
+        _counts[name] = n
+
+def _escape_label(value):
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def render():
+    '''
+    Returns the recorded metrics in the prometheus text exposition format.
+    '''
+    lines = []
+    def gauge(name, helptext, samples):
+        name = '%s_%s' % (METRIC_PREFIX, name)
+        lines.append('# HELP %s %s' % (name, helptext))
+        lines.append('# TYPE %s gauge' % name)
+        for labels, value in samples:
+            if labels:
+                lines.append('%s{%s} %s' % (name, ','.join(
+                    '%s="%s"' % (k, _escape_label(v)) for k, v in labels), value))
+            else:
+                lines.append('%s %s' % (name, value))
+
+    with _lock:
+        phases = list(_phases.items())
+        counts = list(_counts.items())
+
+    gauge('run_info', 'Version and command of the last kernelng run.',
+        [((('version', version), ('command', _command or '')), 1)])
+    gauge('last_run_timestamp_seconds', 'Time at which the last kernelng run finished.',
+        [((), '%.3f' % time.time())])
+    if phases:
+        gauge('phase_duration_seconds', 'Wall-clock time spent in each phase of the kernelng run.',
+            [((('phase', phase_name),), '%.6f' % seconds) for phase_name, seconds in phases])
+    for name, value in counts:
+        gauge(name, METRIC_HELP.get(name, name.replace('_', ' ').capitalize() + '.'),
+            [((), value)])
+    gauge('exit_status', 'Exit status of the last kernelng run.',
+        [((), 0 if _exit_status is None else _exit_status)])
+    return '\n'.join(lines) + '\n'
+
+def write_metrics(path):
+    '''
+    Atomically (re)writes the .prom file at path: the textfile collector must
+    never observe a partially written file, so we write to a temporary file in
+    the same directory and rename it into place.
+    '''
+    dirname = os.path.dirname(os.path.abspath(path))
+    tmppath = os.path.join(dirname, '.%s.%d.tmp' % (os.path.basename(path), os.getpid()))
+    try:
+        with open(tmppath, 'w') as f:
+            f.write(render())
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(tmppath, 0o644)
+        os.rename(tmppath, path)
+    except Exception:
+        try:
+            os.unlink(tmppath)
+        except OSError:
+            pass
+        raise
+
+def write_metrics_file():
+    '''
+    Writes the metrics file given by --metrics-file, if any (as at exit).
+    '''
+    if metrics_file is None:
+        return
+    try:
+        write_metrics(metrics_file)
+    except (IOError, OSError) as e:
+        sys.stderr.write('kernelng: could not write metrics file %s: %s\n' % (metrics_file, e))
+
+atexit.register(write_metrics_file)
@@ -35,12 +35,16 @@ import re
 import codecs
 import locale
 import os
+import atexit
+import threading
+import time
 
-from argparse import HelpFormatter
-from functools import wraps, partial
+from queue import SimpleQueue, Empty
+from contextvars import ContextVar
+
+from functools import wraps, partial, lru_cache
 from inspect import isclass, ismethod
 from .utils import is_string
-import wrapt
 import click
 
 def encoder(text, _encoding_):
@@ -89,49 +93,369 @@ def set_verbose_level(ctx, option, value):
     else:
         verbose_level = value
 
-def echov(message=None, vl=1, file=None, nl=True, err=None):
+OUTPUT_BUFFERING_MODES = ('auto', 'line', 'block', 'none')
+OUTPUT_BUFSIZE = 8192
+
+class OutputChannel(object):
+    '''
+    Buffers the messages written by echov and sechov so that each one does not
+    cost a stream lookup, write and flush of its own.  Each of standard output
+    and standard error gets its own buffer, which is handed to click.echo in a
+    single piece when it is flushed.  The buffering mode may be:
+
+      auto: line-buffered if the stream is a terminal, block-buffered otherwise
+      line: flush after every message containing a newline
+      block: flush once OUTPUT_BUFSIZE characters have accumulated
+      none: flush after every message (the historical behavior)
+
+    Whenever output switches from one stream to the other, the pending output of
+    the first stream is flushed, so that their relative order is preserved when
+    both are redirected to the same place.  Everything is flushed at exit.
+    '''
+    def __init__(self, buffering='auto', bufsize=OUTPUT_BUFSIZE):
+        # reentrant so that a signal handler which flushes cannot deadlock
+        # against an interrupted write in the same thread
+        self._lock = threading.RLock()
+        self._buffers = {False: [], True: []}
+        self._sizes = {False: 0, True: 0}
+        self._modes = {}
+        self._last = None
+        self.bufsize = bufsize
+        self.buffering = buffering
+
+    @property
+    def buffering(self):
+        return self._buffering
+
+    @buffering.setter
+    def buffering(self, value):
+        if value not in OUTPUT_BUFFERING_MODES:
+            raise ValueError('Unknown output buffering mode "%s"' % value)
+        self.flush()
+        self._buffering = value
+        self._modes.clear()
+
+    def _mode(self, err):
+        mode = self._modes.get(err)
+        if mode is None:
+            mode = self._buffering
+            if mode == 'auto':
+                stream = click.get_text_stream('stderr' if err else 'stdout')
+                try:
+                    mode = 'line' if stream.isatty() else 'block'
+                except Exception:
+                    mode = 'block'
+            self._modes[err] = mode
+        return mode
+
+    def write(self, message=None, nl=True, err=False):
+        if message is None:
+            message = ''
+        elif isinstance(message, bytes):
+            # no sensible way to buffer these alongside text; punt to click.
+            with self._lock:
+                self.flush()
+                click.echo(message, nl=nl, err=err)
+            return
+        elif not is_string(message):
+            message = str(message)
+        if nl:
+            message += '\n'
+        with self._lock:
+            if self._last is not None and self._last != err:
+                self._flush_one(self._last)
+            self._last = err
+            self._buffers[err].append(message)
+            self._sizes[err] += len(message)
+            mode = self._mode(err)
+            if mode == 'none' or \
+                    (mode == 'line' and '\n' in message) or \
+                    self._sizes[err] >= self.bufsize:
+                self._flush_one(err)
+
+    def _flush_one(self, err):
+        buf = self._buffers[err]
+        if buf:
+            data = ''.join(buf)
+            del buf[:]
+            self._sizes[err] = 0
+            if log_format == 'jsonl':
+                # nothing for click.echo to strip; write it straight out.
+                stream = click.get_text_stream('stderr' if err else 'stdout')
+                stream.write(data)
+                stream.flush()
+            else:
+                if color_enabled:
+                    # unless colour was forced, click still strips the escapes
+                    # should this particular stream turn out not to be a terminal
+                    click.echo(data, nl=False, err=err, color=color_forced or None)
+                else:
+                    if '\033' in data:
+                        # styled before colour was decided (see kngstyle_static)
+                        data = click.unstyle(data)
+                    click.echo(data, nl=False, err=err, color=True)
+
+    def flush(self):
+        with self._lock:
+            for err in (False, True):
+                self._flush_one(err)
+
+    def _after_fork(self):
+        # whatever the parent had buffered is the parent's to write, and the
+        # child may well be given different streams (see kernelng.server)
+        self._lock = threading.RLock()
+        self._buffers = {False: [], True: []}
+        self._sizes = {False: 0, True: 0}
+        self._modes.clear()
+        self._last = None
+
+_channel = OutputChannel()
+atexit.register(_channel.flush)
+os.register_at_fork(after_in_child=_channel._after_fork)
+
+def flush_output():
+    '''
+    Writes out anything buffered by echov and sechov.
+    '''
+    _channel.flush()
+
+def set_output_buffering(ctx, option, value):
+    if value is None:
+        return
+    _channel.buffering = value
+
+# In 'jsonl' mode, every echov/sechov message and trace line becomes a single-line
+# JSON object with level, timestamp, subsystem and message fields, and no styling.
+LOG_FORMATS = ('text', 'jsonl')
+VERBOSE_LEVEL_NAMES = {0: 'notice', 1: 'info', 2: 'verbose', 3: 'debug'}
+
+log_format = 'text'
+
+def set_log_format(ctx, option, value):
+    global log_format
+    if value is None:
+        return
+    _channel.flush()
+    log_format = value
+
+# Colour is decided once, up front, rather than by styling everything and then
+# stripping the escapes back out again wherever they are unwanted: kngstyle
+# returns plain text when colour is off, so that piped and cron output costs
+# neither the styling nor the stripping.  The default comes from the
+# environment and the terminal; the parsed --color/--no-color options then
+# override it.  The little styled text built at import time (the help
+# strings, for instance), before any option has been parsed, is always styled
+# (see kngstyle_static), and stripped where it is shown uncoloured.
+STYLE_CACHE_SIZE = 1024
+
+def decide_color(stream=None):
+    '''
+    Returns whether output should be coloured by default: not if NO_COLOR is
+    set, otherwise only if stream (standard output by default) is a terminal.
+    '''
+    if os.environ.get('NO_COLOR'):
+        return False
+    try:
+        return (stream or sys.stdout).isatty()
+    except Exception:
+        return False
+
+color_enabled = decide_color()
+# set by --color/--no-color: escapes then go even to streams that are not
+# terminals, rather than being stripped from them
+color_forced = False
+
+def set_color(enabled, forced=False):
+    global color_enabled, color_forced
+    _channel.flush()
+    color_enabled, color_forced = bool(enabled), forced
+
+DEFAULT_OUTPUT_SETTINGS = (verbose_level, log_format, _channel.buffering, color_enabled, color_forced)
+
+def save_output_settings():
+    '''
+    Returns the current verbosity, log format, buffering and colour modes, for
+    restore_output_settings.
+    '''
+    return (verbose_level, log_format, _channel.buffering, color_enabled, color_forced)
+
+def restore_output_settings(settings=None):
+    '''
+    Restores settings saved by save_output_settings or, if settings is None,
+    the defaults in effect before any command-line option was processed.
+    '''
+    global verbose_level, log_format, color_enabled, color_forced
+    _channel.flush()
+    verbose_level, log_format, _channel.buffering, color_enabled, color_forced = \
+        settings or DEFAULT_OUTPUT_SETTINGS
+
+@lru_cache(maxsize=STYLE_CACHE_SIZE)
+def _styled(text, **styles):
+    return click.style(text, **styles)
+
+def kngstyle(text, **styles):
+    '''
+    click.style, except that no escape sequences are generated at all when
+    they would only be thrown away, i.e., when colour is off or in jsonl log
+    mode.  The same few tokens get styled over and over, so the results are
+    cached.
+    '''
+    if not color_enabled or log_format == 'jsonl':
+        return text
+    return _styled(text, **styles)
+
+def kngstyle_static(text, **styles):
+    '''
+    click.style, for text styled at import time, before colour has been
+    decided: the escapes are always generated, and stripped again wherever
+    the text turns out to be shown uncoloured.
+    '''
+    return _styled(text, **styles)
+
+def _iso_timestamp(t):
+    return '%s.%06dZ' % (time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(t)), int((t % 1) * 1000000))
+
+def _caller_subsystem(depth=2):
+    # the name of the kernelng module on whose behalf a message is logged.
+    try:
+        name = sys._getframe(depth).f_globals.get('__name__', '')
+    except ValueError:
+        return 'kernelng'
+    if name.startswith('kernelng.'):
+        name = name[len('kernelng.'):]
+    return name
+
+def jsonl_record(message, level, subsystem, **extra):
+    '''
+    Formats one jsonl log event.  Messages are expected to be free of ANSI
+    escapes in jsonl mode; any stragglers (i.e., from strings styled before
+    the log format was known) are removed.
+    '''
+    if message is None:
+        message = ''
+    elif isinstance(message, bytes):
+        message = message.decode('utf-8', 'replace')
+    elif not is_string(message):
+        message = str(message)
+    if '\033' in message:
+        message = click.unstyle(message)
+    record = {
+        'level': level,
+        'timestamp': _iso_timestamp(time.time()),
+        'subsystem': subsystem,
+        'message': message,
+    }
+    record.update(extra)
+    import json
+    return json.dumps(record, sort_keys=True)
+
+def echov(message=None, vl=1, file=None, nl=True, err=None, subsystem=None):
     if verbose_level >= vl:
         if err is None:
             if vl>= 3:
                 err=True
             else:
                 err=False
-        click.echo(message, file, nl, err)
+        if file is not None:
+            click.echo(message, file, nl, err)
+        elif log_format == 'jsonl':
+            _channel.write(jsonl_record(message, VERBOSE_LEVEL_NAMES.get(vl, 'debug'),
+                subsystem or _caller_subsystem()), True, err)
+        else:
+            _channel.write(message, nl, err)
 
-def sechov(text, vl=1, file=None, nl=True, err=None, **styles):
+def sechov(text, vl=1, file=None, nl=True, err=None, subsystem=None, **styles):
     if verbose_level >= vl:
         if err is None:
             if vl>= 3:
                 err=True
             else:
                 err=False
-        click.secho(text, file, nl, err, **styles)
+        if file is not None:
+            click.secho(text, file, nl, err, **styles)
+        elif log_format == 'jsonl':
+            _channel.write(jsonl_record(text, VERBOSE_LEVEL_NAMES.get(vl, 'debug'),
+                subsystem or _caller_subsystem()), True, err)
+        else:
+            _channel.write(kngstyle(text, **styles) if styles else text, nl, err)
+
+def echo_data(message=None, file=None, nl=True):
+    '''
+    Writes message, which is data (a configuration file, say) rather than a
+    diagnostic, to file or, by default, standard output (through the output
+    channel, so that it stays in order with any diagnostics).  Unlike echov,
+    it is neither subject to the verbosity nor reformatted per --log-format.
+    '''
+    if file is not None:
+        click.echo(message, file, nl)
+    else:
+        _channel.write(message, nl, False)
 
 # we use this dummy as an alternative to None so that valid NoneType keyword arguments
 # can be distinguished from missing arguments.
 _seriously_invalid_argument = object()
 
+# Tracer state lives in context variables rather than on the AutoTracer
+# instance, so that each thread (and each asyncio task, which runs in a copy
+# of its creator's context) gets its own indentation and suppression counts.
+_trace_indent = ContextVar('kernelng_trace_indent', default=0)
+_trace_suppression = ContextVar('kernelng_trace_suppression', default=0)
+
+# sentinels understood by the trace writer thread
+_trace_stop = object()
+_trace_flush = object()
+
+def _trace_tag():
+    '''
+    Returns a short identifier for the thread -- and asyncio task, if any --
+    on whose behalf a trace line is being generated.
+    '''
+    tag = threading.current_thread().name
+    # no need to pay for importing asyncio if nobody else has
+    asyncio = sys.modules.get('asyncio')
+    if asyncio is not None:
+        try:
+            task = asyncio.current_task()
+        except (RuntimeError, AttributeError):
+            task = None
+        if task is not None:
+            getname = getattr(task, 'get_name', None)
+            tag = '%s/%s' % (tag, getname() if getname else '%x' % id(task))
+    return tag
+
 class AutoTracer(object):
     def __init__(self):
-        self._indent = 0
-        self._suppression = 0
+        # trace lines are formatted by the traced thread but written by a
+        # single background thread, so that tracing never makes workers
+        # contend for the output stream.
+        self._queue = SimpleQueue()
+        self._writer = None
+        self._writer_lock = threading.Lock()
+
+    @property
+    def _indent(self):
+        return _trace_indent.get()
+
+    @property
+    def _suppression(self):
+        return _trace_suppression.get()
 
     def style_fn(self, f, arglist):
         return ''.join((
             '  ' * min(self._indent, 20),
-            click.style(f, fg='blue', bold=True),
-            click.style('(', fg='white', bold=True),
+            kngstyle(f, fg='blue', bold=True),
+            kngstyle('(', fg='white', bold=True),
             self._style_arglist(arglist),
-            click.style(')', fg='white', bold=True),
+            kngstyle(')', fg='white', bold=True),
         ))
 
     def style_rvfn(self, f, rv):
         return ''.join((
             '  ' * max(min(self._indent - 1, 20), 0),
-            click.style(f, fg='blue', bold=True),
-            click.style('()', fg='white', bold=True),
+            kngstyle(f, fg='blue', bold=True),
+            kngstyle('()', fg='white', bold=True),
             ' ',
-            click.style('<--', fg='green', bold=True),
+            kngstyle('<--', fg='green', bold=True),
             ' ',
             self._style_obj(rv, objcolor='magenta')
         ))
@@ -139,35 +463,35 @@ class AutoTracer(object):
         return ''.join((
             '  ' * min(self._indent, 20),
             self._style_obj(mi, m),
-            click.style('.', fg='white', bold=True),
-            click.style(m, fg='blue', bold=True),
-            click.style('(', fg='white', bold=True),
+            kngstyle('.', fg='white', bold=True),
+            kngstyle(m, fg='blue', bold=True),
+            kngstyle('(', fg='white', bold=True),
             self._style_arglist(arglist),
-            click.style(')', fg='white', bold=True),
+            kngstyle(')', fg='white', bold=True),
         ))
 
     def style_cm(self, cls, cm, arglist):
         return ''.join((
             '  ' * min(self._indent, 20),
             '<',
-            click.style(mc.__name__, fg='yellow', bold=True),
+            kngstyle(mc.__name__, fg='yellow', bold=True),
             ' class>',
-            click.style('.', fg='white', bold=True),
-            click.style(cm, fg='blue', bold=True),
-            click.style('(', fg='white', bold=True),
+            kngstyle('.', fg='white', bold=True),
+            kngstyle(cm, fg='blue', bold=True),
+            kngstyle('(', fg='white', bold=True),
             self._style_arglist(arglist),
-            click.style(')', fg='white', bold=True),
+            kngstyle(')', fg='white', bold=True),
         ))
 
     def style_rvm(self, mi, m, rv):
         return ''.join((
             '  ' * max(min(self._indent - 1, 20), 0),
             self._style_obj(mi, m),
-            click.style('.', fg='white', bold=True),
-            click.style(m, fg='blue', bold=True),
-            click.style('()', fg='white', bold=True),
+            kngstyle('.', fg='white', bold=True),
+            kngstyle(m, fg='blue', bold=True),
+            kngstyle('()', fg='white', bold=True),
             ' ',
-            click.style('<--', fg='green', bold=True),
+            kngstyle('<--', fg='green', bold=True),
             ' ',
             self._style_obj(rv, objcolor='magenta'),
         ))
@@ -176,13 +500,13 @@ class AutoTracer(object):
         return ''.join((
             '  ' * max(min(self._indent - 1, 20), 0),
             '<',
-            click.style(cls.__name__, fg='yellow', bold=True),
+            kngstyle(cls.__name__, fg='yellow', bold=True),
             ' class>',
-            click.style('.', fg='white', bold=True),
-            click.style(cm, fg='blue', bold=True),
-            click.style('()', fg='white', bold=True),
+            kngstyle('.', fg='white', bold=True),
+            kngstyle(cm, fg='blue', bold=True),
+            kngstyle('()', fg='white', bold=True),
             ' ',
-            click.style('<--', fg='green', bold=True),
+            kngstyle('<--', fg='green', bold=True),
             ' ',
             self._style_obj(rv, objcolor='magenta'),
         ))
@@ -190,12 +514,12 @@ class AutoTracer(object):
     def _errobj_style(self, obj, e, objcolor='yellow'):
         try:
             return '%s%s<%s%s%s>%s' % (
-                click.style(obj.__class__.__name__, fg=objcolor, bold=True),
-                click.style('(', fg='white', bold=True),
-                click.style('WTF', fg='red', bold=True),
-                click.style(':', fg='white', bold=False),
-                click.style(repr(e), fg='red', bold=False),
-                click.style(')', fg='white', bold=True)
+                kngstyle(obj.__class__.__name__, fg=objcolor, bold=True),
+                kngstyle('(', fg='white', bold=True),
+                kngstyle('WTF', fg='red', bold=True),
+                kngstyle(':', fg='white', bold=False),
+                kngstyle(repr(e), fg='red', bold=False),
+                kngstyle(')', fg='white', bold=True)
             )
         except Exception as e:
             try:
@@ -207,38 +531,38 @@ class AutoTracer(object):
         try:
             if m in ['__repr__', '__str__', '__getattr__', '__getitem__']:
                 return '%s%s' % (
-                    click.style(mi.__class__.__name__, fg=objcolor, bold=True),
-                    click.style('()', fg='white', bold=True)
+                    kngstyle(mi.__class__.__name__, fg=objcolor, bold=True),
+                    kngstyle('()', fg='white', bold=True)
                 )
             if mi is None:
-                return click.style('<None>', fg=objcolor, bold=True)
+                return kngstyle('<None>', fg=objcolor, bold=True)
             elif isinstance(mi, bool):
-                return click.style('%r' % mi, fg=objcolor, bold=True)
+                return kngstyle('%r' % mi, fg=objcolor, bold=True)
             rv = repr(mi)
             if len(rv) > 20:
                 if is_string(mi):
                     return("%s%s...%s%s" % (
-                        click.style(rv[0], fg='white', bold=True),
-                        click.style(rv[1:8], fg=objcolor, bold=True),
-                        click.style(rv[-7:-1], fg=objcolor, bold=True),
-                        click.style(rv[-1], fg='white', bold=True)
+                        kngstyle(rv[0], fg='white', bold=True),
+                        kngstyle(rv[1:8], fg=objcolor, bold=True),
+                        kngstyle(rv[-7:-1], fg=objcolor, bold=True),
+                        kngstyle(rv[-1], fg='white', bold=True)
                     ))
                 else:
                     rv = '[%s...%s]' % (
-                            click.style(rv[:8], fg='magenta', bold=False),
-                            click.style(rv[-7:], fg='magenta', bold=False)
+                            kngstyle(rv[:8], fg='magenta', bold=False),
+                            kngstyle(rv[-7:], fg='magenta', bold=False)
                     )
             else:
                 if is_string(mi):
-                    return click.style(rv, fg=objcolor, bold=True)
+                    return kngstyle(rv, fg=objcolor, bold=True)
                 else:
-                    rv = click.style(rv, fg='magenta', bold=False)
+                    rv = kngstyle(rv, fg='magenta', bold=False)
 
             return '%s%s%s%s' % (
-                click.style(mi.__class__.__name__, fg=objcolor, bold=True),
-                click.style('(', fg='white', bold=True),
+                kngstyle(mi.__class__.__name__, fg=objcolor, bold=True),
+                kngstyle('(', fg='white', bold=True),
                 rv,
-                click.style(')', fg='white', bold=True)
+                kngstyle(')', fg='white', bold=True)
             )
         except Exception as e:
             return self._errobj_style(mi, e)
@@ -268,27 +592,116 @@ class AutoTracer(object):
     def say(self, lambdasomething, warning=False, arg=_seriously_invalid_argument):
         if self._suppression <= 0 and has_verbose_level(3) or (warning and has_verbose_level(1)):
             if arg is not _seriously_invalid_argument:
-                echov(lambdasomething(arg), err=True)
+                line = lambdasomething(arg)
             else:
-                echov(lambdasomething(), err=True)
+                line = lambdasomething()
+            if log_format == 'jsonl':
+                self._emit(jsonl_record(line.lstrip(' '), 'warning' if warning else 'trace',
+                    'trace', thread=_trace_tag(), depth=self._indent))
+            else:
+                self._emit(''.join((
+                    kngstyle('[%s]' % _trace_tag(), fg='white', bold=False),
+                    ' ',
+                    line
+                )))
+
+    def _emit(self, line):
+        if self._writer is None:
+            self._start_writer()
+        self._queue.put(line)
+
+    def _start_writer(self):
+        with self._writer_lock:
+            if self._writer is None:
+                writer = threading.Thread(target=self._write_loop, name='kernelng-trace')
+                writer.daemon = True
+                writer.start()
+                self._writer = writer
+
+    def _write_loop(self):
+        q = self._queue
+        while True:
+            lines = [q.get()]
+            # drain whatever else has piled up so that a burst of trace
+            # output costs a single write.
+            while True:
+                try:
+                    lines.append(q.get_nowait())
+                except Empty:
+                    break
+            text = [line for line in lines if is_string(line)]
+            if text:
+                _channel.write('\n'.join(text), err=True)
+            for line in lines:
+                if line is _trace_stop:
+                    return
+                elif isinstance(line, tuple) and line[0] is _trace_flush:
+                    line[1].set()
+
+    def flush(self, timeout=None):
+        '''
+        Blocks until every trace line queued so far has been written.
+        '''
+        if self._writer is None or not self._writer.is_alive():
+            return
+        done = threading.Event()
+        self._queue.put((_trace_flush, done))
+        done.wait(timeout)
+
+    def shutdown(self, timeout=5):
+        '''
+        Writes any queued trace lines and stops the writer thread.
+        '''
+        writer = self._writer
+        if writer is None or not writer.is_alive():
+            return
+        self._queue.put(_trace_stop)
+        writer.join(timeout)
+        self._writer = None
+
+    def _after_fork(self):
+        # the writer thread did not survive the fork; start over in the child
+        # (whatever the parent had queued is the parent's to write)
+        self._queue = SimpleQueue()
+        self._writer = None
+        self._writer_lock = threading.Lock()
 
     def indent(self):
-        self._indent += 1
+        _trace_indent.set(_trace_indent.get() + 1)
     def dedent(self):
-        self._indent -= 1
-        if self._indent < 0:
-            # oops, fuck it, I guess
-            self._indent = 0
+        # oops, fuck it, I guess -- never go below zero
+        _trace_indent.set(max(_trace_indent.get() - 1, 0))
     def suppress(self):
-        self._suppression += 1
+        _trace_suppression.set(_trace_suppression.get() + 1)
     def unsuppress(self):
-        self._suppression -= 1
+        _trace_suppression.set(_trace_suppression.get() - 1)
 
 _at = AutoTracer()
 
-def trace(wrapped=None, warning=False):
-    if wrapped is None:
-        return partial(trace, warning=warning)
+def shutdown_tracing():
+    '''
+    Writes any queued trace lines and stops the trace writer thread.
+    '''
+    _at.shutdown()
+
+atexit.register(shutdown_tracing)
+os.register_at_fork(after_in_child=_at._after_fork)
+
+# Trace output only appears at --debug verbosity, but wrapping every traced
+# function (and importing wrapt to do so) costs startup time, and a call overhead
+# on every traced call.  So, unless KERNELNG_TRACE is set in the environment,
+# @trace hands back a _LazyTrace, which passes calls straight through (binding
+# methods without any wrapper at all) until the parsed --debug option has
+# raised the verbosity -- whether on the command line, a batch line or a
+# command forwarded to a server -- and only then wraps the function.  Warning
+# traces are shown at the default verbosity and therefore always wrapped.
+tracing_enabled = bool(os.environ.get('KERNELNG_TRACE'))
+
+def tracing_active():
+    return tracing_enabled or verbose_level >= 3
+
+def _traced(wrapped, warning):
+    import wrapt
 
     @wrapt.decorator
     def trace_decorator(wrapped, instance, args, kwargs):
@@ -333,9 +746,42 @@ def trace(wrapped=None, warning=False):
 
     return trace_decorator(wrapped)
 
+class _LazyTrace(object):
+    def __init__(self, wrapped, warning):
+        wraps(wrapped)(self)
+        self._warning = warning
+        self._traced = None
+
+    def _tracer(self):
+        if self._traced is None:
+            self._traced = _traced(self.__wrapped__, self._warning)
+        return self._traced
+
+    def __get__(self, instance, owner=None):
+        if tracing_active():
+            return self._tracer().__get__(instance, owner)
+        return self.__wrapped__.__get__(instance, owner)
+
+    def __call__(self, *args, **kwargs):
+        if tracing_active():
+            return self._tracer()(*args, **kwargs)
+        return self.__wrapped__(*args, **kwargs)
+
+    def __repr__(self):
+        return repr(self.__wrapped__)
+
+def trace(wrapped=None, warning=False):
+    if wrapped is None:
+        return partial(trace, warning=warning)
+    if tracing_enabled or warning:
+        return _traced(wrapped, warning)
+    return _LazyTrace(wrapped, warning)
+
 def suppress_tracing(f):
     @wraps(f)
     def wrapper(*args, **kwargs):
+        if not tracing_active():
+            return f(*args, **kwargs)
         _at.suppress()
         try:
             return f(*args, **kwargs)
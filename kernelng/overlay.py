@@ -0,0 +1,702 @@
+#!/usr/bin/env python
+#-*- coding:utf-8 -*-
+# vim:ai:sta:et:ts=4:sw=4:sts=4
+
+"""kernelng 0.x
+ Tool for maintaining customized overlays of kernel-ng.eclass-based ebuilds
+
+Copyright 2005-2014 Gentoo Foundation
+
+        Copyright (C) 2014 Gregory M. Turner <gmt@be-evil.net>
+
+Distributed under the terms of the GNU General Public License v2
+ This program is free software; you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, version 2 of the License.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program; if not, write to the Free Software
+ Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA 02110-1301, USA.
+
+"""
+
+from __future__ import print_function
+
+import os
+import json
+import stat
+import errno
+import hashlib
+
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from .config import FRAMEWORK, PROGNAME, PROGDESC, portage_dbapi
+from .ebuildtemplate import ebuild_templates, KNGTemplateError
+from .kernelindex import KERNEL_CATEGORY, METADATA_KEYS, ENTRY_MD5, ENTRY_ECLASSES, \
+    ENTRY_METADATA, kernel_index
+from .output import echov, trace, kngstyle
+from .digestcache import digest_cache
+from .manifest import MANIFEST, MANIFEST_HASHES, dist_entries, package_manifest
+from .staging import OverlayStage, KNGStageError, staged_paths, lock_overlay, unpublish, remove_trees
+from .reposconf import register_repo, deregister_repo, KNGReposConfError
+from .version import version
+from . import metrics
+
+# The overlay mirrors each sys-kernel/*-sources ebuild in the configured
+# portage repositories with two generated ebuilds: an "ng" package, which
+# builds and installs a kernel per the kernel-ng configuration, and a "no"
+# package, which installs the kernel alone, without its sources.
+
+# Records, per generated ebuild, the digest of everything it was generated
+# from, so that "overlay update" need regenerate only what has changed.
+STATE_FILE = os.path.join('metadata', '%s-state.json' % FRAMEWORK)
+STATE_FORMAT = 1
+
+LAYOUT_CONF = os.path.join('metadata', 'layout.conf')
+
+# the repository providing the eclasses (and profiles) the overlay relies on
+MASTER_REPO = 'gentoo'
+
+# identifies ebuilds we generated (and therefore may replace or remove)
+GENERATED_MARKER = '# Generated by %s' % PROGDESC
+
+class KNGOverlayError(Exception):
+    pass
+
+# One upstream kernel ebuild: tree is the location of its repository, cp
+# its category/package, pvr its version (with any revision), stamp the
+# (_md5_, _eclasses_) pair identifying what it was generated from, and
+# metadata a tuple of its kernelindex.METADATA_KEYS values.
+KernelSource = namedtuple('KernelSource', ('repo', 'tree', 'cp', 'pn', 'pvr', 'stamp', 'metadata'))
+
+# One ebuild to generate: flavor is 'ng' or 'no', path is relative to the
+# overlay root and digest is that of its inputs.
+GeneratedEbuild = namedtuple('GeneratedEbuild', ('flavor', 'cp', 'path', 'source', 'digest'))
+
+@trace
+def overlay_location(conf):
+    '''
+    Returns the configured filesystem location of the overlay.
+    '''
+    return conf.globals['overlay_location'].value
+
+@trace
+def scan_kernel_sources(dbapi, exclude=(), index=None):
+    '''
+    Generates a KernelSource for every sys-kernel/*-sources ebuild in each of
+    portage's repositories, save those located at any of the exclude paths
+    (i.e., the overlay itself), from the KernelIndex index (by default, the
+    process-wide one), which is brought up to date as it goes.
+    '''
+    if index is None:
+        index = kernel_index()
+    exclude = set(os.path.realpath(path) for path in exclude)
+    for tree in dbapi.porttrees:
+        if os.path.realpath(tree) in exclude:
+            continue
+        repo = dbapi.getRepositoryName(tree)
+        for pn, entries in sorted(index.packages(tree, dbapi).items()):
+            cp = '%s/%s' % (KERNEL_CATEGORY, pn)
+            for pvr, entry in sorted(entries.items()):
+                yield KernelSource(repo, tree, cp, pn, pvr, (entry[ENTRY_MD5], entry[ENTRY_ECLASSES]),
+                    tuple(entry[ENTRY_METADATA:]))
+
+def _package_sections(conf):
+    '''
+    Returns a list of (atom, settings-dict) pairs, one per package section of
+    conf, in file order.
+    '''
+    from portage.dep import Atom
+    from portage.exception import InvalidAtom
+    result = []
+    for section, items in conf.items():
+        if section in ('global', 'implicit_global') or items.fetal:
+            continue
+        try:
+            atom = Atom(section)
+        except InvalidAtom:
+            echov('%s: ignoring section [%s], which is not a package atom.' % (
+                PROGNAME, section), 0, err=True)
+            continue
+        result.append((atom, dict(items.iterkeypairs())))
+    return result
+
+@trace
+def effective_settings(global_settings, package_sections, source):
+    '''
+    Returns the dict of settings in effect for the KernelSource source: the
+    global settings, overridden by those of each package section matching
+    source in turn (so where several match, the last one wins).
+    '''
+    from portage.dep import match_from_list
+    settings = dict(global_settings)
+    cpv = '%s-%s' % (source.cp, source.pvr)
+    for atom, section_settings in package_sections:
+        if match_from_list(atom, [cpv]):
+            settings.update(section_settings)
+    return settings
+
+def resolve_names(settings, source):
+    '''
+    Returns the (ng, no) package names of the overlay packages mirroring the
+    KernelSource source, given its effective settings: name_override and
+    no_name_override, if set (in a package section), or else name_prefix and
+    no_name_prefix, prepended to the upstream package name.
+    '''
+    return (
+        settings.get('name_override') or settings.get('name_prefix', '') + source.pn,
+        settings.get('no_name_override') or settings.get('no_name_prefix', '') + source.pn,
+    )
+
+def _generator_digest(template):
+    # everything about this version of the generator, and the template in
+    # effect, bearing on its output
+    return hashlib.sha1(json.dumps([version, GENERATED_MARKER, template.text]
+        ).encode('utf-8')).hexdigest()
+
+def input_digest(generator, flavor, source, settings):
+    '''
+    Returns the digest of the inputs of the flavor ebuild generated from the
+    KernelSource source, with the given effective settings, by the generator
+    (whose digest, which covers the flavor's template, is as returned by
+    _generator_digest()).
+    '''
+    return hashlib.sha1(json.dumps([generator, flavor, source.repo, source.cp, source.pvr,
+        source.stamp, source.metadata, sorted(settings.items())]).encode('utf-8')).hexdigest()
+
+@trace
+def plan_ebuilds(conf, sources, templates):
+    '''
+    Returns the list of GeneratedEbuilds mirroring sources, to be rendered
+    from the {flavor: EbuildTemplate} templates.  Should two sources map
+    onto the same overlay ebuild, the first wins and the other is reported
+    and skipped.
+    '''
+    global_settings = dict(conf.globals.iterkeypairs())
+    package_sections = _package_sections(conf)
+    generators = dict((flavor, _generator_digest(template))
+        for flavor, template in templates.items())
+    planned = {}
+    for source in sources:
+        settings = effective_settings(global_settings, package_sections, source)
+        for flavor, name in zip(('ng', 'no'), resolve_names(settings, source)):
+            cp = '%s/%s' % (KERNEL_CATEGORY, name)
+            path = os.path.join(KERNEL_CATEGORY, name, '%s-%s.ebuild' % (name, source.pvr))
+            if path in planned:
+                other = planned[path].source
+                echov('%s: %s-%s::%s and %s-%s::%s both map onto %s; skipping the latter.' % (
+                    PROGNAME, other.cp, other.pvr, other.repo, source.cp, source.pvr,
+                    source.repo, path), 0, err=True)
+                continue
+            planned[path] = GeneratedEbuild(flavor, cp, path, source,
+                input_digest(generators[flavor], flavor, source, settings))
+    return list(planned.values())
+
+def _bash_quote(value):
+    # the inside of a bash double-quoted string
+    for c in '\\"$`':
+        value = value.replace(c, '\\' + c)
+    return value
+
+def render_ebuild(ebuild, template):
+    '''
+    Returns the text of the GeneratedEbuild ebuild, rendered from the
+    EbuildTemplate template.
+    '''
+    source = ebuild.source
+    values = dict(zip(METADATA_KEYS, (_bash_quote(value) for value in source.metadata)))
+    values.update({
+        'MARKER': GENERATED_MARKER,
+        'FRAMEWORK': FRAMEWORK,
+        'FLAVOR': ebuild.flavor,
+        'NAME': ebuild.cp.split('/', 1)[1],
+        'UPSTREAM': '%s-%s' % (source.cp, source.pvr),
+        'UPSTREAM_PN': source.pn,
+        'UPSTREAM_REPO': source.repo,
+        'UPSTREAM_EAPI': values.pop('EAPI'),
+        'PVR': source.pvr,
+    })
+    return template.render(values)
+
+def _is_generated(path):
+    try:
+        with open(path) as f:
+            head = f.read(512)
+    except (IOError, OSError):
+        return False
+    return GENERATED_MARKER in head
+
+def _write_if_changed(path, text, owner, mode=None):
+    '''
+    Writes text to path unless it already holds exactly that, atomically (via
+    a temporary file renamed into place), giving it the owner (uid, gid) pair
+    and mode if not None.  Returns True if the file was written.
+    '''
+    try:
+        with open(path) as f:
+            if f.read() == text:
+                return False
+    except (IOError, OSError) as e:
+        if e.errno != errno.ENOENT:
+            raise
+    tmppath = os.path.join(os.path.dirname(path), '.%s.%d.tmp' % (os.path.basename(path), os.getpid()))
+    try:
+        with open(tmppath, 'w') as f:
+            f.write(text)
+        if owner is not None:
+            os.chown(tmppath, *owner)
+        if mode is not None:
+            os.chmod(tmppath, mode)
+        os.rename(tmppath, path)
+    except Exception:
+        try:
+            os.unlink(tmppath)
+        except OSError:
+            pass
+        raise
+    return True
+
+def _generate(location, ebuild, template, owner, mode):
+    # runs on the worker pool: nothing in here may produce output
+    return _write_if_changed(os.path.join(location, ebuild.path),
+        render_ebuild(ebuild, template), owner, mode)
+
+def _write_manifest(root, location, pkgdir, dists, cache, owner, mode):
+    # runs on the worker pool: nothing in here may produce output
+    return _write_if_changed(os.path.join(root, pkgdir, MANIFEST),
+        package_manifest(os.path.join(root, pkgdir), dists, cache, os.path.join(location, pkgdir)),
+        owner, mode)
+
+@trace
+def upstream_dists(ebuilds):
+    '''
+    Returns the {package directory: {distfile: entry}} dict of the DIST
+    Manifest entries of the upstream packages of each package of ebuilds.
+    '''
+    manifests = {}
+    rv = {}
+    for ebuild in ebuilds:
+        upstream = os.path.join(ebuild.source.tree, ebuild.source.cp, MANIFEST)
+        if upstream not in manifests:
+            manifests[upstream] = dist_entries(upstream)
+        rv.setdefault(os.path.dirname(ebuild.path), {}).update(manifests[upstream])
+    return rv
+
+@trace
+def load_state(location):
+    '''
+    Returns the {path: input digest} dict recorded by the last update of the
+    overlay at location, or None if there is no (usable) record.
+    '''
+    path = os.path.join(location, STATE_FILE)
+    try:
+        with open(path) as f:
+            state = json.load(f)
+        if state.get('format') == STATE_FORMAT:
+            return state['ebuilds']
+    except (IOError, OSError) as e:
+        if e.errno == errno.ENOENT:
+            return None
+        echov('%s: could not read %s: %s' % (PROGNAME, path, e), 0, err=True)
+    except (ValueError, KeyError, AttributeError):
+        pass
+    echov('%s: ignoring unusable %s; regenerating everything.' % (PROGNAME, path), 0, err=True)
+    return None
+
+@trace
+def save_state(location, ebuilds, owner, modes):
+    '''
+    Records the input digests of ebuilds for the next update.  Returns True
+    if the record changed.
+    '''
+    dirmode, filemode = modes
+    _makedirs(os.path.dirname(os.path.join(location, STATE_FILE)), owner, dirmode)
+    return _write_if_changed(os.path.join(location, STATE_FILE), json.dumps({
+        'format': STATE_FORMAT,
+        'ebuilds': dict((ebuild.path, ebuild.digest) for ebuild in ebuilds),
+    }, indent=1, sort_keys=True) + '\n', owner, filemode)
+
+def _remove(location, paths):
+    '''
+    Removes the ebuilds at the given relative paths, and any package
+    directory thereby emptied.  Returns the list of paths removed.
+    '''
+    removed = []
+    for path in sorted(paths):
+        try:
+            os.unlink(os.path.join(location, path))
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            continue
+        echov('removed %s' % kngstyle(path, fg='red'), 2)
+        removed.append(path)
+    for pkgdir in set(os.path.dirname(path) for path in paths):
+        try:
+            os.rmdir(os.path.join(location, pkgdir))
+        except OSError as e:
+            if e.errno not in (errno.ENOENT, errno.ENOTEMPTY, errno.EEXIST):
+                raise
+    return removed
+
+def _makedirs(path, owner, mode=None):
+    if os.path.isdir(path):
+        return
+    _makedirs(os.path.dirname(path), owner, mode)
+    os.mkdir(path)
+    if owner is not None:
+        os.chown(path, *owner)
+    if mode is not None:
+        # (mkdir's mode is subject to the umask; chmod's isn't)
+        os.chmod(path, mode)
+
+def _overlay_modes(location):
+    '''
+    Returns the (directory mode, file mode) pair new entries of the overlay
+    at location are given: those of the overlay itself and of its
+    profiles/repo_name (as set by "overlay create").
+    '''
+    dirmode = stat.S_IMODE(os.stat(location).st_mode)
+    try:
+        filemode = stat.S_IMODE(os.stat(os.path.join(location, 'profiles', 'repo_name')).st_mode)
+    except OSError:
+        filemode = dirmode & 0o666
+    return (dirmode, filemode)
+
+def _prune(location, keep):
+    '''
+    Removes any ebuild we generated earlier which is not among the relative
+    paths in keep, and any package directory thereby emptied, by inspecting
+    the overlay (for want of a state record).  Returns the list of paths
+    removed.
+    '''
+    removed = []
+    category = os.path.join(location, KERNEL_CATEGORY)
+    try:
+        names = os.listdir(category)
+    except OSError as e:
+        if e.errno == errno.ENOENT:
+            return removed
+        raise
+    for name in names:
+        pkgdir = os.path.join(category, name)
+        if not os.path.isdir(pkgdir):
+            continue
+        entries = os.listdir(pkgdir)
+        for entry in entries:
+            path = os.path.join(KERNEL_CATEGORY, name, entry)
+            if entry.endswith('.ebuild') and path not in keep and \
+                    _is_generated(os.path.join(location, path)):
+                os.unlink(os.path.join(location, path))
+                echov('removed %s' % kngstyle(path, fg='red'), 2)
+                removed.append(path)
+        if entries and not os.listdir(pkgdir):
+            os.rmdir(pkgdir)
+    return removed
+
+def _dir_mode(perm):
+    # directories are searchable wherever they are readable
+    return perm | (perm & 0o444) >> 2
+
+@trace
+def overlay_skeleton(conf):
+    '''
+    Returns the {relative path: text} dict of the files making up an empty
+    overlay as configured in conf.
+    '''
+    return {
+        os.path.join('profiles', 'repo_name'): '%s\n' % conf.globals['overlay'].value,
+        os.path.join('profiles', 'categories'): '%s\n' % KERNEL_CATEGORY,
+        LAYOUT_CONF: ''.join('%s = %s\n' % setting for setting in (
+            ('masters', MASTER_REPO),
+            ('thin-manifests', 'false'),
+            ('manifest-hashes', ' '.join(MANIFEST_HASHES)),
+            ('sign-manifests', 'false'),
+        )),
+    }
+
+def _create_files(root, files, owner, perm):
+    '''
+    Creates the files (a {relative path: text} dict) and the directories
+    leading to them under root, giving each the owner (uid, gid) pair and
+    perm (or, for directories, perm made searchable) as it is created, by
+    way of descriptors relative to its directory's.  Returns the number of
+    entries created.
+    '''
+    dirmode = _dir_mode(perm)
+    created = 0
+    dirfds = {'': os.open(root, os.O_RDONLY | os.O_DIRECTORY)}
+    try:
+        os.fchown(dirfds[''], *owner)
+        os.fchmod(dirfds[''], dirmode)
+        for path, text in sorted(files.items()):
+            parent = ''
+            for part in os.path.dirname(path).split(os.sep):
+                child = os.path.join(parent, part)
+                if child not in dirfds:
+                    try:
+                        os.mkdir(part, dirmode, dir_fd=dirfds[parent])
+                        made = True
+                    except OSError as e:
+                        if e.errno != errno.EEXIST:
+                            raise
+                        made = False
+                    dirfds[child] = os.open(part, os.O_RDONLY | os.O_DIRECTORY, dir_fd=dirfds[parent])
+                    if made:
+                        # (mkdir's mode is subject to the umask; fchmod's isn't)
+                        os.fchown(dirfds[child], *owner)
+                        os.fchmod(dirfds[child], dirmode)
+                        created += 1
+                parent = child
+            fd = os.open(os.path.basename(path), os.O_WRONLY | os.O_CREAT | os.O_EXCL, perm,
+                dir_fd=dirfds[parent])
+            try:
+                os.write(fd, text.encode('utf-8'))
+                os.fchown(fd, *owner)
+                os.fchmod(fd, perm)
+            finally:
+                os.close(fd)
+            created += 1
+    finally:
+        for fd in dirfds.values():
+            os.close(fd)
+    return created
+
+def _repermission(location, owner, perm):
+    '''
+    Gives everything in the overlay at location the owner (uid, gid) pair
+    and perm (or, for directories, perm made searchable), touching only the
+    entries which differ.  Returns the number of entries changed.
+    '''
+    dirmode = _dir_mode(perm)
+    uid, gid = owner
+    changed = 0
+    def fix(name, mode, dirfd):
+        st = os.stat(name, dir_fd=dirfd, follow_symlinks=False)
+        if stat.S_ISLNK(st.st_mode):
+            return 0
+        wrong = 0
+        if (uid != -1 and st.st_uid != uid) or (gid != -1 and st.st_gid != gid):
+            os.chown(name, uid, gid, dir_fd=dirfd, follow_symlinks=False)
+            wrong = 1
+        if stat.S_IMODE(st.st_mode) != mode:
+            os.chmod(name, mode, dir_fd=dirfd)
+            wrong = 1
+        return wrong
+    root = os.path.realpath(location)
+    changed += fix(root, dirmode, None)
+    for dirpath, dirnames, filenames, dirfd in os.fwalk(root):
+        for name in dirnames:
+            changed += fix(name, dirmode, dirfd)
+        for name in filenames:
+            changed += fix(name, perm, dirfd)
+    return changed
+
+@trace
+def create_overlay(conf, uid=-1, gid=-1, perm=0o664):
+    '''
+    Creates the overlay configured in conf, if it does not exist, as an
+    empty overlay (see overlay_skeleton) published by way of an
+    OverlayStage, its entries owned by uid and gid (where not -1) and
+    having the permissions perm (or, for directories, perm made
+    searchable).  If the overlay exists, any of its missing skeleton files
+    are added and its entries given that ownership and those permissions.
+    Either way, the overlay is then registered in the repos.conf named by
+    the repos_conf setting (if any).  Returns a (created, registered) pair:
+    whether the overlay was created, and the list of repos.conf files
+    changed.
+    '''
+    location = overlay_location(conf)
+    owner = (uid, gid)
+    skeleton = overlay_skeleton(conf)
+    try:
+        created = _create_overlay(location, skeleton, owner, perm)
+        repos_conf = conf.globals['repos_conf'].value
+        registered = register_repo(conf.globals['overlay'].value, location, repos_conf) if repos_conf else []
+    except KNGReposConfError as e:
+        raise KNGOverlayError(str(e))
+    return (created, registered)
+
+def _create_overlay(location, skeleton, owner, perm):
+    try:
+        if os.path.isdir(location):
+            if not all(os.path.exists(os.path.join(location, path)) for path in skeleton):
+                # restore what's missing in a new generation, never the live one
+                with OverlayStage(location, owner) as stage:
+                    missing = dict((path, text) for path, text in skeleton.items()
+                        if not os.path.lexists(os.path.join(stage.root, path)))
+                    _create_files(stage.root, missing, owner, perm)
+                    for path in missing:
+                        stage.changed(path)
+                    if stage.dirty:
+                        stage.publish()
+            with metrics.phase('overlay_permissions'):
+                metrics.set_count('repermissioned_entries', _repermission(location, owner, perm))
+            return False
+        _makedirs(os.path.dirname(os.path.abspath(location)), None)
+        with OverlayStage(location) as stage:
+            _create_files(stage.root, skeleton, owner, perm)
+            for path in skeleton:
+                stage.changed(path)
+            stage.publish()
+    except KNGStageError as e:
+        raise KNGOverlayError(str(e))
+    except (IOError, OSError) as e:
+        raise KNGOverlayError('Could not create the overlay at %s: %s' % (location, e))
+    return True
+
+@trace
+def destroy_overlay(conf, jobs=None):
+    '''
+    Destroys the overlay configured in conf: withdraws it from portage's
+    view at once (see staging.unpublish), removes its files, spread over a
+    pool of jobs threads (by default, one per CPU), and removes its section
+    from the repos.conf named by the repos_conf setting (if any).  Returns a
+    (destroyed, deregistered) pair: whether there was anything to remove,
+    and the list of repos.conf files changed.
+    '''
+    location = overlay_location(conf)
+    try:
+        if os.path.isdir(os.path.dirname(os.path.abspath(location))):
+            lockfile = lock_overlay(location)
+            try:
+                doomed = unpublish(location)
+                with metrics.phase('overlay_remove'):
+                    remove_trees(doomed, jobs)
+            finally:
+                lockfile.close()
+        else:
+            doomed = []
+        repos_conf = conf.globals['repos_conf'].value
+        deregistered = deregister_repo(conf.globals['overlay'].value, repos_conf) if repos_conf else []
+    except (KNGStageError, KNGReposConfError) as e:
+        raise KNGOverlayError(str(e))
+    except (IOError, OSError) as e:
+        raise KNGOverlayError('Could not destroy the overlay at %s: %s' % (location, e))
+    return (bool(doomed), deregistered)
+
+@trace
+def update_overlay(conf, jobs=None, regenerate=False, rehash=False):
+    '''
+    Brings the overlay configured in conf up to date with the kernel sources
+    packages in portage's other repositories.  Only ebuilds whose inputs
+    have changed since the last update (or all of them, if regenerate is
+    True) are regenerated, on a pool of jobs worker threads (by default, one
+    per CPU), and only ebuilds whose upstream counterpart has gone are
+    removed.  The Manifest of each package affected (or of every package,
+    if regenerate or rehash is True) is remade, hashing only files unknown
+    to the digest cache (or, if rehash is True, every file).  The changes
+    are made to a staged copy of the overlay, which then replaces it
+    atomically (see staging.OverlayStage).  Returns a (planned, regenerated,
+    written, removed) tuple of ebuild counts.
+    '''
+    location = overlay_location(conf)
+    if not os.path.isdir(location):
+        raise KNGOverlayError('The overlay location %s does not exist (try "%s overlay create").' % (
+            location, PROGNAME))
+    dbapi = portage_dbapi()
+    if dbapi is None:
+        raise KNGOverlayError('portage is required to update the overlay, but it could not be imported.')
+
+    try:
+        templates = ebuild_templates()
+    except (KNGTemplateError, IOError, OSError) as e:
+        raise KNGOverlayError(str(e))
+
+    state = load_state(location)
+    with metrics.phase('overlay_scan'):
+        index = kernel_index()
+        sources = list(scan_kernel_sources(dbapi, exclude=staged_paths(location), index=index))
+        try:
+            index.save()
+        except (IOError, OSError) as e:
+            echov('%s: could not save the kernel index: %s' % (PROGNAME, e), 1, err=True)
+        ebuilds = plan_ebuilds(conf, sources, templates)
+        recorded = {} if state is None or regenerate else state
+        stale = [ebuild for ebuild in ebuilds if recorded.get(ebuild.path) != ebuild.digest
+            or not os.path.exists(os.path.join(location, ebuild.path))]
+        planned = set(ebuild.path for ebuild in ebuilds)
+        pkgdirs = set(os.path.dirname(path) for path in planned)
+        unmanifested = set(pkgdir for pkgdir in pkgdirs
+            if not os.path.exists(os.path.join(location, pkgdir, MANIFEST)))
+    echov('found %d kernel sources ebuilds, mapping onto %d overlay ebuilds, %d out of date.' % (
+        len(sources), len(ebuilds), len(stale)), 2)
+
+    written = []
+    removed = []
+    manifested = []
+    if stale or unmanifested or rehash or state is None or set(state) != planned:
+        # new files take the ownership and modes of the overlay itself
+        st = os.stat(location)
+        owner = (st.st_uid, st.st_gid) if os.geteuid() == 0 else None
+        dirmode, filemode = modes = _overlay_modes(location)
+        cache = digest_cache()
+        if rehash:
+            cache.clear()
+        try:
+            with OverlayStage(location, owner) as stage:
+                root = stage.root
+                if stale:
+                    with metrics.phase('overlay_generate'):
+                        for pkgdir in set(os.path.dirname(ebuild.path) for ebuild in stale):
+                            _makedirs(os.path.join(root, pkgdir), owner, dirmode)
+                        with ThreadPoolExecutor(max_workers=jobs or os.cpu_count() or 1) as pool:
+                            written = list(pool.map(
+                                lambda ebuild: _generate(root, ebuild, templates[ebuild.flavor], owner, filemode), stale))
+                    for ebuild, was_written in zip(stale, written):
+                        if was_written:
+                            stage.changed(ebuild.path)
+                            echov('wrote %s' % kngstyle(ebuild.path, fg='green'), 2)
+
+                with metrics.phase('overlay_prune'):
+                    if state is None:
+                        removed = _prune(root, planned)
+                    else:
+                        removed = _remove(root, set(state) - planned)
+                for path in removed:
+                    stage.changed(path)
+
+                with metrics.phase('overlay_manifest'):
+                    touched = set(pkgdirs) if regenerate or rehash else unmanifested.copy()
+                    touched.update(os.path.dirname(path) for path in removed)
+                    touched.update(os.path.dirname(ebuild.path)
+                        for ebuild, was_written in zip(stale, written) if was_written)
+                    for pkgdir in touched - pkgdirs:
+                        # emptied by the removals
+                        _remove(root, [os.path.join(pkgdir, MANIFEST)])
+                        stage.changed(os.path.join(pkgdir, MANIFEST))
+                    touched = sorted(touched & pkgdirs)
+                    dists = upstream_dists(ebuild for ebuild in ebuilds
+                        if os.path.dirname(ebuild.path) in touched)
+                    with ThreadPoolExecutor(max_workers=jobs or os.cpu_count() or 1) as pool:
+                        manifested = list(pool.map(lambda pkgdir: _write_manifest(root, location, pkgdir,
+                            dists[pkgdir], cache, owner, filemode), touched))
+                    for pkgdir, was_written in zip(touched, manifested):
+                        if was_written:
+                            stage.changed(os.path.join(pkgdir, MANIFEST))
+                            echov('wrote %s' % kngstyle(os.path.join(pkgdir, MANIFEST), fg='green'), 2)
+                if save_state(root, ebuilds, owner, modes):
+                    stage.changed(STATE_FILE)
+                if stage.dirty:
+                    stage.publish(jobs)
+        except KNGStageError as e:
+            raise KNGOverlayError(str(e))
+        # only now are the files where the cache entries say
+        try:
+            cache.save()
+        except (IOError, OSError) as e:
+            echov('%s: could not save the digest cache: %s' % (PROGNAME, e), 1, err=True)
+
+    metrics.set_count('generated_packages', len(set(ebuild.cp for ebuild in ebuilds)))
+    metrics.set_count('generated_ebuilds', len(ebuilds))
+    metrics.set_count('regenerated_ebuilds', len(stale))
+    metrics.set_count('written_ebuilds', sum(written))
+    metrics.set_count('removed_ebuilds', len(removed))
+    metrics.set_count('written_manifests', sum(manifested))
+    return (len(ebuilds), len(stale), sum(written), len(removed))
@@ -0,0 +1,283 @@
+#!/usr/bin/env python
+#-*- coding:utf-8 -*-
+# vim:ai:sta:et:ts=4:sw=4:sts=4
+
+"""kernelng 0.x
+ Tool for maintaining customized overlays of kernel-ng.eclass-based ebuilds
+
+Copyright 2005-2014 Gentoo Foundation
+
+        Copyright (C) 2014 Gregory M. Turner <gmt@be-evil.net>
+
+Distributed under the terms of the GNU General Public License v2
+ This program is free software; you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, version 2 of the License.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program; if not, write to the Free Software
+ Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA 02110-1301, USA.
+
+"""
+
+
+from __future__ import print_function
+
+import os
+import re
+import errno
+
+from collections import namedtuple, OrderedDict
+
+from .config import FRAMEWORK, PROGDESC, REPOS_CONF_FILE
+from .output import trace
+from .utils import file_stamp
+
+# Portage's repos.conf, which may be a single file or a directory of them
+# (read in name order, skipping hidden files and editor backups), each an
+# ini-style file with a section per repository.  Each file is parsed once and
+# re-parsed only when its stamp changes.  Edits rewrite (atomically) only the
+# lines of the section concerned, so everything else -- other repositories'
+# sections, comments, formatting -- is left exactly as it was.  In the
+# directory layout, a repository we register gets a file of its own,
+# REPOS_CONF_FRAGMENT, which deregistering it removes again.
+
+REPOS_CONF_FRAGMENT = '%s.conf' % FRAMEWORK
+
+SECTION_RE = re.compile(r'^\s*\[(?P<name>[^\]]+)\]\s*$')
+SETTING_RE = re.compile(r'^(?P<lead>\s*(?P<key>[^\s=:#;][^=:]*?)\s*[=:]\s*)(?P<value>.*?)\s*$')
+
+class KNGReposConfError(Exception):
+    pass
+
+# The lines [start, end) of filename making up the section of a repository
+# (header being that of its "[name]" line), and its {key: value} settings.
+ReposConfSection = namedtuple('ReposConfSection', ('filename', 'start', 'header', 'end', 'settings'))
+
+@trace
+def repos_conf_files(path=REPOS_CONF_FILE):
+    '''
+    Returns the paths of the files making up the repos.conf at path, in the
+    order portage reads them.
+    '''
+    if not os.path.isdir(path):
+        return [path] if os.path.exists(path) else []
+    rv = []
+    for dirpath, dirnames, filenames in os.walk(path):
+        dirnames[:] = sorted(d for d in dirnames if not d.startswith('.'))
+        rv.extend(os.path.join(dirpath, f) for f in sorted(filenames)
+            if not f.startswith('.') and not f.endswith('~'))
+    return rv
+
+def parse_sections(filename, lines):
+    '''
+    Returns the {name: [ReposConfSection, ...]} OrderedDict of the sections
+    in the lines of the file filename (a name may have several, which
+    portage merges).  Comment lines directly above a section header are
+    reckoned part of that section; blank lines, of none.
+    '''
+    rv = OrderedDict()
+    name = start = header = None
+    settings = {}
+    def close(end):
+        while end > header + 1 and (not lines[end - 1].strip() or lines[end - 1].lstrip().startswith('#')):
+            end -= 1
+        rv.setdefault(name, []).append(ReposConfSection(filename, start, header, end, settings))
+        return end
+    floor = 0
+    for i, line in enumerate(lines):
+        m = SECTION_RE.match(line)
+        if m:
+            if name is not None:
+                floor = close(i)
+            name, header, settings = m.group('name').strip(), i, {}
+            start = i
+            while start > floor and lines[start - 1].lstrip().startswith('#'):
+                start -= 1
+            continue
+        m = SETTING_RE.match(line)
+        if m and name is not None and not line[:1].isspace():
+            settings[m.group('key')] = m.group('value')
+    if name is not None:
+        close(len(lines))
+    return rv
+
+def _write(path, text):
+    # atomically, keeping the ownership and mode of any file being replaced
+    st = None
+    try:
+        st = os.stat(path)
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            raise
+    tmppath = os.path.join(os.path.dirname(path), '.%s.%d.tmp' % (os.path.basename(path), os.getpid()))
+    try:
+        with open(tmppath, 'w') as f:
+            f.write(text)
+        os.chmod(tmppath, 0o644 if st is None else st.st_mode & 0o7777)
+        if st is not None and os.geteuid() == 0:
+            os.chown(tmppath, st.st_uid, st.st_gid)
+        os.rename(tmppath, path)
+    except Exception:
+        try:
+            os.unlink(tmppath)
+        except OSError:
+            pass
+        raise
+
+class ReposConf(object):
+    '''
+    The repos.conf at path, file or directory, parsed (and, as its files
+    change, re-parsed) on load().
+    '''
+    @trace
+    def __init__(self, path):
+        self.path = path
+        self._files = OrderedDict()
+
+    @trace
+    def load(self):
+        '''
+        (Re)reads the files which have changed since we last did.
+        '''
+        files = OrderedDict()
+        for filename in repos_conf_files(self.path):
+            stamp = file_stamp(filename)
+            cached = self._files.get(filename)
+            if cached is not None and cached[0] == stamp:
+                files[filename] = cached
+                continue
+            try:
+                with open(filename) as f:
+                    lines = f.read().splitlines(True)
+            except (IOError, OSError) as e:
+                raise KNGReposConfError('Could not read %s: %s' % (filename, e))
+            files[filename] = (stamp, lines, parse_sections(filename, lines))
+        self._files = files
+
+    @property
+    def isdir(self):
+        return os.path.isdir(self.path) or not os.path.exists(self.path)
+
+    def find(self, name):
+        '''
+        Returns the list of ReposConfSections of the repository name, in the
+        order portage reads them.
+        '''
+        return [section for stamp, lines, sections in self._files.values()
+            for section in sections.get(name, ())]
+
+    def repositories(self):
+        '''
+        Returns the {name: {key: value}} OrderedDict of the repositories
+        configured, with the settings merged as portage merges them.
+        '''
+        rv = OrderedDict()
+        for stamp, lines, sections in self._files.values():
+            for name, named in sections.items():
+                for section in named:
+                    rv.setdefault(name, {}).update(section.settings)
+        return rv
+
+    def _replace(self, filename, start, end, new):
+        lines = list(self._files[filename][1])
+        lines[start:end] = new
+        # only our own file goes when emptied; others are the admin's to remove
+        if filename != self.path and os.path.basename(filename) == REPOS_CONF_FRAGMENT and \
+                all(not line.strip() or line.lstrip().startswith('#') for line in lines):
+            os.unlink(filename)
+        else:
+            _write(filename, ''.join(lines))
+        self.load()
+
+    @trace
+    def register(self, name, location):
+        '''
+        Makes the repository name, located at location, known to portage,
+        unless it already is.  If it has a section, only its location line
+        is rewritten (or, lacking one, added); otherwise, a section is added
+        to the repos.conf file, or, in the directory layout, written as the
+        file REPOS_CONF_FRAGMENT.  Returns the list of files changed.
+        '''
+        changed = []
+        try:
+            sections = self.find(name)
+            if sections and self.repositories()[name].get('location') != location:
+                # the last one read has the last word
+                section = sections[-1]
+                lines = self._files[section.filename][1]
+                for i in range(section.header + 1, section.end):
+                    m = SETTING_RE.match(lines[i])
+                    if m and m.group('key') == 'location':
+                        self._replace(section.filename, i, i + 1, ['%s%s\n' % (m.group('lead'), location)])
+                        break
+                else:
+                    self._replace(section.filename, section.header + 1, section.header + 1,
+                        ['location = %s\n' % location])
+                changed.append(section.filename)
+            elif not sections:
+                text = '# Managed by %s\n[%s]\nlocation = %s\n' % (PROGDESC, name, location)
+                if self.isdir:
+                    if not os.path.isdir(self.path):
+                        os.makedirs(self.path, 0o755)
+                    filename = os.path.join(self.path, REPOS_CONF_FRAGMENT)
+                    if filename in self._files:
+                        # ours, but without the section (hand-edited?)
+                        raise KNGReposConfError('%s exists but does not configure %s.' % (filename, name))
+                    _write(filename, text)
+                    self.load()
+                else:
+                    filename = self.path
+                    lines = self._files[filename][1]
+                    gap = '' if not lines else '\n' if lines[-1].endswith('\n') else '\n\n'
+                    self._replace(filename, len(lines), len(lines), [gap + text])
+                changed.append(filename)
+        except (IOError, OSError) as e:
+            raise KNGReposConfError('Could not update %s: %s' % (self.path, e))
+        return changed
+
+    @trace
+    def deregister(self, name):
+        '''
+        Removes every section of the repository name.  REPOS_CONF_FRAGMENT,
+        if left with nothing but blank lines and comments, is removed
+        altogether.  Returns the list of files changed.
+        '''
+        changed = []
+        try:
+            # from the last, so that the earlier ones' lines stay put
+            for section in reversed(self.find(name)):
+                start = section.start
+                lines = self._files[section.filename][1]
+                # blank lines before the header go with it
+                while start > 0 and not lines[start - 1].strip():
+                    start -= 1
+                self._replace(section.filename, start, section.end, [])
+                changed.append(section.filename)
+        except (IOError, OSError) as e:
+            raise KNGReposConfError('Could not update %s: %s' % (self.path, e))
+        return sorted(set(changed))
+
+_repos_conf = {}
+
+@trace
+def repos_conf(path=REPOS_CONF_FILE):
+    '''
+    Returns the process-wide ReposConf of the repos.conf at path, brought up
+    to date with its files.
+    '''
+    if path not in _repos_conf:
+        _repos_conf[path] = ReposConf(path)
+    _repos_conf[path].load()
+    return _repos_conf[path]
+
+def register_repo(name, location, path=REPOS_CONF_FILE):
+    return repos_conf(path).register(name, location)
+
+def deregister_repo(name, path=REPOS_CONF_FILE):
+    return repos_conf(path).deregister(name)
@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+#-*- coding:utf-8 -*-
+# vim:ai:sta:et:ts=4:sw=4:sts=4
+
+"""kernelng 0.x
+ Tool for maintaining customized overlays of kernel-ng.eclass-based ebuilds
+
+Copyright 2005-2014 Gentoo Foundation
+
+        Copyright (C) 2014 Gregory M. Turner <gmt@be-evil.net>
+
+Distributed under the terms of the GNU General Public License v2
+ This program is free software; you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, version 2 of the License.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program; if not, write to the Free Software
+ Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA 02110-1301, USA.
+
+"""
+
+from __future__ import print_function
+
+import shlex
+
+import click
+
+from .. import metrics
+from ..kngclick import kngcommand
+from ..output import trace, echov, kngstyle, kngstyle_static, save_output_settings, restore_output_settings
+from .helpstrings import HS, hs
+
+HS['batch_keep_going'] = kngstyle_static('--keep-going', fg='white', bold=True)
+
+def run_batch_command(root, args, prog_name):
+    '''
+    Runs one command line (sans program name) through the root command
+    without letting it exit the process, and returns its exit status.
+    '''
+    try:
+        rv = root.main(args=args, prog_name=prog_name, standalone_mode=False)
+    except click.ClickException as e:
+        e.show()
+        return e.exit_code
+    except click.Abort:
+        echov('Aborted!', 0, err=True)
+        return 1
+    except SystemExit as e:
+        return e.code if isinstance(e.code, int) else 0 if e.code is None else 1
+    # in non-standalone mode, ctx.exit(n) (as with --help) returns n
+    return rv if isinstance(rv, int) else 0
+
+def batch_command_name(root, args, prog_name):
+    '''
+    Returns the name of the subcommand a command line (sans program name)
+    would run, looking past any leading options, or None if it names none.
+    '''
+    ctx = click.Context(root, info_name=prog_name, resilient_parsing=True)
+    try:
+        rest = root.make_parser(ctx).parse_args(list(args))[1]
+        if rest:
+            return root.resolve_command(ctx, rest)[0]
+    except click.UsageError:
+        pass
+    return None
+
+@kngcommand(
+    'batch',
+    help = hs(
+        """
+        Run a series of %(prog)s commands, one per line, read from standard
+        input or a file, all in a single process.  The configuration and portage
+        are loaded only once, however many commands there are.  Each line is a
+        %(prog)s command line without the leading "%(prog)s", split as the shell
+        would split it.  Blank lines and #-comments are ignored.
+
+        Each command starts afresh with the default verbosity, output and
+        logging settings, just as it would if run by itself; those given to
+        %(prog)s batch govern only its own reports.  The exit status of each
+        command is reported (if it failed, or at -v verbosity) and, unless
+        %(batch_keep_going)s is given, the batch stops at the first failure.
+        The exit status of the batch is that of the first failed command.
+
+        \b
+          # %(prog)s batch <<EOF
+          config example --install
+          overlay create --perm 755
+          EOF
+        """
+    ),
+    short_help = hs("Run many commands, read from a file, in one go.")
+)
+@click.option('-f', '--file', 'batchfile', type=click.File('r'), default='-',
+    help='Read commands from the specified file instead of standard input.')
+@click.option('-k', '--keep-going', is_flag=True, help='Carry on with the rest of the commands after one fails.')
+@click.pass_context
+@trace
+def batch(ctx, batchfile, keep_going):
+    root = ctx.find_root()
+    settings = save_output_settings()
+    failed = None
+    for lineno, line in enumerate(batchfile, 1):
+        try:
+            args = shlex.split(line, comments=True)
+        except ValueError as e:
+            echov('%s:%d: %s' % (batchfile.name, lineno, e), 0, err=True)
+            status = 2
+        else:
+            if not args:
+                continue
+            if batch_command_name(root.command, args, root.info_name) == ctx.info_name:
+                echov('%s:%d: batches may not be nested.' % (batchfile.name, lineno), 0, err=True)
+                status = 2
+            else:
+                restore_output_settings()
+                try:
+                    status = run_batch_command(root.command, args, root.info_name)
+                finally:
+                    restore_output_settings(settings)
+        metrics.count('batch_commands')
+        if status:
+            metrics.count('batch_failures')
+            echov('%s:%d: %s: %s' % (batchfile.name, lineno, line.strip(),
+                kngstyle('failed (exit status %d)' % status, fg='red', bold=True)), 0, err=True)
+            if failed is None:
+                failed = status
+            if not keep_going:
+                break
+        else:
+            echov('%s:%d: %s: %s' % (batchfile.name, lineno, line.strip(),
+                kngstyle('ok', fg='green', bold=True)), 2, err=True)
+    metrics.set_command(ctx.command_path)
+    if failed:
+        ctx.exit(failed)
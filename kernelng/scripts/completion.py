@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+#-*- coding:utf-8 -*-
+# vim:ai:sta:et:ts=4:sw=4:sts=4
+
+"""kernelng 0.x
+ Tool for maintaining customized overlays of kernel-ng.eclass-based ebuilds
+
+Copyright 2005-2014 Gentoo Foundation
+
+        Copyright (C) 2014 Gregory M. Turner <gmt@be-evil.net>
+
+Distributed under the terms of the GNU General Public License v2
+ This program is free software; you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, version 2 of the License.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program; if not, write to the Free Software
+ Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA 02110-1301, USA.
+
+"""
+
+from __future__ import print_function
+
+import os
+
+import click
+
+from ..kngclick import kngcommand, KNGContext, KNGGroup
+from ..config import EPREFIX, FRAMEWORK, SYSTEM_CACHE_DIR, USER_CACHE_DIR
+from ..output import trace, echov, echo_data, kngstyle_static
+from ..version import version
+from .helpstrings import HS, hs
+
+# The completion index is a static, tab-separated description of the whole
+# command tree which the shell functions in completion/ read directly, so that
+# tab-completion never has to start python (let alone import click or portage).
+# Each non-comment line reads:
+#
+#   <command path>\t<subcommands>\t<options>
+#
+# where the command path is "/"-separated (starting with "kernelng"), the
+# subcommands are space-separated, and each space-separated option is either a
+# bare flag or "<option>=<TYPE>", where TYPE is PATH (for click.Path and
+# click.File), DIR, CHOICE:<a>,<b>,..., INTEGER or FLOAT (ranges included) or
+# else the upper-cased click type name (OCTAL_3, ...), whitespace replaced, as
+# in all of them, by underscores.
+#
+# The first line is a header naming the kernelng version which wrote the index.
+# setup.py builds one at install time (SHIPPED_COMPLETION_INDEX), and the shell
+# functions skip any other index whose header differs from that one's, so an
+# index left over from another version is never consulted.
+
+COMPLETION_ROOT = 'kernelng'
+COMPLETION_INDEX = 'completion-index'
+SYSTEM_COMPLETION_INDEX = os.path.join(SYSTEM_CACHE_DIR, COMPLETION_INDEX)
+USER_COMPLETION_INDEX = os.path.join(USER_CACHE_DIR, COMPLETION_INDEX)
+SHIPPED_COMPLETION_INDEX = '%s/usr/share/%s/%s' % (EPREFIX, FRAMEWORK, COMPLETION_INDEX)
+
+def default_index_path():
+    return SYSTEM_COMPLETION_INDEX if os.geteuid() == 0 else USER_COMPLETION_INDEX
+
+def _option_type(param):
+    if param.is_flag:
+        return None
+    ptype = param.type
+    if isinstance(ptype, click.Path):
+        otype = 'DIR' if ptype.dir_okay and not ptype.file_okay else 'PATH'
+    elif isinstance(ptype, click.File):
+        otype = 'PATH'
+    elif isinstance(ptype, click.Choice):
+        otype = 'CHOICE:%s' % ','.join(ptype.choices)
+    elif isinstance(ptype, click.IntRange):
+        otype = 'INTEGER'
+    elif isinstance(ptype, click.FloatRange):
+        otype = 'FLOAT'
+    else:
+        otype = (getattr(ptype, 'name', None) or 'TEXT').upper()
+    # the index is whitespace-separated
+    return '_'.join(otype.split())
+
+def _index_lines(cmd, ctx, path):
+    options = []
+    for param in cmd.get_params(ctx):
+        if not isinstance(param, click.Option) or getattr(param, 'hidden', False):
+            continue
+        otype = _option_type(param)
+        # sorted, as click keeps the help option's names in a set
+        for opt in sorted(param.opts) + sorted(param.secondary_opts):
+            options.append(opt if otype is None else '%s=%s' % (opt, otype))
+    subcommands = cmd.list_commands(ctx) if isinstance(cmd, click.MultiCommand) else []
+    yield '\t'.join((path, ' '.join(subcommands), ' '.join(options)))
+    for name in subcommands:
+        sub = cmd.get_command(ctx, name)
+        if sub is None:
+            continue
+        subctx = KNGContext(sub, parent=ctx, info_name=name)
+        for line in _index_lines(sub, subctx, '%s/%s' % (path, name)):
+            yield line
+
+@trace
+def completion_index(root):
+    '''
+    Returns the text of the completion index for the given root command.
+    '''
+    ctx = KNGContext(root, info_name=COMPLETION_ROOT, **(root.context_settings or {}))
+    lines = ['# %s completion index, version %s' % (COMPLETION_ROOT, version)]
+    lines.extend(_index_lines(root, ctx, COMPLETION_ROOT))
+    return '\n'.join(lines) + '\n'
+
+@trace
+def write_completion_index(root, path):
+    dirname = os.path.dirname(os.path.abspath(path))
+    if not os.path.isdir(dirname):
+        os.makedirs(dirname)
+    tmppath = '%s.%d.tmp' % (path, os.getpid())
+    with open(tmppath, 'w') as f:
+        f.write(completion_index(root))
+    os.chmod(tmppath, 0o644)
+    os.rename(tmppath, path)
+
+HS['completion_rebuild'] = kngstyle_static('--rebuild', fg='white', bold=True)
+HS['completion_sysindex'] = SYSTEM_COMPLETION_INDEX
+HS['completion_userindex'] = USER_COMPLETION_INDEX
+HS['completion_shippedindex'] = SHIPPED_COMPLETION_INDEX
+
+@kngcommand(
+    'completion',
+    help = hs(
+        """
+        Display or regenerate the static shell-completion index read by the
+        %(prog)s bash and zsh completion functions.  These answer tab-completion
+        requests from the index alone, without starting python.  An index is
+        built when %(progdesc)s is installed, as %(completion_shippedindex)s; an
+        index rebuilt here takes precedence over it, but the completion functions
+        ignore any index written by a different version of %(progdesc)s.
+
+        Without %(completion_rebuild)s, the index is written to standard output.  The
+        default index location is %(completion_sysindex)s when run as root, and
+        %(completion_userindex)s otherwise.
+        """
+    ),
+    short_help = hs("Display or rebuild the shell-completion index.")
+)
+@click.option('-r', '--rebuild', is_flag=True, help='Regenerate the completion index file.')
+@click.option('-o', '--index', type=click.Path(dir_okay=False, writable=True), default=None,
+    help='Location of the completion index file to regenerate.')
+@click.pass_context
+@trace
+def completion(ctx, rebuild, index):
+    root = ctx.find_root().command
+    if rebuild:
+        path = index or default_index_path()
+        try:
+            write_completion_index(root, path)
+        except (IOError, OSError) as e:
+            raise click.ClickException('Could not write completion index %s: %s' % (path, e))
+        echov('Wrote completion index %s' % path, 2)
+    elif index:
+        raise click.UsageError('-o/--index is only meaningful with -r/--rebuild.')
+    else:
+        echo_data(completion_index(root), nl=False)
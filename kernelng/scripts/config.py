@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+#-*- coding:utf-8 -*-
+# vim:ai:sta:et:ts=4:sw=4:sts=4
+
+"""kernelng 0.x
+ Tool for maintaining customized overlays of kernel-ng.eclass-based ebuilds
+
+Copyright 2005-2014 Gentoo Foundation
+
+        Copyright (C) 2005 Colin Kingsley <tercel@gentoo.org>
+        Copyright (C) 2008 Zac Medico <zmedico@gentoo.org>
+        Copyright (C) 2009 Sebastian Pipping <sebastian@pipping.org>
+        Copyright (C) 2009 Christian Ruppert <idl0r@gentoo.org>
+        Copyright (C) 2012 Brian Dolbec <dolsen@gentoo.org>
+        Copyright (C) 2014 Gregory M. Turner <gmt@be-evil.net>
+
+Distributed under the terms of the GNU General Public License v2
+ This program is free software; you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, version 2 of the License.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program; if not, write to the Free Software
+ Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA 02110-1301, USA.
+
+"""
+
+from __future__ import print_function
+
+import os
+
+import click
+
+from ..kngclick import knggroup
+from ..config import KERNELNG_CONF_FILE, KNGConfig
+from ..output import trace, kngstyle
+from .helpstrings import HS, hs, CONTEXT_SETTINGS
+
+CONFIG_EXAMPLE_OPTIONS = 'One, at most, of the %(i)s/%(install)s,' \
+    ' %(I)s/%(install_as)s and %(a)s/%(append_to)s options may be used' \
+    ' per invocation, as these each specify where the output goes.' % {
+        'i': kngstyle('-i', fg='white', bold=True),
+        'install': kngstyle('--install', fg='white', bold=True),
+        'I': kngstyle('-I', fg='white', bold=True),
+        'install_as': kngstyle('--install-as', fg='white', bold=True),
+        'a': kngstyle('-a', fg='white', bold=True),
+        'append_to': kngstyle('--append-to', fg='white', bold=True),
+}
+HS['config_example_options'] = CONFIG_EXAMPLE_OPTIONS
+
+@knggroup(
+    help = hs(
+        """
+        Modify the %(progdesc)s configuration.
+
+        %(subcmdhelp)s
+        """
+    )
+)
+@trace
+def config():
+    pass
+
+@config.knggroup(
+    help = hs(
+        """
+        Display %(framework)s actual or default configuration information.
+        """
+    ),
+    short_help = hs("Display %(framework)s configuration info.")
+)
+@trace
+def show():
+    pass
+
+@config.kngcommand(
+    help = hs(
+        """
+        Display or save the hard-coded example configuration file that came with this version of %(progdesc)s.
+        The output is in the "%(kngconf)s" format utilized by %(progname)s, and illustrates the %(kngconf)s
+        syntax while providing a brief commented explanation of each of the supported settings.  The example
+        may also serve as a means to bootstrap the %(progdesc)s configuration process, as it contains a sensible
+        baseline configuration likely to meet the needs of a plurality of %(framework)s users.
+
+        %(config_example_options)s
+        """
+    ),
+    short_help = hs("Display or save the example configuration file.")
+)
+@click.option('-i', '--install', is_flag=True, help=hs('Bootstrap the %(framework)s configuration process by saving the '
+    'configuration example file to %(kngconffile)s.'))
+@click.option('-I', '--install-as', type=click.Path(dir_okay=False, writable=True), help='Write output to file instead of standard output.')
+@click.option('-a', '--append-to', type=click.Path(dir_okay=False, writable=True), help='Append output to end of the specified file.')
+@click.option('-f', '--force', is_flag=True, help='Replace existing configuration file, if present (valid only with %s or %s option).' % (
+    kngstyle('--install-as', fg='white', bold=True), kngstyle('--install', fg='white', bold=True)))
+@click.option('-n', '--no-comments', is_flag=True, help='Omit all comments and blank lines in the example file.')
+@trace
+def example(install=None, install_as=None, append_to=None, force=False, no_comments=False):
+    outfile = None
+    s=sum([1 if x else 0 for x in [install, install_as, append_to]])
+    if s > 1:
+        raise click.UsageError('-i/--install, -I/--install-as, and -a/--append-to arguments applied simultaneously.')
+    if force and (not (install or install_as)):
+        raise click.UsageError('--force only relevant to -i/--install or -I/--install-as options')
+
+    filename = KERNELNG_CONF_FILE if install \
+        else install_as if install_as \
+        else append_to if append_to \
+        else None
+
+    conf = KNGConfig()
+    conf.loadExampleConfig()
+
+    if filename:
+        mode='a' if append_to \
+            else 'w' if force \
+            else 'x'
+        if os.path.exists(filename):
+            if os.path.isdir(filename):
+                raise click.ClickException('%s must not be a directory.' % filename)
+            elif (not append_to) and not force:
+                raise click.ClickException('File %s already exists but --force option not provided.' % filename)
+        dirname = os.path.dirname(filename)
+        basename = os.path.basename(filename)
+        if not basename:
+            raise click.ClickException('filename %s appears to be an invalid file-name.' % filename)
+        elif not os.path.exists(dirname):
+            os.makedirs(os.path.dirname(filename))
+        elif not os.path.isdir(dirname):
+            raise click.ClickException('Whatever %s is, it\'s not the directory we need to store %s in.' % (dirname, filename))
+        else:
+            with click.open_file(filename, mode=mode) as outfile:
+                conf.writeConfigText(file=outfile, no_comments=no_comments)
+    else:
+        conf.writeConfigText(no_comments=no_comments)
@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+#-*- coding:utf-8 -*-
+# vim:ai:sta:et:ts=4:sw=4:sts=4
+
+"""kernelng 0.x
+ Tool for maintaining customized overlays of kernel-ng.eclass-based ebuilds
+
+Copyright 2005-2014 Gentoo Foundation
+
+        Copyright (C) 2005 Colin Kingsley <tercel@gentoo.org>
+        Copyright (C) 2008 Zac Medico <zmedico@gentoo.org>
+        Copyright (C) 2009 Sebastian Pipping <sebastian@pipping.org>
+        Copyright (C) 2009 Christian Ruppert <idl0r@gentoo.org>
+        Copyright (C) 2012 Brian Dolbec <dolsen@gentoo.org>
+        Copyright (C) 2014 Gregory M. Turner <gmt@be-evil.net>
+
+Distributed under the terms of the GNU General Public License v2
+ This program is free software; you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, version 2 of the License.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program; if not, write to the Free Software
+ Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA 02110-1301, USA.
+
+"""
+
+from __future__ import print_function
+
+import inspect
+
+from ..config import PROGNAME, SUBCONSTS, subconsts
+from ..output import kngstyle_static
+
+# Help-string substitution constants shared by the kernelng command modules:
+# we augment the general substitution constants dict with command-line
+# specific constants.
+
+HS = SUBCONSTS.copy()
+HELPSHORT = '-h'
+HELPLONG = '--help'
+
+# nb: hs() strips the common indentation from help strings before substituting
+# into them, and this is stripped likewise, so the two need not line up.
+SUBCMDHELP = inspect.cleandoc(
+        """
+        The %(progname)s interface is broken into several nested
+        subcommands.  For detailed subcommand help, issue the
+        subcommand followed by the %(helpshort)s or %(helplong)s
+        option, i.e.:
+
+        \b
+          # kernelng config -h""" % {
+            'helpshort': kngstyle_static(HELPSHORT, fg='white', bold=True),
+            'helplong': kngstyle_static(HELPLONG, fg='white', bold=True),
+            'progname': kngstyle_static(PROGNAME, fg='white', bold=True)
+        })
+
+HS['progname'] = kngstyle_static(PROGNAME, fg='white', bold=True)
+HS['helpshort'] = HELPSHORT
+HS['helplong'] = HELPLONG
+HS['subcmdhelp'] = SUBCMDHELP
+HS['fixme'] = kngstyle_static('>FIXME!<', fg='red', bold=True)
+
+HS['early_alpha_warning'] = ''.join((
+    kngstyle_static('WARNING', fg='red', bold=True),
+    kngstyle_static(':', fg='white', bold=True),
+    ' ',
+    kngstyle_static(PROGNAME, fg='magenta', bold=True),
+    ' ',
+    ' '.join((
+        kngstyle_static(word, fg='magenta', bold=False) if word else word # ('')
+        for word in ' '.join((
+            'is in an early-alpha stage of development.  Many important',
+            'features are as-yet unimplemented and the code is in a state',
+            'of rapid flux.  It could easily break your ability to boot',
+            'or worse.  Please keep an up-to-date backup, or gamble only',
+            'with what you\'re fully prepared to lose.'
+        )).split(' ')
+    ))
+))
+
+def hs(value):
+    return subconsts(inspect.cleandoc(value), subconsts=HS)
+
+CONTEXT_SETTINGS = dict(
+    help_option_names = [HELPSHORT, HELPLONG]
+)
@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+#-*- coding:utf-8 -*-
+# vim:ai:sta:et:ts=4:sw=4:sts=4
+
+"""kernelng 0.x
+ Tool for maintaining customized overlays of kernel-ng.eclass-based ebuilds
+
+Copyright 2005-2014 Gentoo Foundation
+
+        Copyright (C) 2005 Colin Kingsley <tercel@gentoo.org>
+        Copyright (C) 2008 Zac Medico <zmedico@gentoo.org>
+        Copyright (C) 2009 Sebastian Pipping <sebastian@pipping.org>
+        Copyright (C) 2009 Christian Ruppert <idl0r@gentoo.org>
+        Copyright (C) 2012 Brian Dolbec <dolsen@gentoo.org>
+        Copyright (C) 2014 Gregory M. Turner <gmt@be-evil.net>
+
+Distributed under the terms of the GNU General Public License v2
+ This program is free software; you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, version 2 of the License.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program; if not, write to the Free Software
+ Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA 02110-1301, USA.
+
+"""
+
+from __future__ import print_function
+
+import click
+
+from ..kngclick import knggroup, OCTAL_3
+from ..config import portage_ids, active_config
+from ..output import trace, echov
+from ..overlay import update_overlay, destroy_overlay, KNGOverlayError
+from .. import metrics
+from ..ebuildtemplate import TEMPLATE_DIR
+from ..reposconf import REPOS_CONF_FRAGMENT
+from .helpstrings import HS, hs, CONTEXT_SETTINGS
+
+HS['ebuild_template_dir'] = TEMPLATE_DIR
+HS['reposconffragment'] = REPOS_CONF_FRAGMENT
+
+@knggroup(
+    help = hs(
+        """
+        Manage the %(progdesc)s overlay.
+
+        %(subcmdhelp)s
+        """
+    )
+)
+@trace
+def overlay():
+    pass
+
+@overlay.kngcommand(
+    help = hs(
+        """
+        Creates and activates an empty %(progdesc)s overlay.  Its files are
+        given the ownership and permissions specified (by default, those of
+        the portage user and group, and 664); its directories get the same,
+        plus search permission wherever they are readable.  If the overlay
+        already exists, its ownership and permissions are brought into line
+        instead.  Either way, the overlay is then registered in portage's
+        repos.conf (unless the repos_conf setting is empty): its section
+        there is added, or its location corrected, leaving the rest of the
+        file as it was; where repos.conf is a directory, the overlay gets a
+        file of its own in it, %(reposconffragment)s.
+        """
+    ),
+    short_help = hs("Create and activate an empty %(progdesc)s overlay.")
+)
+@click.option('-u', '--uid', type=click.INT, default=-1,
+    help='Numeric user id to assign to overlay files.')
+@click.option('-g', '--gid', type=click.INT, default=-1,
+    help='Numeric group id to assign to overlay files.')
+@click.option('-p', '--perm', type=OCTAL_3, default=0o664,
+    help='Three-digit octal permissions to assign to overlay files.')
+@trace
+def create(uid, gid, perm):
+    if uid == -1 and gid == -1:
+        uid, gid = portage_ids()
+    conf = active_config()
+    with metrics.phase('overlay_create'):
+        try:
+            created, registered = conf.createOverlay(uid, gid, perm)
+        except KNGOverlayError as e:
+            raise click.ClickException(str(e))
+    location = conf.globals['overlay_location'].value
+    if created:
+        echov('overlay create: created %s.' % location)
+    else:
+        echov('overlay create: %s exists; updated its ownership and permissions.' % location)
+    for filename in registered:
+        echov('overlay create: registered %s in %s.' % (conf.globals['overlay'].value, filename))
+
+@overlay.kngcommand(
+    help = hs(
+        """
+        Updates the %(progdesc)s overlay to mirror the kernel packages in
+        portage.  Each sys-kernel/*-sources package version in the other
+        configured repositories gets an ng-sources and a no-sources ebuild
+        in the overlay, named according to the name_prefix, name_override,
+        no_name_prefix and no_name_override settings.  The inputs of each
+        generated ebuild are recorded in the overlay, so that only ebuilds
+        whose upstream ebuild, settings or generator have changed since the
+        last update are regenerated, and only those whose upstream ebuild
+        has gone are removed.  The Manifests of the packages affected are
+        remade along the way, listing the distfiles of the upstream packages;
+        files whose digests are already known (from a cache keyed by their
+        inode, size and mtime) are not read again.  The changes are made to a
+        staged copy of the overlay, which then replaces it in one step, so
+        that portage never sees a partly updated overlay, even if the update
+        is interrupted.
+
+        The ebuilds are rendered from templates, which a site may replace by
+        putting its own ng-sources.ebuild or no-sources.ebuild into
+        %(ebuild_template_dir)s.  In these, "@NAME@" marks a slot for a
+        value, such as @UPSTREAM@, @SLOT@ or @KEYWORDS@, and "@@" a literal
+        "@".
+        """
+    ),
+    short_help = hs("Update the %(progdesc)s overlay from portage.")
+)
+@click.option('-j', '--jobs', type=click.IntRange(1, None),
+    help='Number of worker threads generating ebuilds (default: one per CPU).')
+@click.option('-a', '--all', 'regenerate', is_flag=True,
+    help='Regenerate every ebuild and Manifest, even those recorded as up to date.')
+@click.option('--rehash', is_flag=True,
+    help='Remake every Manifest, hashing every file afresh rather than trusting the digest cache.')
+@trace
+def update(jobs, regenerate, rehash):
+    with metrics.phase('overlay_update'):
+        try:
+            planned, regenerated, written, removed = update_overlay(active_config(),
+                jobs=jobs, regenerate=regenerate, rehash=rehash)
+        except KNGOverlayError as e:
+            raise click.ClickException(str(e))
+    echov('overlay update: %d ebuilds, %d regenerated (%d changed), %d removed.' % (
+        planned, regenerated, written, removed))
+
+@overlay.kngcommand(
+    help = hs(
+        """
+        Deactivates and removes the %(progdesc)s overlay.  The overlay
+        vanishes from portage's view at once; its files are then removed
+        in parallel, and its section removed from portage's repos.conf
+        (unless the repos_conf setting is empty).
+        """
+    ),
+    short_help = hs("Deactivate and remove the %(progdesc)s overlay.")
+)
+@click.option('-j', '--jobs', type=click.IntRange(1, None),
+    help='Number of worker threads removing files (default: one per CPU).')
+@trace
+def destroy(jobs):
+    conf = active_config()
+    with metrics.phase('overlay_destroy'):
+        try:
+            destroyed, deregistered = destroy_overlay(conf, jobs=jobs)
+        except KNGOverlayError as e:
+            raise click.ClickException(str(e))
+    location = conf.globals['overlay_location'].value
+    echov('overlay destroy: %s %s.' % (location, 'removed' if destroyed else 'did not exist'))
+    for filename in deregistered:
+        echov('overlay destroy: removed %s from %s.' % (conf.globals['overlay'].value, filename))
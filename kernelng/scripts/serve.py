@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+#-*- coding:utf-8 -*-
+# vim:ai:sta:et:ts=4:sw=4:sts=4
+
+"""kernelng 0.x
+ Tool for maintaining customized overlays of kernel-ng.eclass-based ebuilds
+
+Copyright 2005-2014 Gentoo Foundation
+
+        Copyright (C) 2014 Gregory M. Turner <gmt@be-evil.net>
+
+Distributed under the terms of the GNU General Public License v2
+ This program is free software; you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, version 2 of the License.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program; if not, write to the Free Software
+ Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA 02110-1301, USA.
+
+"""
+
+from __future__ import print_function
+
+import click
+
+from ..kngclick import kngcommand
+from ..client import default_socket_path
+from ..output import trace, echov
+from .helpstrings import HS, hs
+
+HS['serve_socket'] = default_socket_path()
+
+@kngcommand(
+    'serve',
+    help = hs(
+        """
+        Run a %(progname)s server in the foreground.  The server keeps the
+        %(framework)s configuration and portage loaded between commands, and
+        subsequent %(prog)s commands run by the same user are handed to it
+        instead of starting from scratch, which makes a great difference to
+        hooks run many times over, such as those run by emerge.  Commands run
+        just as they would otherwise, and if no server is running, they simply
+        run by themselves.
+
+        The server listens on %(serve_socket)s (or as set by the
+        KERNELNG_SOCKET environment variable) and only accepts commands from
+        its own user.  Set KERNELNG_NO_SERVER to run a command without it.
+        """
+    ),
+    short_help = hs("Run a server to speed up subsequent commands.")
+)
+@click.option('-s', '--socket', 'socket_path', type=click.Path(dir_okay=False), default=None,
+    help='Listen on the specified socket instead of the default.')
+@click.option('-t', '--idle-timeout', type=click.FloatRange(min=0), default=0,
+    help='Exit after this many seconds without a request (default: never).')
+@trace
+def serve(socket_path=None, idle_timeout=0):
+    from ..server import KNGServer
+    path = socket_path or default_socket_path()
+    try:
+        server = KNGServer(path, idle_timeout=idle_timeout)
+    except (IOError, OSError) as e:
+        raise click.ClickException('Could not listen on %s: %s' % (path, e))
+    try:
+        server.warm()
+        echov('Listening on %s' % path, 1)
+        server.serve()
+    finally:
+        server.server_close()
@@ -0,0 +1,262 @@
+#!/usr/bin/env python
+#-*- coding:utf-8 -*-
+# vim:ai:sta:et:ts=4:sw=4:sts=4
+
+"""kernelng 0.x
+ Tool for maintaining customized overlays of kernel-ng.eclass-based ebuilds
+
+Copyright 2005-2014 Gentoo Foundation
+
+        Copyright (C) 2014 Gregory M. Turner <gmt@be-evil.net>
+
+Distributed under the terms of the GNU General Public License v2
+ This program is free software; you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, version 2 of the License.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program; if not, write to the Free Software
+ Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA 02110-1301, USA.
+
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import json
+import time
+import array
+import errno
+import socket
+import struct
+import traceback
+import socketserver
+
+import click
+
+from . import metrics
+from .config import PROGNAME, portage_ids, portage_dbapi, active_config
+from .kernelindex import kernel_index
+from .digestcache import digest_cache
+from .utils import file_stamp
+from .client import send_message
+from .output import echov, trace, flush_output, shutdown_tracing, set_color, decide_color, \
+    save_output_settings, restore_output_settings
+
+# "kernelng serve": a long-running process which keeps click, the command tree,
+# the kernel-ng configuration and portage loaded, and runs the command lines
+# forwarded to it by kernelng.client.  Each request is handled in a forked
+# child, so commands start from the warm state but cannot disturb it, nor
+# each other.  The client passes its standard streams along with the request
+# (as SCM_RIGHTS ancillary data) and the child adopts them, along with the
+# client's working directory, environment and umask, before running the command
+# exactly as the client would have.
+
+SERVE_POLL_INTERVAL = 0.5
+
+def portage_stamp(dbapi):
+    '''
+    Returns what an "emerge --sync" (or a change of repositories) changes:
+    the stamps of each repository of dbapi and of its metadata/timestamp.chk.
+    '''
+    return tuple((tree, file_stamp(tree), file_stamp(os.path.join(tree, 'metadata', 'timestamp.chk')))
+        for tree in dbapi.porttrees)
+
+class KNGRequestHandler(socketserver.BaseRequestHandler):
+    # n.b.: runs in the forked child
+    def _receive(self):
+        fds = array.array('i')
+        data, ancdata, flags, addr = self.request.recvmsg(65536,
+            socket.CMSG_SPACE(3 * fds.itemsize))
+        for level, kind, cdata in ancdata:
+            if level == socket.SOL_SOCKET and kind == socket.SCM_RIGHTS:
+                fds.frombytes(cdata[:len(cdata) - (len(cdata) % fds.itemsize)])
+        while not data.endswith(b'\n'):
+            chunk = self.request.recv(65536)
+            if not chunk:
+                raise EOFError('client hung up mid-request')
+            data += chunk
+        return json.loads(data.decode('utf-8')), list(fds)
+
+    def handle(self):
+        request, fds = self._receive()
+        if len(fds) != 3:
+            for fd in fds:
+                os.close(fd)
+            raise ValueError('expected 3 file descriptors from the client, got %d' % len(fds))
+        for target, fd in enumerate(fds):
+            os.dup2(fd, target)
+            os.close(fd)
+        # the old stream objects still describe the server's own streams (they
+        # may, for instance, have decided that they are seekable files)
+        sys.stdin = open(0, 'r', closefd=False)
+        sys.stdout = open(1, 'w', closefd=False)
+        sys.stderr = open(2, 'w', buffering=1, closefd=False, errors='backslashreplace')
+        os.chdir(request['cwd'])
+        os.environ.clear()
+        os.environ.update(request['env'])
+        os.umask(request['umask'])
+        send_message(self.request, {'pid': os.getpid()})
+        send_message(self.request, {'status': run_command(request['argv'])})
+
+def run_command(argv):
+    '''
+    Runs the kernelng command line argv as if it were this process's own, and
+    returns its exit status.  The command starts from the default output
+    settings (not those of the server's own command line), with colour
+    decided afresh for its streams, and the settings are restored after.
+    '''
+    from .scripts.kernelng import cli
+    sys.argv = list(argv)
+    metrics.reset()
+    settings = save_output_settings()
+    restore_output_settings()
+    set_color(decide_color())
+    try:
+        try:
+            cli.main(args=argv[1:], prog_name=os.path.basename(argv[0]))
+            status = 0
+        except SystemExit as e:
+            if e.code is None or isinstance(e.code, int):
+                status = e.code or 0
+            else:
+                sys.stderr.write('%s\n' % e.code)
+                status = 1
+        except Exception:
+            traceback.print_exc()
+            status = 1
+        # socketserver leaves the child through os._exit, so the exit handlers
+        # would never run; those (of the server's) that matter to the command
+        # are run here, and no others.
+        metrics.write_metrics_file()
+        shutdown_tracing()
+        flush_output()
+    finally:
+        restore_output_settings(settings)
+    sys.stdout.flush()
+    sys.stderr.flush()
+    return status
+
+class KNGServer(socketserver.ForkingMixIn, socketserver.UnixStreamServer):
+    '''
+    Listens on the unix socket at path, serving the uid it runs as and nobody
+    else.  If idle_timeout is nonzero, serve() returns once that many seconds
+    pass without a request.
+    '''
+    request_handler = KNGRequestHandler
+
+    def __init__(self, path, idle_timeout=0):
+        self.path = path
+        self.idle_timeout = idle_timeout
+        self._last_request = time.time()
+        self._warm_error = None
+        self._portage_stamp = None
+        super(KNGServer, self).__init__(path, self.request_handler)
+
+    @trace
+    def server_bind(self):
+        dirname = os.path.dirname(self.path)
+        if not os.path.isdir(dirname):
+            os.makedirs(dirname, 0o700)
+        if os.path.exists(self.path):
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(self.path)
+            except OSError:
+                # left behind by a server which is no longer running
+                os.unlink(self.path)
+            else:
+                raise OSError(errno.EADDRINUSE, 'A kernelng server is already listening', self.path)
+            finally:
+                probe.close()
+        super(KNGServer, self).server_bind()
+        os.chmod(self.path, 0o600)
+
+    def verify_request(self, request, client_address):
+        creds = request.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize('3i'))
+        pid, uid, gid = struct.unpack('3i', creds)
+        if uid != os.geteuid():
+            echov('Refused request from pid %d: uid %d is not ours.' % (pid, uid), 0, err=True)
+            return False
+        return True
+
+    def process_request(self, request, client_address):
+        self._last_request = time.time()
+        # a postsync hook's request may beat the next warm() to the new tree
+        try:
+            self.refresh_portage()
+        except Exception:
+            # warm() reports it
+            pass
+        # lest the child inherit, and repeat, anything not yet written
+        flush_output()
+        sys.stdout.flush()
+        sys.stderr.flush()
+        super(KNGServer, self).process_request(request, client_address)
+
+    @trace
+    def warm(self):
+        '''
+        Loads (or, as they change, reloads) everything worth sharing between
+        requests, so that the children inherit it ready-made.
+        '''
+        from .scripts.kernelng import cli
+        ctx = click.Context(cli, info_name=PROGNAME)
+        for name in cli.list_commands(ctx):
+            cli.get_command(ctx, name)
+        portage_ids()
+        try:
+            self.refresh_portage()
+            active_config()
+            kernel_index()
+            digest_cache()
+            self._warm_error = None
+        except Exception as e:
+            # the children will run into it too, and report it to the client;
+            # we mention it (once) and keep serving.
+            message = '%s: %s' % (type(e).__name__, e)
+            if message != self._warm_error:
+                echov('Could not preload state: %s' % message, 0, err=True)
+            self._warm_error = message
+
+    def refresh_portage(self):
+        '''
+        Loads portage's dbapi, reloading it if the repositories have changed
+        (been synced, say) since it was loaded.
+        '''
+        dbapi = portage_dbapi()
+        if dbapi is None:
+            return
+        stamp = portage_stamp(dbapi)
+        if self._portage_stamp is not None and stamp != self._portage_stamp:
+            echov('The portage repositories have changed; reloading portage.', 2, err=True)
+            dbapi = portage_dbapi(reload=True)
+            stamp = portage_stamp(dbapi)
+        self._portage_stamp = stamp
+
+    def service_actions(self):
+        super(KNGServer, self).service_actions()
+        self.warm()
+
+    def idle(self):
+        return self.idle_timeout and not self.active_children and \
+            time.time() - self._last_request >= self.idle_timeout
+
+    def serve(self):
+        self.timeout = SERVE_POLL_INTERVAL
+        while not self.idle():
+            self.handle_request()
+            self.service_actions()
+
+    def server_close(self):
+        super(KNGServer, self).server_close()
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
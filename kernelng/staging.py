@@ -0,0 +1,318 @@
+#!/usr/bin/env python
+#-*- coding:utf-8 -*-
+# vim:ai:sta:et:ts=4:sw=4:sts=4
+
+"""kernelng 0.x
+ Tool for maintaining customized overlays of kernel-ng.eclass-based ebuilds
+
+Copyright 2005-2014 Gentoo Foundation
+
+        Copyright (C) 2014 Gregory M. Turner <gmt@be-evil.net>
+
+Distributed under the terms of the GNU General Public License v2
+ This program is free software; you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, version 2 of the License.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program; if not, write to the Free Software
+ Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA 02110-1301, USA.
+
+"""
+
+
+from __future__ import print_function
+
+import os
+import re
+import errno
+import fcntl
+import shutil
+import stat
+
+from concurrent.futures import ThreadPoolExecutor
+
+from .output import trace
+from . import metrics
+
+# The overlay is published in generations: the configured location is a
+# symlink to a sibling directory ".<name>.<n>" holding generation n.  An
+# update builds generation n+1 in the staging directory ".<name>.stage" --
+# starting out as a tree of hard links to generation n, so only what changes
+# is written -- fsyncs what it wrote in one batch, renames the staging
+# directory to ".<name>.<n+1>" and renames a new symlink over the location.
+# Portage therefore sees either the old or the new overlay, never a mixture,
+# however large the overlay is and wherever the update is interrupted.
+#
+# Files in the staging directory share their inodes with the published
+# generation, so they must only ever be replaced (written to a temporary
+# file renamed into place) or unlinked, never written in place.
+#
+# Portage resolves repository locations to their real paths, so a running
+# emerge goes on reading the generation it started with; the generation
+# before the current one is therefore kept until the next publish.
+#
+# Likewise, destroying the overlay only takes unlinking the symlink; the
+# generations can then be removed at leisure.
+
+GENERATION_RE = re.compile(r'\.(?P<name>.+)\.(?P<n>[0-9]+)$')
+KEEP_GENERATIONS = 2
+
+class KNGStageError(Exception):
+    pass
+
+def _sibling(location, suffix):
+    parent, name = os.path.split(os.path.abspath(location))
+    return os.path.join(parent, '.%s.%s' % (name, suffix))
+
+@trace
+def generations(location):
+    '''
+    Returns the {n: path} dict of the generation directories of the overlay
+    at location, published or not.
+    '''
+    parent, name = os.path.split(os.path.abspath(location))
+    rv = {}
+    try:
+        entries = os.listdir(parent)
+    except OSError as e:
+        if e.errno == errno.ENOENT:
+            return rv
+        raise
+    for entry in entries:
+        m = GENERATION_RE.match(entry)
+        if m and m.group('name') == name:
+            rv[int(m.group('n'))] = os.path.join(parent, entry)
+    return rv
+
+@trace
+def staged_paths(location):
+    '''
+    Returns the paths at which the overlay at location, or any generation of
+    it, may be found (i.e., which portage may report as its location).
+    '''
+    return [location] + sorted(generations(location).values())
+
+def _link_tree(src, dst, owner):
+    '''
+    Recreates the directory tree at src at dst (which must exist), hard
+    linking the files.  Returns the number of files linked.
+    '''
+    linked = 0
+    for entry in os.scandir(src):
+        target = os.path.join(dst, entry.name)
+        if entry.is_dir(follow_symlinks=False):
+            mode = stat.S_IMODE(entry.stat(follow_symlinks=False).st_mode)
+            os.mkdir(target, mode)
+            if owner is not None:
+                os.chown(target, *owner)
+            # (mkdir's mode is subject to the umask; chmod's isn't)
+            os.chmod(target, mode)
+            linked += _link_tree(entry.path, target, owner)
+        elif entry.is_symlink():
+            os.symlink(os.readlink(entry.path), target)
+        else:
+            try:
+                os.link(entry.path, target)
+            except OSError as e:
+                # some filesystems don't do hard links
+                if e.errno not in (errno.EPERM, errno.EXDEV, errno.EMLINK):
+                    raise
+                shutil.copy2(entry.path, target)
+            linked += 1
+    return linked
+
+def _fsync(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+@trace
+def lock_overlay(location):
+    '''
+    Takes the exclusive lock serializing changes to the overlay at location
+    and returns the open lock file; closing it releases the lock.  The lock
+    file is left in place for good: were it removed while locked, the next
+    process would lock a new file while a waiter still locked the old one.
+    '''
+    lockpath = _sibling(location, 'lock')
+    lockfile = open(lockpath, 'a')
+    try:
+        fcntl.flock(lockfile, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except (IOError, OSError) as e:
+        lockfile.close()
+        if e.errno in (errno.EAGAIN, errno.EACCES):
+            raise KNGStageError('%s is locked by another update of the overlay.' % lockpath)
+        raise
+    return lockfile
+
+@trace
+def unpublish(location):
+    '''
+    Atomically withdraws the overlay at location from view, returning the
+    paths of the directories (its generations, and any leftovers) which
+    remain to be removed.  The caller must hold the overlay's lock.
+    '''
+    location = os.path.abspath(location)
+    if os.path.islink(location):
+        os.unlink(location)
+    elif os.path.isdir(location):
+        # an overlay from before generations
+        os.rename(location, _sibling(location, 'doomed.%d' % os.getpid()))
+    _fsync(os.path.dirname(location))
+    parent, name = os.path.split(location)
+    doomed = sorted(generations(location).values())
+    doomed.extend(os.path.join(parent, entry) for entry in sorted(os.listdir(parent))
+        if entry == '.%s.stage' % name or entry.startswith('.%s.doomed.' % name))
+    return doomed
+
+def _remove_entry(path):
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path)
+    else:
+        os.unlink(path)
+
+@trace
+def remove_trees(paths, jobs=None):
+    '''
+    Removes the directory trees at paths.  An overlay has few categories
+    but many packages, so the work is spread at the level below: the entries
+    of each top-level directory (i.e., the package directories) are removed
+    in parallel on a pool of jobs threads, and the directories holding them
+    afterwards.
+    '''
+    entries, parents = [], []
+    for path in paths:
+        for entry in os.scandir(path):
+            if entry.is_dir(follow_symlinks=False):
+                parents.append(entry.path)
+                entries.extend(child.path for child in os.scandir(entry.path))
+            else:
+                os.unlink(entry.path)
+    with ThreadPoolExecutor(max_workers=jobs or os.cpu_count() or 1) as pool:
+        list(pool.map(_remove_entry, entries))
+    for path in parents + list(paths):
+        os.rmdir(path)
+
+class OverlayStage(object):
+    '''
+    Stages a new generation of the overlay at location, for use as a
+    context manager:
+
+        with OverlayStage(location, owner) as stage:
+            ... write into stage.root, calling stage.changed() ...
+            stage.publish()
+
+    New directories are given the owner (uid, gid) pair, if not None.  If
+    the with-block is left without publishing, for whatever reason (a
+    caught SIGINT raises SystemExit), the staging directory is removed and
+    the published overlay is left as it was.  An exclusive lock is held
+    meanwhile, so that only one stage of an overlay exists at a time.
+    '''
+    def __init__(self, location, owner=None):
+        self.location = os.path.abspath(location)
+        self.owner = owner
+        self.root = None
+        self._changed = set()
+        self._lockfile = None
+
+    def __enter__(self):
+        self._lockfile = lock_overlay(self.location)
+        try:
+            self.root = _sibling(self.location, 'stage')
+            # left behind by a run killed outright; we hold the lock, so it's nobody's
+            shutil.rmtree(self.root, ignore_errors=True)
+            with metrics.phase('overlay_stage'):
+                mode = None
+                if os.path.isdir(self.location):
+                    mode = stat.S_IMODE(os.stat(self.location).st_mode)
+                    os.mkdir(self.root, mode)
+                    metrics.set_count('staged_links', _link_tree(self.location, self.root, self.owner))
+                else:
+                    os.mkdir(self.root)
+                if self.owner is not None:
+                    os.chown(self.root, *self.owner)
+                if mode is not None:
+                    os.chmod(self.root, mode)
+        except Exception:
+            self.__exit__(None, None, None)
+            raise
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        if self.root is not None:
+            shutil.rmtree(self.root, ignore_errors=True)
+            self.root = None
+        if self._lockfile is not None:
+            self._lockfile.close()
+            self._lockfile = None
+        return False
+
+    def changed(self, path):
+        '''
+        Notes that the file at path (relative to the stage root) was written
+        or removed, so must be synced before the stage is published.
+        '''
+        self._changed.add(path)
+
+    @property
+    def dirty(self):
+        return bool(self._changed)
+
+    @trace
+    def publish(self, jobs=None):
+        '''
+        Syncs the changed files (on a pool of jobs threads) and their
+        directories to disk and atomically replaces the published overlay
+        with the stage.  Returns the path of the new generation.
+        '''
+        with metrics.phase('overlay_publish'):
+            files = []
+            dirs = set([''])
+            for path in self._changed:
+                if os.path.isfile(os.path.join(self.root, path)):
+                    files.append(path)
+                path = os.path.dirname(path)
+                while path not in dirs:
+                    dirs.add(path)
+                    path = os.path.dirname(path)
+            # fsync one at a time is dominated by latency, so overlap them
+            with ThreadPoolExecutor(max_workers=jobs or os.cpu_count() or 1) as pool:
+                list(pool.map(_fsync, [os.path.join(self.root, path) for path in files]))
+                # (less any package directories emptied and removed)
+                list(pool.map(_fsync, [os.path.join(self.root, path) for path in dirs
+                    if os.path.isdir(os.path.join(self.root, path))]))
+            metrics.set_count('synced_files', len(files))
+
+            gens = generations(self.location)
+            n = max(gens) + 1 if gens else 1
+            if os.path.isdir(self.location) and not os.path.islink(self.location):
+                # an overlay from before generations: it becomes one (briefly
+                # leaving the location empty; this happens only once)
+                gens[n] = _sibling(self.location, n)
+                os.rename(self.location, gens[n])
+                n += 1
+            gens[n] = _sibling(self.location, n)
+            os.rename(self.root, gens[n])
+            self.root = None
+
+            link = _sibling(self.location, 'link')
+            try:
+                os.unlink(link)
+            except OSError as e:
+                if e.errno != errno.ENOENT:
+                    raise
+            os.symlink(os.path.basename(gens[n]), link)
+            os.rename(link, self.location)
+            _fsync(os.path.dirname(self.location))
+
+            for old in sorted(gens)[:-KEEP_GENERATIONS]:
+                shutil.rmtree(gens[old], ignore_errors=True)
+        return gens[n]
@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+#-*- coding:utf-8 -*-
+# vim:ai:sta:et:ts=4:sw=4:sts=4
+
+"""kernelng 0.x
+ Tool for maintaining customized overlays of kernel-ng.eclass-based ebuilds
+
+Copyright 2005-2014 Gentoo Foundation
+
+        Copyright (C) 2014 Gregory M. Turner <gmt@be-evil.net>
+
+Distributed under the terms of the GNU General Public License v2
+ This program is free software; you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, version 2 of the License.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program; if not, write to the Free Software
+ Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA 02110-1301, USA.
+
+"""
+
+import os
+import sys
+import time
+
+from .output import echov, kngstyle
+
+# --startup-report: measures what it costs to get kernelng off the ground.  The
+# measurements are taken in fresh interpreters (using python's own -X importtime
+# instrumentation) so that they reflect a cold start and not whatever the current
+# process happens to have imported already.
+
+# the console entry point (see setup.py), then the command tree it runs
+# in-process when there is no "kernelng serve" server to forward to
+STARTUP_MODULES = ('kernelng.client', 'kernelng.scripts.kernelng')
+HEAVY_MODULES = ('portage', 'wrapt')
+HELP_TARGET_MS = 100.0
+REPORT_ROWS = 15
+
+def _child_env():
+    env = os.environ.copy()
+    # make sure the child imports this very copy of kernelng
+    topdir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env['PYTHONPATH'] = os.pathsep.join(
+        p for p in (topdir, env.get('PYTHONPATH')) if p)
+    return env
+
+def parse_importtime(text):
+    '''
+    Parses the stderr of "python -X importtime" into a list of
+    (module, depth, self_us, cumulative_us) tuples, in import order.
+    '''
+    rows = []
+    for line in text.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        fields = line[len('import time:'):].split('|')
+        if len(fields) != 3:
+            continue
+        try:
+            self_us = int(fields[0])
+            cumulative_us = int(fields[1])
+        except ValueError:
+            # the header line
+            continue
+        name = fields[2].rstrip()
+        stripped = name.lstrip(' ')
+        rows.append((stripped, (len(name) - len(stripped) - 1) // 2, self_us, cumulative_us))
+    return rows
+
+def measure_imports(modules=STARTUP_MODULES):
+    '''
+    Imports modules in a fresh interpreter and returns the parse_importtime
+    rows, along with the list of HEAVY_MODULES which ended up imported.  (An
+    import which failed shows up in the rows all the same, but not in
+    sys.modules, and so not in that list.)
+    '''
+    import subprocess
+    code = '; '.join(['import sys'] + ['import %s' % module for module in modules] +
+        ['print(" ".join(m for m in %r if m in sys.modules))' % (HEAVY_MODULES,)])
+    proc = subprocess.Popen([sys.executable, '-X', 'importtime', '-c', code],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=_child_env(),
+        universal_newlines=True)
+    out, err = proc.communicate()
+    return parse_importtime(err), out.split()
+
+def measure_help(runs=3):
+    '''
+    Returns the best-of-runs wall-clock time, in milliseconds, of a cold
+    "kernelng -h" (interpreter startup included).
+    '''
+    import subprocess
+    code = 'import sys; sys.argv = ["kernelng", "-h"]; from kernelng.client import main; main()'
+    best = None
+    with open(os.devnull, 'w') as devnull:
+        for run in range(runs):
+            started = time.time()
+            subprocess.call([sys.executable, '-c', code], stdout=devnull,
+                stderr=devnull, env=_child_env())
+            elapsed = (time.time() - started) * 1000.0
+            best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def _heading(text):
+    return kngstyle(text, fg='cyan', bold=True)
+
+def _row(name, ms, width=40):
+    return '  %-*s %9.1f ms' % (width, name, ms)
+
+def startup_report(ctx, param, value):
+    '''
+    click callback implementing the --startup-report option.
+    '''
+    if not value or ctx.resilient_parsing:
+        return
+    rows, heavy = measure_imports()
+    total_us = sum(row[2] for row in rows)
+
+    packages = {}
+    for name, depth, self_us, cumulative_us in rows:
+        top = name.split('.', 1)[0]
+        packages[top] = packages.get(top, 0) + self_us
+
+    echov(_heading('Import time by top-level package') +
+        ' (%.1f ms in %d modules):' % (total_us / 1000.0, len(rows)), 0)
+    for top, self_us in sorted(packages.items(), key=lambda item: -item[1])[:REPORT_ROWS]:
+        echov(_row(top, self_us / 1000.0), 0)
+
+    echov('', 0)
+    echov(_heading('Slowest modules') + ' (cumulative, including their own imports):', 0)
+    for name, depth, self_us, cumulative_us in sorted(rows, key=lambda row: -row[3])[:REPORT_ROWS]:
+        echov(_row(name, cumulative_us / 1000.0), 0)
+
+    if heavy:
+        echov('', 0)
+        echov('%s imported at startup: %s' % (
+            kngstyle('WARNING', fg='red', bold=True), ', '.join(heavy)), 0)
+
+    help_ms = measure_help()
+    echov('', 0)
+    echov('%s %.1f ms (target: %.0f ms)' % (_heading('Cold "kernelng -h":'), help_ms,
+        HELP_TARGET_MS), 0)
+    ctx.exit()
@@ -32,6 +32,8 @@ Distributed under the terms of the GNU General Public License v2
 
 from __future__ import print_function
 
+import os
+
 _string_types=None
 
 def _init_stringtypes():
@@ -57,3 +59,14 @@ if _string_types is None:
 def is_string(thing):
     return isinstance(thing, _string_types)
 
+def file_stamp(path):
+    '''
+    Returns the (device, inode, size, mtime_ns) of the file at path, which
+    changes whenever the file is replaced or modified, or None if there is
+    no such file.
+    '''
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
@@ -6,7 +6,9 @@ from __future__ import print_function
 
 import re
 import sys
+import subprocess
 from setuptools import setup, Command, find_packages
+from setuptools.command.build_py import build_py
 from distutils import log
 
 import os
@@ -71,6 +73,105 @@ class set_version(Command):
         man_re = r'(?<=^.TH "kernelng" "8" )' + quote + '[^\'"]*' + quote
         sub(manpage, man_re)
 
+WIDTH_TABLE = 'kernelng/kngwidthtable.py'
+
+WIDTH_TABLE_HEADER = """# vim:ai:sta:et:ts=4:sw=4:sts=4
+# Generated by "python setup.py build_width_table" from the unicodedata of
+# python %(pyversion)s -- do not edit.  Used by kernelng.kngtextwrapper.
+
+# Terminal display width of every code point, as runs: code points from
+# WIDTH_STARTS[i] up to (but not including) WIDTH_STARTS[i + 1] are each
+# WIDTH_VALUES[i] columns wide.  Wide and fullwidth east-asian characters are
+# 2, combining marks, format characters and hangul medial/final jamo 0.
+# Unassigned code points are 1, save in the blocks reserved for CJK ideographs.
+
+UNICODE_VERSION = '%(unidata_version)s'
+
+"""
+
+UNASSIGNED_WIDE = ((0x3400, 0x4dbf), (0x4e00, 0x9fff), (0xf900, 0xfaff),
+    (0x20000, 0x2fffd), (0x30000, 0x3fffd))
+
+def char_width(cp):
+    import unicodedata
+    ch = chr(cp)
+    if 0x1160 <= cp <= 0x11ff:
+        return 0
+    category = unicodedata.category(ch)
+    if category in ('Mn', 'Me') or (category == 'Cf' and cp != 0xad):
+        return 0
+    if category == 'Cn':
+        # unassigned: wide only where the east-asian width default says so
+        return 2 if any(start <= cp <= end for start, end in UNASSIGNED_WIDE) else 1
+    if unicodedata.east_asian_width(ch) in ('W', 'F'):
+        return 2
+    return 1
+
+def width_table_text():
+    import unicodedata
+    starts = []
+    values = []
+    for cp in range(sys.maxunicode + 1):
+        width = char_width(cp)
+        if not values or values[-1] != width:
+            starts.append(cp)
+            values.append(width)
+    def tuple_text(name, items, fmt, per_line):
+        lines = ['%s = (' % name]
+        for i in range(0, len(items), per_line):
+            lines.append('    ' + ' '.join(fmt % item + ',' for item in items[i:i + per_line]))
+        lines.append(')')
+        return '\n'.join(lines) + '\n'
+    return ''.join((
+        WIDTH_TABLE_HEADER % {
+            'pyversion': '.'.join(str(v) for v in sys.version_info[:3]),
+            'unidata_version': unicodedata.unidata_version},
+        tuple_text('WIDTH_STARTS', starts, '0x%05x', 8), '\n',
+        tuple_text('WIDTH_VALUES', values, '%d', 24)))
+
+class build_width_table(Command):
+    """Regenerate the display-width table from python's unicodedata."""
+    description = "regenerate %s from python's unicodedata" % WIDTH_TABLE
+    user_options = []
+
+    def initialize_options (self):
+        pass
+    def finalize_options (self):
+        pass
+    def run(self):
+        log.info('writing %s' % WIDTH_TABLE)
+        with io.open(os.path.join(cwd, WIDTH_TABLE), 'w', encoding='utf_8') as f:
+            f.write(width_table_text())
+
+# the shell-completion index of the kernelng being built, installed (as a data
+# file) alongside the completion functions, which read it
+COMPLETION_INDEX = os.path.join('build', 'completion-index')
+
+def completion_index_text(build_lib):
+    env = dict(os.environ, KERNELNG_NO_SERVER='1', KERNELNG_NO_HELP_CACHE='1',
+        PYTHONPATH=os.pathsep.join([os.path.abspath(build_lib)] +
+            [p for p in [os.environ.get('PYTHONPATH')] if p]))
+    return subprocess.check_output([sys.executable, '-m', 'kernelng.scripts.kernelng',
+        'completion'], env=env).decode('utf_8')
+
+class kng_build_py(build_py):
+    """build_py, additionally (re)generating the display-width table in the build
+    directory from the unicodedata of the python doing the building, and the
+    shell-completion index from the command tree just built."""
+    def run(self):
+        build_py.run(self)
+        target = os.path.join(self.build_lib, WIDTH_TABLE)
+        log.info('generating %s' % target)
+        with io.open(target, 'w', encoding='utf_8') as f:
+            f.write(width_table_text())
+        target = os.path.join(cwd, COMPLETION_INDEX)
+        log.info('generating %s' % target)
+        text = completion_index_text(self.build_lib)
+        if not os.path.isdir(os.path.dirname(target)):
+            os.makedirs(os.path.dirname(target))
+        with io.open(target, 'w', encoding='utf_8') as f:
+            f.write(text)
+
 # def load_test():
 #     """Only return the real test class if it's actually being run so that we
 #     don't depend on snakeoil just to install."""
@@ -113,10 +214,17 @@ setup(
     include_package_data=True,
     data_files=(
         (os.path.join(os.sep, EPREFIX.lstrip(os.sep), 'usr/share/man/man8'), ['kernelng.8']),
+        (os.path.join(os.sep, EPREFIX.lstrip(os.sep), 'usr/share/bash-completion/completions'),
+            ['completion/kernelng']),
+        (os.path.join(os.sep, EPREFIX.lstrip(os.sep), 'usr/share/zsh/site-functions'),
+            ['completion/_kernelng']),
+        (os.path.join(os.sep, EPREFIX.lstrip(os.sep), 'usr/share/kernel-ng'), [COMPLETION_INDEX]),
     ),
     cmdclass={
         # 'test': load_test(),
         'set_version': set_version,
+        'build_width_table': build_width_table,
+        'build_py': kng_build_py,
     },
     install_requires=[
         'Click',
@@ -125,6 +233,6 @@ setup(
     ],
     entry_points='''
         [console_scripts]
-        kernelng=kernelng.scripts.kernelng:cli
+        kernelng=kernelng.client:main
     ''',
 )
@@ -0,0 +1,38 @@
+"""Checks how the client decides which command lines stay local.
+
+kernelng.client must not import click, so it keeps its own list of the global
+options which take a separate value; these tests keep that list in step with
+the options the command tree actually has.  Run from the top of the source
+tree:
+
+    python -m pytest tests
+"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from kernelng.client import VALUE_OPTIONS, top_level_command
+
+@pytest.mark.parametrize('args, command', [
+    (['serve'], 'serve'),
+    (['-v', '--debug', 'serve'], 'serve'),
+    (['--log-format', 'jsonl', 'serve'], 'serve'),
+    (['--metrics-file=/tmp/x.prom', 'serve'], 'serve'),
+    (['--log-format', 'serve', 'config'], 'config'),
+    (['config', 'example', '--debug', 'serve'], 'config'),
+    (['-q'], None),
+])
+def test_top_level_command(args, command):
+    assert top_level_command(args) == command
+
+def test_value_options_match_the_command_tree():
+    from kernelng.scripts.kernelng import cli
+    taking_values = set()
+    for param in cli.params:
+        if not getattr(param, 'is_flag', True) and param.nargs == 1:
+            taking_values.update(param.opts)
+    assert taking_values == VALUE_OPTIONS
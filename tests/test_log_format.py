@@ -0,0 +1,35 @@
+"""Checks that --log-format only affects diagnostics, never data output.
+
+Runs kernelng in a subprocess (bypassing any "kernelng serve" server) once
+per log format and compares what the data-producing commands print.  Run
+from the top of the source tree:
+
+    python -m pytest tests
+"""
+
+import os
+import sys
+import subprocess
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from kernelng.output import LOG_FORMATS
+
+TOP = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def kernelng(*args):
+    env = dict(os.environ, KERNELNG_NO_SERVER='1', KERNELNG_NO_HELP_CACHE='1',
+        PYTHONPATH=os.pathsep.join([TOP] + [p for p in [os.environ.get('PYTHONPATH')] if p]))
+    proc = subprocess.run([sys.executable, '-m', 'kernelng.scripts.kernelng'] + list(args),
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env, cwd=TOP)
+    assert proc.returncode == 0, proc.stderr
+    return proc.stdout
+
+@pytest.mark.parametrize('command', [('config', 'example'), ('completion',)])
+def test_data_output_independent_of_log_format(command):
+    outputs = dict((fmt, kernelng('--log-format', fmt, *command)) for fmt in LOG_FORMATS)
+    assert outputs['text']
+    for fmt, output in outputs.items():
+        assert output == outputs['text'], fmt